@@ -0,0 +1,321 @@
+"""Benchmark station scraping and CSV downloads end to end against a local server.
+
+Starts the SINCA stand-in from benchmarks.sinca_server in its own process, then
+runs the station and download stages in child processes inside a scratch
+directory, so each one starts cold and reports its own peak RSS. The whole run
+is repeated and the median of every metric is compared against a baseline file;
+the run exits with status 1 when any metric regressed.
+
+The numbers depend on the machine, so the baseline records the machine it was
+measured on. Runs on another machine, or with another configuration, exit with
+status 2 until a baseline is recorded for them with --update-baseline.
+
+    python -m benchmarks.bench_end_to_end
+    python -m benchmarks.bench_end_to_end --update-baseline
+
+Request pacing is lifted for the local server; the concurrency caps stay as
+configured in common/scheduler.py.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import re
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.sinca_server import CONTAMINANTS, STATIONS_PER_REGION
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(REPO_DIR, "benchmarks", "baseline.json")
+STAGES = ("stations", "downloads")
+DOWNLOAD_PERIOD = "diario"
+# Runs whose median is reported, and the fewest compared against the baseline;
+# the latencies of a single run swing by more than their tolerance
+REPEATS = 3
+
+# Metrics compared against the baseline, whether higher values are better and
+# the relative change allowed before they count as a regression. Per-task
+# latencies of a few milliseconds swing more between runs than totals do.
+METRICS = {
+    "tasks_per_second": (True, 0.25),
+    "p50_seconds": (False, 0.5),
+    "p95_seconds": (False, 0.5),
+    "peak_rss_mb": (False, 0.25),
+    "wall_seconds": (False, 0.25),
+}
+
+
+def get_percentile(values, fraction):
+    """Nearest-rank percentile of values"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def get_peak_rss():
+    """Peak RSS of this process in bytes.
+
+    On Linux ru_maxrss keeps the high-water mark of the parent carried over by
+    fork, so VmHWM, which starts again at exec, is read instead.
+    """
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            match = re.search(r"^VmHWM:\s+(\d+) kB", f.read(), re.MULTILINE)
+        if match:
+            return int(match.group(1)) * 1024
+    except FileNotFoundError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+def start_server_process(stations, contaminants, latency):
+    """Start the stand-in in its own process, so neither its memory nor its GIL
+    is shared with the benchmark. Returns the process and its base URL."""
+    command = [sys.executable, "-u", "-m", "benchmarks.sinca_server", "--port", "0"]
+    command += ["--stations", str(stations), "--latency", str(latency)]
+    command += ["--contaminants", *contaminants]
+    process = subprocess.Popen(command, cwd=REPO_DIR, stdout=subprocess.PIPE, text=True)
+    # The server prints its URL once it is listening
+    line = process.stdout.readline()
+    match = re.search(r"http://\S+", line)
+    if not match:
+        process.kill()
+        raise RuntimeError(f"The SINCA stand-in did not start: {line!r}")
+    return process, match.group(0)
+
+
+def run_stage(stage):
+    """Run one stage in this process and return its raw measurements"""
+    from common import scheduler
+
+    scheduler.REQUESTS_PER_SECOND = 1e6
+    scheduler.RATE_BURST = 1e6
+
+    from common.catalog import StationCatalog
+
+    latencies = []
+    start = time.perf_counter()
+
+    with StationCatalog() as catalog:
+        if stage == "stations":
+            from get_all_stations_data import mapaRegionUrls, run_regions
+
+            completed = asyncio.run(run_regions(catalog, latencies))
+            failed = len(mapaRegionUrls) - len(completed)
+            catalog.export_json()
+        else:
+            import download_csv
+            from common.manifest import DownloadManifest
+            from common.web_scraping import CSV_CONTAMINANTS_DIR
+
+            os.makedirs(CSV_CONTAMINANTS_DIR, exist_ok=True)
+            tasks = download_csv.build_tasks(catalog, DOWNLOAD_PERIOD)
+            manifest = DownloadManifest()
+            _, failed = asyncio.run(
+                download_csv.run_downloads(tasks, manifest, latencies)
+            )
+            if download_csv.WRITE_PARQUET:
+                download_csv.write_parquet_dataset(tasks, manifest)
+
+    wall = time.perf_counter() - start
+    peak_rss = get_peak_rss()
+
+    return {
+        "latencies": latencies,
+        "failed": failed,
+        "wall_seconds": wall,
+        "peak_rss": peak_rss,
+    }
+
+
+def run_stage_process(stage, work_dir, host):
+    """Run a stage in a child process and summarize its measurements"""
+    output_path = os.path.join(work_dir, f"{stage}_result.json")
+    env = dict(os.environ, SINCA_HOST=host, PYTHONPATH=REPO_DIR)
+    command = [sys.executable, "-m", "benchmarks.bench_end_to_end"]
+    command += ["--stage", stage, "--output", output_path]
+
+    completed = subprocess.run(
+        command,
+        cwd=work_dir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Stage {stage} failed:\n{completed.stderr}")
+
+    with open(output_path, "r", encoding="utf-8") as f:
+        result = json.load(f)
+    # Failing tasks finish fast, a run with failures says nothing about speed
+    if result["failed"]:
+        raise RuntimeError(f"Stage {stage} had {result['failed']} failed tasks")
+
+    latencies = result["latencies"]
+    return {
+        "tasks": len(latencies),
+        "tasks_per_second": len(latencies) / result["wall_seconds"],
+        "p50_seconds": get_percentile(latencies, 0.50),
+        "p95_seconds": get_percentile(latencies, 0.95),
+        "peak_rss_mb": result["peak_rss"] / (1024 * 1024),
+        "wall_seconds": result["wall_seconds"],
+    }
+
+
+def get_median_results(runs):
+    """Median of every metric of every stage over several runs"""
+    return {
+        stage: {
+            metric: statistics.median(run[stage][metric] for run in runs)
+            for metric in runs[0][stage]
+        }
+        for stage in STAGES
+    }
+
+
+def get_machine():
+    """Description of the machine, baselines are only valid on the one that
+    recorded them"""
+    return {
+        "system": platform.system(),
+        "processor": platform.machine(),
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+    }
+
+
+def compare_to_baseline(results, baseline, tolerance=None):
+    """Get a description of every metric worse than the baseline by more than
+    its tolerance, or than tolerance for all metrics when given"""
+    regressions = []
+    for stage, metrics in results.items():
+        for metric, (higher_is_better, metric_tolerance) in METRICS.items():
+            expected = baseline.get(stage, {}).get(metric)
+            if not expected:
+                continue
+            allowed = metric_tolerance if tolerance is None else tolerance
+            change = (metrics[metric] - expected) / expected
+            if (-change if higher_is_better else change) > allowed:
+                regressions.append(
+                    f"{stage} {metric}: {metrics[metric]:.4f} vs baseline "
+                    f"{expected:.4f} ({change:+.0%}, {allowed:.0%} allowed)"
+                )
+    return regressions
+
+
+def print_results(results):
+    print(
+        f"{'stage':<10} {'tasks':>6} {'tasks/s':>9} {'p50 s':>8} {'p95 s':>8} "
+        f"{'rss MB':>8} {'wall s':>8}"
+    )
+    for stage, m in results.items():
+        print(
+            f"{stage:<10} {m['tasks']:>6} {m['tasks_per_second']:>9.2f} "
+            f"{m['p50_seconds']:>8.4f} {m['p95_seconds']:>8.4f} "
+            f"{m['peak_rss_mb']:>8.1f} {m['wall_seconds']:>8.2f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stations", type=int, default=STATIONS_PER_REGION)
+    parser.add_argument("--contaminants", nargs="+", default=CONTAMINANTS)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=REPEATS,
+        help=f"Runs whose median is reported, at least {REPEATS}",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        help="Relative change allowed for every metric, instead of the per-metric ones",
+    )
+    # Internal: run a single stage and write its measurements to --output
+    parser.add_argument("--stage", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--output", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        # The parent discards this process' stdout, where every task is logged
+        result = run_stage(args.stage)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f)
+        return 0
+
+    if args.repeats < REPEATS:
+        parser.error(f"--repeats must be at least {REPEATS}")
+
+    config = {
+        "stations": args.stations,
+        "contaminants": args.contaminants,
+        "latency": args.latency,
+        "period": DOWNLOAD_PERIOD,
+        "machine": get_machine(),
+    }
+    server, host = start_server_process(args.stations, args.contaminants, args.latency)
+
+    try:
+        runs = []
+        for _ in range(args.repeats):
+            results = {}
+            with tempfile.TemporaryDirectory(prefix="sinca_bench_") as work_dir:
+                for stage in STAGES:
+                    results[stage] = run_stage_process(stage, work_dir, host)
+            runs.append(results)
+    finally:
+        server.terminate()
+        server.wait()
+
+    results = get_median_results(runs)
+
+    print_results(results)
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"config": config, **results}, f, indent=4)
+            f.write("\n")
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}, run with --update-baseline")
+        return 2
+
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("config") != config:
+        print(
+            f"\nBaseline was recorded with {baseline.get('config')}, not with "
+            f"{config}. Run with --update-baseline to record this configuration."
+        )
+        return 2
+
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+    if regressions:
+        print("\nREGRESSIONS (worse than baseline by more than allowed):")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+
+    print(f"\nNo regressions against {args.baseline}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
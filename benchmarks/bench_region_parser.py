@@ -0,0 +1,74 @@
+"""Benchmark region page parsing and station indexing on synthetic pages.
+
+Builds region pages with a growing number of contaminant links and reports the
+time per link, which stays flat when parsing and indexing scale linearly.
+
+    python -m benchmarks.bench_region_parser
+"""
+
+import contextlib
+import io
+import math
+import time
+
+from get_all_stations_data import parseRegionStations
+
+REGION_URL = "https://sinca.mma.gob.cl/index.php/region/index/id/M"
+CONTAMINANTS = ["PM10", "PM25", "0001", "0003", "0004", "0008", "0NOX", "0002"]
+LINK_COUNTS = [1000, 2000, 4000, 8000, 16000]
+REPEATS = 3
+
+
+def build_region_page(number_links):
+    """Build a region page with number_links contaminant links"""
+    number_stations = max(1, number_links // len(CONTAMINANTS))
+    rows = []
+    for i in range(number_stations):
+        links = "".join(
+            f'<td><a href="/cgi-bin/APUB-MMA/apub.htmlindico2.cgi?page=pageRight'
+            f"&header=Estacion%20{i}&macropath=./RM/S{i}/Cal/{code}"
+            f'&macro={code}.diario.diario&from=970101&to=250101&">{code}</a></td>'
+            for code in CONTAMINANTS
+        )
+        rows.append(
+            f'<tr><td><a href="/index.php/estacion/index/id/{i}">Estacion {i}</a>'
+            f'<span title="en línea"></span></td>{links}</tr>'
+        )
+
+    return (
+        '<table id="tablaRegional">'
+        f'<caption id="tableRows">Estaciones: {number_stations}</caption>'
+        f"<tbody>{''.join(rows)}</tbody></table>"
+    )
+
+
+def time_parse(html):
+    """Best wall time of parsing a page, with the per-link logging silenced"""
+    best = None
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            parseRegionStations(html, REGION_URL)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    results = []
+    print(f"{'links':>8} {'seconds':>10} {'us/link':>10}")
+    for number_links in LINK_COUNTS:
+        elapsed = time_parse(build_region_page(number_links))
+        results.append((number_links, elapsed))
+        print(
+            f"{number_links:>8} {elapsed:>10.4f} {elapsed / number_links * 1e6:>10.2f}"
+        )
+
+    # Slope of log(time) against log(links): 1.0 is linear, 2.0 quadratic
+    (first_links, first_time), (last_links, last_time) = results[0], results[-1]
+    exponent = math.log(last_time / first_time) / math.log(last_links / first_links)
+    print(f"\nScaling exponent: {exponent:.2f}")
+
+
+if __name__ == "__main__":
+    main()
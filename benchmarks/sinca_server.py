@@ -0,0 +1,202 @@
+"""Local stand-in for the SINCA site, serving synthetic pages and CSV exports.
+
+Serves the region index pages, the apub.htmlindico2.cgi graph pages and the CSV
+exports they link to, with the same markup the scrapers look for. Content is
+generated deterministically from the region, station and contaminant in the URL.
+
+    python -m benchmarks.sinca_server --port 8000
+    SINCA_HOST=http://127.0.0.1:8000 python get_all_stations_data.py
+"""
+
+import argparse
+import random
+import threading
+import time
+from datetime import date, timedelta
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, urlsplit
+
+from get_all_stations_data import regiones
+
+STATIONS_PER_REGION = 8
+CONTAMINANTS = ["PM10", "PM25", "0003", "0008"]
+FROM_DATE = "090101"
+TO_DATE = "250101"
+LATENCY = 0.0  # seconds added to every response
+
+CSV_HEADER = (
+    "FECHA (YYMMDD);HORA (HHMM);Registros validados;Registros preliminares;"
+    "Registros no validados;\r\n"
+)
+GRAPH_PATH = "/cgi-bin/APUB-MMA/apub.htmlindico2.cgi"
+EXPORT_PATH = "/cgi-bin/APUB-MMA/export.cgi"
+REGION_PATH = "/index.php/region/index/id/"
+
+
+def get_station_key(region, number):
+    return f"S{regiones.index(region):02d}{number:02d}"
+
+
+def build_region_page(region, stations_per_region, contaminants):
+    """Region page with a #tablaRegional row per station"""
+    rows = []
+    for number in range(stations_per_region):
+        station_key = get_station_key(region, number)
+        name = f"Estacion {region} {number}"
+        links = "".join(
+            f'<td><a href="{GRAPH_PATH}?page=pageRight&header={quote(name)}'
+            f"&macropath=./R{region}/{station_key}/Cal/{code}"
+            f"&macro={code}.diario.diario&from={FROM_DATE}&to={TO_DATE}&"
+            f'">{code}</a></td>'
+            for code in contaminants
+        )
+        rows.append(
+            f'<tr><td><a href="/index.php/estacion/index/id/{station_key[1:]}">{name}</a>'
+            f'<span title="en línea"></span><span title="estación pública"></span>'
+            f"</td>{links}</tr>"
+        )
+
+    return (
+        "<html><body>"
+        '<table id="tablaRegional">'
+        f'<caption id="tableRows">Estaciones: {stations_per_region}</caption>'
+        "<thead><tr><th>Estación</th></tr></thead>"
+        f"<tbody>{''.join(rows)}</tbody></table></body></html>"
+    )
+
+
+def build_graph_page(query):
+    """Graph page linking to the CSV export of the same series"""
+    return (
+        "<html><body><table><tbody><tr><td>"
+        "<table></table><table></table><table><tbody><tr><td><label>"
+        f'<span class="icon-file-excel"><a href="{EXPORT_PATH}?{query}">CSV</a></span>'
+        "</label></td></tr></tbody></table>"
+        "</td></tr></tbody></table></body></html>"
+    )
+
+
+def parse_date(yymmdd):
+    year = int(yymmdd[:2])
+    year += 1900 if year >= 69 else 2000
+    return date(year, int(yymmdd[2:4]), int(yymmdd[4:6]))
+
+
+@lru_cache(maxsize=64)
+def get_export_days(from_date, to_date, step):
+    """Get the YYMMDD date of every row of an export and whether it is recent.
+
+    Shared by all the exports of a date range, so the server doesn't spend its
+    time formatting dates: a daily export has thousands of rows and the
+    benchmark should measure the client, not this server.
+    """
+    days = []
+    day = parse_date(from_date)
+    end = parse_date(to_date)
+    while day <= end:
+        # Older data is validated, the most recent only preliminary
+        days.append((day.strftime("%y%m%d"), end - day <= timedelta(days=180)))
+        day += timedelta(days=step)
+    return tuple(days)
+
+
+@lru_cache(maxsize=256)
+def build_export(macro, from_date, to_date):
+    """CSV export with one row per day, quarter or year between the dates"""
+    period = macro.split(".")[-2] if macro.count(".") >= 2 else "diario"
+    step = {"diario": 1, "trimestral": 91, "anual": 365}.get(period, 1)
+    rng = random.Random(macro)
+    uniform = rng.uniform
+    random_value = rng.random
+
+    lines = [CSV_HEADER]
+    for day, recent in get_export_days(from_date, to_date, step):
+        value = f"{uniform(0, 150):.2f}".replace(".", ",")
+        if random_value() <= 0.03:
+            lines.append(f"{day};;;;;\r\n")
+        elif recent:
+            lines.append(f"{day};;;{value};;\r\n")
+        else:
+            lines.append(f"{day};;{value};;;\r\n")
+    return "".join(lines).encode("latin-1")
+
+
+class SincaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, body, content_type, status=200):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if url.path.startswith(REGION_PATH):
+            region = url.path[len(REGION_PATH) :]
+            if region in regiones:
+                page = build_region_page(
+                    region, self.server.stations_per_region, self.server.contaminants
+                )
+                return self._send(page.encode("utf-8"), "text/html; charset=utf-8")
+
+        elif url.path == GRAPH_PATH:
+            page = build_graph_page(url.query)
+            return self._send(page.encode("utf-8"), "text/html; charset=utf-8")
+
+        elif url.path == EXPORT_PATH:
+            body = build_export(
+                params.get("macro", ""),
+                params.get("from", FROM_DATE),
+                params.get("to", TO_DATE),
+            )
+            return self._send(body, "text/csv; charset=latin-1")
+
+        self._send(b"<html>Not found</html>", "text/html", status=404)
+
+
+def start_server(
+    port=0,
+    stations_per_region=STATIONS_PER_REGION,
+    contaminants=CONTAMINANTS,
+    latency=LATENCY,
+):
+    """Start the server in a background thread and return it; its URL is
+    http://127.0.0.1:{server.server_port}"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), SincaHandler)
+    server.daemon_threads = True
+    server.stations_per_region = stations_per_region
+    server.contaminants = list(contaminants)
+    server.latency = latency
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--stations", type=int, default=STATIONS_PER_REGION)
+    parser.add_argument("--contaminants", nargs="+", default=CONTAMINANTS)
+    parser.add_argument("--latency", type=float, default=LATENCY)
+    args = parser.parse_args()
+
+    server = start_server(args.port, args.stations, args.contaminants, args.latency)
+    print(f"Serving SINCA stand-in at http://127.0.0.1:{server.server_port}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import io
+import os
+from typing import NamedTuple
+
+import numpy as np
+
+from common.atomic_write import atomic_write_bytes
+
+# Periods computed from the daily series and their length in months
+PERIOD_MONTHS = {"trimestral": 3, "anual": 12}
+PERCENTILES = (50, 90, 98)
+
+# 24-hour limits (µg/m³N) of the Chilean primary standards, used to count
+# exceedance days. Contaminants without a daily limit get NaN exceedances.
+DAILY_LIMITS = {"PM10": 130.0, "PM25": 50.0}
+
+
+class PeriodAggregates(NamedTuple):
+    """Statistics of a daily series over quarters or years, one row per period.
+
+    starts (datetime64[s]) first instant of each period, means, counts of days
+    with a value, completeness (counts over the days in the period), exceedances
+    (days above the daily limit, NaN without a limit) and percentiles (one
+    column per PERCENTILES level, NaN for periods without values).
+    """
+
+    starts: np.ndarray
+    means: np.ndarray
+    counts: np.ndarray
+    completeness: np.ndarray
+    exceedances: np.ndarray
+    percentiles: np.ndarray
+
+
+def get_period_months(timestamps, period):
+    """Get the first month of the period of each timestamp, as months since 1970"""
+    months = timestamps.astype("datetime64[M]").astype(np.int64)
+    # Month 0 is January, so quarters start at multiples of 3
+    return months - months % PERIOD_MONTHS[period]
+
+
+def aggregate(series, period, limit=None, percentiles=PERCENTILES):
+    """Aggregate a daily SincaSeries into quarters ("trimestral") or years ("anual").
+
+    Every period with a row in the series gets a row, including periods whose
+    values are all missing. Everything is computed over whole arrays, without a
+    Python loop per period or value.
+    """
+    timestamps = np.asarray(series.timestamps)
+    values = np.asarray(series.values)
+    period_months, inverse = np.unique(
+        get_period_months(timestamps, period), return_inverse=True
+    )
+    size = len(period_months)
+
+    valid = ~np.isnan(values)
+    groups = inverse[valid]
+    values = values[valid]
+
+    counts = np.bincount(groups, minlength=size)
+    sums = np.bincount(groups, weights=values, minlength=size)
+    means = np.full(size, np.nan)
+    np.divide(sums, counts, out=means, where=counts > 0)
+
+    starts = period_months.astype("datetime64[M]")
+    ends = starts + PERIOD_MONTHS[period]
+    days = (ends.astype("datetime64[D]") - starts.astype("datetime64[D]")).astype(
+        np.int64
+    )
+    completeness = counts / days
+
+    if limit is None:
+        exceedances = np.full(size, np.nan)
+    else:
+        exceedances = np.bincount(groups, weights=values > limit, minlength=size)
+
+    # Sort by period and then by value, so each period's values are contiguous
+    # and sorted, then interpolate linearly between closest ranks
+    sorted_values = values[np.lexsort((values, groups))]
+    firsts = np.cumsum(counts) - counts
+    has_values = counts > 0
+    levels = np.full((size, len(percentiles)), np.nan)
+    for i, level in enumerate(percentiles):
+        # Ranks within each period, so a period's result doesn't depend on the
+        # periods before it and incremental updates match full recomputes
+        ranks = (counts - 1).clip(0) * (level / 100)
+        lower_ranks = np.floor(ranks)
+        weight = (ranks - lower_ranks)[has_values]
+        lower = firsts + lower_ranks.astype(np.int64)
+        upper = np.minimum(lower + 1, firsts + counts - 1)
+        lower = lower[has_values]
+        upper = upper[has_values]
+        levels[has_values, i] = sorted_values[lower] + weight * (
+            sorted_values[upper] - sorted_values[lower]
+        )
+
+    return PeriodAggregates(
+        starts.astype("datetime64[s]"),
+        means,
+        counts,
+        completeness,
+        exceedances,
+        levels,
+    )
+
+
+def get_first_change(old_series, new_series):
+    """Get the earliest timestamp whose row differs between two versions of a
+    series, None when they are equal"""
+    size = min(len(old_series.timestamps), len(new_series.timestamps))
+    changed = np.asarray(old_series.timestamps[:size]) != np.asarray(
+        new_series.timestamps[:size]
+    )
+    old_values = np.asarray(old_series.values[:size])
+    new_values = np.asarray(new_series.values[:size])
+    changed |= (old_values != new_values) & ~(
+        np.isnan(old_values) & np.isnan(new_values)
+    )
+    changed |= np.asarray(old_series.flags[:size]) != np.asarray(
+        new_series.flags[:size]
+    )
+
+    first = np.argmax(changed) if changed.any() else size
+    if first < len(new_series.timestamps):
+        return new_series.timestamps[first]
+    if first < len(old_series.timestamps):
+        # Rows were removed at the end
+        return old_series.timestamps[first]
+    return None
+
+
+def update_aggregates(
+    previous, old_series, new_series, period, limit=None, percentiles=PERCENTILES
+):
+    """Bring the aggregates of a series up to date with a new version of it.
+
+    Only the periods from the first changed row onwards are computed again; the
+    aggregates of earlier periods are kept from previous.
+
+    Args:
+        previous (PeriodAggregates): Aggregates of old_series, None for none
+        old_series (SincaSeries): Daily series previous was computed from
+        new_series (SincaSeries): New version of the daily series
+    """
+    if (
+        previous is None
+        or old_series is None
+        or previous.percentiles.shape[1] != len(percentiles)
+    ):
+        return aggregate(new_series, period, limit, percentiles)
+
+    changed_at = get_first_change(old_series, new_series)
+    if changed_at is None:
+        return previous
+
+    period_start = get_period_months(np.array([changed_at]), period)[0]
+    period_start = period_start.astype("datetime64[M]").astype("datetime64[s]")
+    kept = np.searchsorted(previous.starts, period_start, side="left")
+    first_row = np.searchsorted(new_series.timestamps, period_start, side="left")
+
+    tail = type(new_series)(*(array[first_row:] for array in new_series))
+    updated = aggregate(tail, period, limit, percentiles)
+    return PeriodAggregates(
+        *(np.concatenate([old[:kept], new]) for old, new in zip(previous, updated))
+    )
+
+
+def save_aggregates(path, aggregates):
+    buffer = io.BytesIO()
+    np.savez(buffer, **aggregates._asdict())
+    atomic_write_bytes(path, buffer.getvalue())
+
+
+def load_aggregates(path):
+    """Load aggregates saved by save_aggregates, None if the file doesn't exist"""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return PeriodAggregates(*(data[name] for name in PeriodAggregates._fields))
@@ -0,0 +1,28 @@
+import json
+import os
+import threading
+
+
+def atomic_write_bytes(path, data):
+    """Replace path with data atomically.
+
+    The data is written to a temporary file next to path and renamed over it,
+    so an interrupted write never leaves a truncated file and readers that
+    have the old file open or mapped keep seeing it whole.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def atomic_write_json(path, data):
+    """Replace path with data as indented JSON atomically"""
+    text = json.dumps(data, ensure_ascii=False, indent=4)
+    atomic_write_bytes(path, text.encode("utf-8"))
@@ -0,0 +1,265 @@
+import atexit
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows, where the index is not shared between processes
+    fcntl = None
+
+from common.atomic_write import atomic_write_json
+from common.manifest import hash_file
+from common.telemetry import increment
+from common.web_scraping import BLOB_DIR
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# Seconds between index writes while files are being linked; flush() writes the
+# rest at the end of a run
+INDEX_SAVE_INTERVAL = 10.0
+# Blobs linked this recently are kept by garbage collection even when the index
+# doesn't refer to them, since another process may not have saved its index yet
+GC_GRACE_PERIOD = 3600  # seconds
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store():
+    """Get the process-wide blob store, creating it on first use. Its index is
+    flushed when the process exits."""
+    global _store
+
+    with _store_lock:
+        if _store is None:
+            _store = BlobStore()
+            atexit.register(_store.flush)
+    return _store
+
+
+class BlobStore:
+    """Content-addressed store of downloaded files.
+
+    Blobs are named after the sha256 of their content, so a file is stored once
+    however many times it is downloaded. The usual file names stay available as
+    hardlinks to the blobs, or symlinks where hardlinks are not supported, and an
+    index maps each of those names to its hash.
+
+    Blobs are read-only. Writers must replace linked files (write a temporary
+    file and os.replace it) instead of writing them in place.
+
+    Index changes are written at most every INDEX_SAVE_INTERVAL seconds, call
+    flush() once the run is done linking files. Saving merges them into the
+    index on disk under a file lock, so processes sharing the store keep each
+    other's entries.
+    """
+
+    def __init__(self, root=BLOB_DIR):
+        self.root = root
+        self.index_path = os.path.join(root, "index.json")
+        self.tmp_dir = os.path.join(root, "tmp")
+        self._lock = threading.Lock()
+        self.index = {}  # Linked file path -> sha256
+        self._changes = {}  # Linked file path -> sha256, None when unlinked
+        self._saved_at = time.monotonic()
+
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        index = self._read_index()
+        # Garbage collection would delete every blob after losing the index
+        self.index_loaded = index is not None
+        self.index = index or {}
+
+    def _read_index(self):
+        """Read the index on disk, None when it is invalid"""
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path, "r", encoding="utf-8") as f:
+            try:
+                return json.load(f)
+            except json.JSONDecodeError as e:
+                print(f"Ignoring invalid blob index {self.index_path}: {e}")
+                return None
+
+    @contextmanager
+    def _index_lock(self):
+        """Hold the lock of the index file against other processes"""
+        with self._lock, open(f"{self.index_path}.lock", "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def get_blob_path(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def has_blob(self, digest):
+        return os.path.exists(self.get_blob_path(digest))
+
+    def get_hash(self, path):
+        """Get the hash of the blob linked at path, None if it isn't linked"""
+        with self._lock:
+            return self.index.get(os.path.normpath(path))
+
+    def put_stream(self, stream, dest_path, digest=None):
+        """Store the content of a binary stream and link it at dest_path.
+
+        Nothing is written when a blob with the same content exists.
+
+        Args:
+            stream: Readable binary file object positioned at the start
+            dest_path (str): Path where the content is made available
+            digest (str): sha256 of the content when already known
+
+        Returns:
+            str: sha256 of the content
+        """
+        if digest is None:
+            digest = hash_stream(stream)
+            stream.seek(0)
+
+        if not self.has_blob(digest):
+            tmp_path = os.path.join(self.tmp_dir, f"{digest}.{threading.get_ident()}")
+            with open(tmp_path, "wb") as f:
+                shutil.copyfileobj(stream, f, HASH_CHUNK_SIZE)
+            self._add_blob(tmp_path, digest)
+        else:
+            increment("blob_dedup_total")
+
+        self._link(digest, dest_path)
+        return digest
+
+    def put_file(self, path, dest_path=None):
+        """Move a file into the store and link it at dest_path (path by default).
+
+        The file is dropped instead when a blob with the same content exists.
+
+        Returns:
+            str: sha256 of the content
+        """
+        dest_path = dest_path or path
+        digest = hash_file(path)
+
+        if not self.has_blob(digest):
+            self._add_blob(path, digest)
+        else:
+            increment("blob_dedup_total")
+            if os.path.abspath(path) != os.path.abspath(dest_path):
+                os.remove(path)
+
+        self._link(digest, dest_path)
+        return digest
+
+    def _add_blob(self, path, digest):
+        blob_path = self.get_blob_path(digest)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.chmod(path, 0o444)
+        # A move within the file system, a copy across file systems
+        shutil.move(path, blob_path)
+        increment("blob_writes_total")
+
+    def _link(self, digest, dest_path):
+        blob_path = self.get_blob_path(digest)
+        dest_path = os.path.normpath(dest_path)
+
+        linked = os.path.exists(dest_path) and os.path.samefile(dest_path, blob_path)
+        with self._lock:
+            if linked and self.index.get(dest_path) == digest:
+                return
+
+        if not linked:
+            os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
+            tmp_path = f"{dest_path}.link"
+            if os.path.lexists(tmp_path):
+                os.remove(tmp_path)
+            try:
+                os.link(blob_path, tmp_path)
+            except OSError:
+                # Hardlinks need the same file system and support for them
+                target = os.path.relpath(blob_path, os.path.dirname(dest_path) or ".")
+                os.symlink(target, tmp_path)
+            os.replace(tmp_path, dest_path)
+
+        with self._lock:
+            self.index[dest_path] = digest
+            self._changes[dest_path] = digest
+        self._save_if_due()
+
+    def unlink(self, path):
+        """Remove a linked file and its index entry, keeping the blob"""
+        path = os.path.normpath(path)
+        if os.path.lexists(path):
+            os.remove(path)
+        with self._lock:
+            if self.index.pop(path, None):
+                self._changes[path] = None
+        self._save_if_due()
+
+    def collect_garbage(self):
+        """Forget linked files that were deleted and delete the blobs no linked
+        file refers to, except recently linked ones. Nothing is deleted when
+        the index could not be loaded. Returns the number of blobs deleted."""
+        if not self.index_loaded:
+            print(f"Not collecting garbage, {self.index_path} could not be loaded")
+            return 0
+
+        with self._index_lock():
+            index = self._merge()
+            for path in [path for path in index if not os.path.lexists(path)]:
+                del index[path]
+            self._write(index)
+            referenced = set(index.values())
+
+        removed = 0
+        recent = time.time() - GC_GRACE_PERIOD
+        for prefix in os.listdir(self.root):
+            prefix_dir = os.path.join(self.root, prefix)
+            if len(prefix) != 2 or not os.path.isdir(prefix_dir):
+                continue
+            for digest in os.listdir(prefix_dir):
+                blob_path = os.path.join(prefix_dir, digest)
+                # Linking a blob changes its ctime
+                if digest not in referenced and os.stat(blob_path).st_ctime < recent:
+                    os.remove(blob_path)
+                    removed += 1
+        return removed
+
+    def flush(self):
+        """Write the index changes not saved yet"""
+        with self._index_lock():
+            if self._changes:
+                self._write(self._merge())
+
+    def _save_if_due(self):
+        if self._changes and time.monotonic() - self._saved_at >= INDEX_SAVE_INTERVAL:
+            self.flush()
+
+    def _merge(self):
+        """Get the index on disk with the changes of this process applied"""
+        index = self._read_index() or {}
+        for path, digest in self._changes.items():
+            if digest is None:
+                index.pop(path, None)
+            else:
+                index[path] = digest
+        return index
+
+    def _write(self, index):
+        atomic_write_json(self.index_path, index)
+        self.index = index
+        self._changes = {}
+        self._saved_at = time.monotonic()
+
+
+def hash_stream(stream):
+    """Get the sha256 hex digest of a binary stream, read to its end"""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: stream.read(HASH_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,171 @@
+import atexit
+import os
+import threading
+from contextlib import contextmanager
+from multiprocessing.util import Finalize
+
+from common.web_scraping import (
+    BROWSER_MEMORY_LIMIT_MB,
+    get_browser_memory,
+    setup_driver,
+)
+
+DRIVER_MAX_TASKS = 50  # Recycle a driver after this many tasks to bound memory creep
+MAX_DRIVERS = 1  # Drivers per process; one per worker process by default
+
+_config = {
+    "download_dir": None,
+    "max_tasks": DRIVER_MAX_TASKS,
+    "max_drivers": MAX_DRIVERS,
+}
+_idle = []  # (driver, tasks done) pairs ready to be borrowed
+_drivers = set()
+_starting = 0  # Slots reserved for drivers that are being started
+_condition = threading.Condition()
+
+
+def init_worker(
+    download_dir=None, max_tasks=DRIVER_MAX_TASKS, eager=True, max_drivers=MAX_DRIVERS
+):
+    """Pool initializer: configure this worker's drivers and optionally start one now.
+
+    Args:
+        download_dir (str): Base download directory passed to setup_driver
+        max_tasks (int): Number of tasks after which a driver is recycled
+        eager (bool): Start a driver immediately instead of on first borrow
+        max_drivers (int): Maximum number of drivers alive at once in this process
+    """
+    _config["download_dir"] = download_dir
+    _config["max_tasks"] = max_tasks
+    _config["max_drivers"] = max(1, max_drivers)
+
+    # ProcessPoolExecutor workers leave through os._exit, which skips atexit
+    Finalize(None, shutdown_pool, exitpriority=10)
+
+    if eager:
+        _reserve_slot()
+        driver = _start_driver()
+        with _condition:
+            _idle.append((driver, 0))
+            _condition.notify()
+
+
+def is_driver_alive(driver):
+    """Health-check a driver session without navigating"""
+    try:
+        driver.current_url
+        return True
+    except Exception:
+        return False
+
+
+def _reserve_slot():
+    global _starting
+    with _condition:
+        _starting += 1
+
+
+def _start_driver():
+    """Start a driver for a slot already reserved with _reserve_slot"""
+    global _starting
+    try:
+        driver = setup_driver(_config["download_dir"])
+    except Exception:
+        with _condition:
+            _starting -= 1
+            _condition.notify()
+        raise
+
+    with _condition:
+        _starting -= 1
+        _drivers.add(driver)
+    return driver
+
+
+def _quit_driver(driver):
+    with _condition:
+        _drivers.discard(driver)
+        _condition.notify()
+
+    try:
+        driver.quit()
+    except Exception as e:
+        print(f"Error quitting driver: {e}")
+
+    # Remove the driver's download directory if nothing was left behind
+    download_dir = getattr(driver, "download_dir", None)
+    if download_dir and os.path.isdir(download_dir) and not os.listdir(download_dir):
+        os.rmdir(download_dir)
+
+
+def _acquire():
+    """Take an idle driver, or reserve a slot for a new one (returns None)"""
+    global _starting
+    with _condition:
+        while True:
+            if _idle:
+                return _idle.pop()
+            if len(_drivers) + _starting < _config["max_drivers"]:
+                _starting += 1
+                return None, 0
+            _condition.wait()
+
+
+@contextmanager
+def borrow_driver():
+    """Borrow a driver from the pool, starting or recycling it when needed"""
+    driver, tasks = _acquire()
+
+    if driver is not None:
+        recycle = False
+        if tasks >= _config["max_tasks"]:
+            print(f"Recycling driver after {tasks} tasks")
+            recycle = True
+        elif not is_driver_alive(driver):
+            print("Driver session is not responding, recycling it")
+            recycle = True
+        elif BROWSER_MEMORY_LIMIT_MB:
+            memory = get_browser_memory(driver)
+            if memory > BROWSER_MEMORY_LIMIT_MB:
+                print(
+                    f"Recycling driver using {memory:.0f} MB "
+                    f"(limit {BROWSER_MEMORY_LIMIT_MB} MB)"
+                )
+                recycle = True
+
+        if recycle:
+            # Keep the slot while the replacement starts
+            _reserve_slot()
+            _quit_driver(driver)
+            driver = None
+
+    if driver is None:
+        driver, tasks = _start_driver(), 0
+
+    healthy = True
+    try:
+        yield driver
+    except Exception:
+        # Drop crashed sessions right away so the next task gets a fresh one
+        healthy = is_driver_alive(driver)
+        raise
+    finally:
+        if healthy:
+            with _condition:
+                _idle.append((driver, tasks + 1))
+                _condition.notify()
+        else:
+            _quit_driver(driver)
+
+
+def shutdown_pool():
+    """Quit every driver started by this process"""
+    with _condition:
+        drivers = list(_drivers)
+        _idle.clear()
+
+    for driver in drivers:
+        _quit_driver(driver)
+
+
+atexit.register(shutdown_pool)
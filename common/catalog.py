@@ -0,0 +1,311 @@
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+from common.atomic_write import atomic_write_json
+from common.web_scraping import CATALOG_PATH, STATIONS_PATH
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS regions (
+    code TEXT PRIMARY KEY,
+    number_stations TEXT,
+    scraped_at TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS stations (
+    region_code TEXT NOT NULL REFERENCES regions(code) ON DELETE CASCADE,
+    key TEXT NOT NULL,
+    id TEXT,
+    name TEXT NOT NULL,
+    ficha_url TEXT,
+    en_linea INTEGER NOT NULL DEFAULT 0,
+    estacion_meteorologica INTEGER NOT NULL DEFAULT 0,
+    estacion_publica INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (region_code, key)
+);
+CREATE INDEX IF NOT EXISTS stations_key ON stations (key);
+
+CREATE TABLE IF NOT EXISTS station_contaminants (
+    region_code TEXT NOT NULL,
+    station_key TEXT NOT NULL,
+    contaminant_code TEXT NOT NULL,
+    from_date TEXT,
+    to_date TEXT,
+    graph_url TEXT,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (region_code, station_key, contaminant_code),
+    FOREIGN KEY (region_code, station_key)
+        REFERENCES stations(region_code, key) ON DELETE CASCADE
+);
+CREATE INDEX IF NOT EXISTS station_contaminants_contaminant
+    ON station_contaminants (contaminant_code, region_code);
+CREATE INDEX IF NOT EXISTS station_contaminants_updated
+    ON station_contaminants (updated_at);
+"""
+
+# Flags of the station type badges, stored as integer columns
+STATION_FLAGS = ("en_linea", "estacion_meteorologica", "estacion_publica")
+
+
+def get_region_code(region):
+    """Catalog code of a region, accepting both "M" and "RM" """
+    return region if region.startswith("R") else f"R{region}"
+
+
+class StationCatalog:
+    """SQLite catalog of regions, stations and the contaminants they measure.
+
+    Regions are upserted one at a time as they finish scraping, and
+    stations_data.json is exported from it as a derived artifact.
+    """
+
+    def __init__(self, path=CATALOG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def is_empty(self):
+        with self._lock:
+            return not self.connection.execute(
+                "SELECT 1 FROM regions LIMIT 1"
+            ).fetchone()
+
+    def upsert_region(self, region_code, region_data):
+        """Replace the stations of a region with freshly scraped ones.
+
+        A contaminant's updated_at only moves when its date range changes, so
+        updated_since queries return the series that actually grew.
+        """
+        now = datetime.now().isoformat(timespec="seconds")
+        stations = region_data.get("stations", {})
+
+        with self._lock, self.connection:
+            db = self.connection
+            db.execute(
+                """
+                INSERT INTO regions (code, number_stations, scraped_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT (code) DO UPDATE SET
+                    number_stations = excluded.number_stations,
+                    scraped_at = excluded.scraped_at
+                """,
+                (region_code, region_data.get("number_stations"), now),
+            )
+
+            station_keys = []
+            for station_name, station in stations.items():
+                station_keys.append(station["key"])
+                db.execute(
+                    """
+                    INSERT INTO stations (region_code, key, id, name, ficha_url,
+                        en_linea, estacion_meteorologica, estacion_publica)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (region_code, key) DO UPDATE SET
+                        id = excluded.id,
+                        name = excluded.name,
+                        ficha_url = excluded.ficha_url,
+                        en_linea = excluded.en_linea,
+                        estacion_meteorologica = excluded.estacion_meteorologica,
+                        estacion_publica = excluded.estacion_publica
+                    """,
+                    (
+                        region_code,
+                        station["key"],
+                        station.get("id"),
+                        station_name,
+                        station.get("ficha_url"),
+                        *(bool(station.get(flag)) for flag in STATION_FLAGS),
+                    ),
+                )
+
+                contaminants = station.get("contaminants", {})
+                for contaminant_code, dates in contaminants.items():
+                    db.execute(
+                        """
+                        INSERT INTO station_contaminants (region_code, station_key,
+                            contaminant_code, from_date, to_date, graph_url, updated_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT (region_code, station_key, contaminant_code)
+                        DO UPDATE SET
+                            updated_at = CASE
+                                WHEN from_date IS excluded.from_date
+                                    AND to_date IS excluded.to_date
+                                THEN updated_at ELSE excluded.updated_at END,
+                            from_date = excluded.from_date,
+                            to_date = excluded.to_date,
+                            graph_url = excluded.graph_url
+                        """,
+                        (
+                            region_code,
+                            station["key"],
+                            contaminant_code,
+                            dates.get("from_date"),
+                            dates.get("to_date"),
+                            dates.get("graph_url"),
+                            now,
+                        ),
+                    )
+                self._delete_missing(
+                    "station_contaminants",
+                    "contaminant_code",
+                    list(contaminants),
+                    "region_code = ? AND station_key = ?",
+                    (region_code, station["key"]),
+                )
+
+            self._delete_missing(
+                "stations", "key", station_keys, "region_code = ?", (region_code,)
+            )
+
+    def get_date_ranges(self, region_code):
+        """Get the (from_date, to_date) of every contaminant of a region, by
+        (station_key, contaminant_code)"""
+        with self._lock:
+            rows = self.connection.execute(
+                """
+                SELECT station_key, contaminant_code, from_date, to_date
+                FROM station_contaminants WHERE region_code = ?
+                """,
+                (get_region_code(region_code),),
+            ).fetchall()
+        return {
+            (row["station_key"], row["contaminant_code"]): (
+                row["from_date"],
+                row["to_date"],
+            )
+            for row in rows
+        }
+
+    def _delete_missing(self, table, column, kept, where, params):
+        """Delete the rows matching where whose column is not in kept"""
+        placeholders = ", ".join("?" * len(kept))
+        self.connection.execute(
+            f"DELETE FROM {table} WHERE {where} AND {column} NOT IN ({placeholders})",
+            (*params, *kept),
+        )
+
+    def iter_station_contaminants(
+        self, regions=None, contaminants=None, stations=None, updated_since=None
+    ):
+        """Yield (region_code, station_name, station_data, contaminant_code,
+        contaminant_data) matching all the given filters.
+
+        Args:
+            regions (list): Region codes, with or without the "R" prefix
+            contaminants (list): Contaminant codes, like "PM25" or "0003"
+            stations (list): Station names or keys
+            updated_since (str): ISO date or datetime; only contaminants whose date
+                                 range changed since then
+        """
+        conditions = []
+        params = []
+        if regions:
+            codes = [get_region_code(region) for region in regions]
+            conditions.append(f"c.region_code IN ({', '.join('?' * len(codes))})")
+            params.extend(codes)
+        if contaminants:
+            conditions.append(
+                f"c.contaminant_code IN ({', '.join('?' * len(contaminants))})"
+            )
+            params.extend(contaminants)
+        if stations:
+            placeholders = ", ".join("?" * len(stations))
+            conditions.append(
+                f"(s.name IN ({placeholders}) OR s.key IN ({placeholders}))"
+            )
+            params.extend(stations)
+            params.extend(stations)
+        if updated_since:
+            conditions.append("c.updated_at >= ?")
+            params.append(updated_since)
+
+        query = """
+            SELECT s.*, c.contaminant_code, c.from_date, c.to_date, c.graph_url
+            FROM station_contaminants c
+            JOIN stations s
+                ON s.region_code = c.region_code AND s.key = c.station_key
+        """
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY c.region_code, s.name, c.contaminant_code"
+
+        with self._lock:
+            rows = self.connection.execute(query, params).fetchall()
+
+        for row in rows:
+            station_data = {
+                "name": row["name"],
+                **{flag: bool(row[flag]) for flag in STATION_FLAGS},
+                "ficha_url": row["ficha_url"],
+                "key": row["key"],
+                "id": row["id"],
+            }
+            contaminant_data = {
+                "from_date": row["from_date"],
+                "to_date": row["to_date"],
+                "graph_url": row["graph_url"],
+            }
+            yield (
+                row["region_code"],
+                row["name"],
+                station_data,
+                row["contaminant_code"],
+                contaminant_data,
+            )
+
+    def to_dict(self):
+        """Rebuild the nested stations_data.json structure"""
+        stations_data = {}
+        with self._lock:
+            for row in self.connection.execute(
+                "SELECT code, number_stations FROM regions ORDER BY code"
+            ):
+                stations_data[row["code"]] = {
+                    "number_stations": row["number_stations"],
+                    "stations": {},
+                }
+
+        for (
+            region_code,
+            station_name,
+            station,
+            contaminant_code,
+            dates,
+        ) in self.iter_station_contaminants():
+            region_stations = stations_data[region_code]["stations"]
+            if station_name not in region_stations:
+                region_stations[station_name] = {**station, "contaminants": {}}
+            region_stations[station_name]["contaminants"][contaminant_code] = dates
+        return stations_data
+
+    def export_json(self, path=STATIONS_PATH):
+        """Write the catalog as stations_data.json"""
+        atomic_write_json(path, self.to_dict())
+
+    def import_json(self, path=STATIONS_PATH):
+        """Load a stations_data.json written before the catalog existed"""
+        with open(path, "r", encoding="utf-8") as f:
+            stations_data = json.load(f)
+        if not isinstance(stations_data, dict):
+            raise TypeError("JSON data must be an object/dictionary at root level")
+
+        for region_code, region_data in stations_data.items():
+            if isinstance(region_data, dict) and "stations" in region_data:
+                self.upsert_region(region_code, region_data)
+        return len(stations_data)
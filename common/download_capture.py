@@ -0,0 +1,118 @@
+import base64
+
+import requests
+
+from common.http_fetch import check_csv_content_type
+
+CAPTURE_TIMEOUT = 120  # seconds for the browser to fetch all the exports
+# Largest export kept in memory, larger ones are downloaded to disk instead. The
+# body is held by the browser and again base64 encoded on its way to Python.
+CAPTURE_MAX_BYTES = 32 * 1024 * 1024
+
+# Fetch the URLs from the page with its cookies, one at a time so only one body
+# is held at once, and hand the bodies back base64 encoded since WebDriver only
+# carries JSON. Bodies over maxBytes, by Content-Length or while reading them,
+# are cancelled and reported with tooLarge instead.
+FETCH_SCRIPT = """
+const urls = arguments[0];
+const maxBytes = arguments[1];
+const done = arguments[arguments.length - 1];
+
+function encode(blob) {
+    return new Promise((resolve, reject) => {
+        const reader = new FileReader();
+        reader.onload = () => resolve(reader.result.split(",", 2)[1] || "");
+        reader.onerror = () => reject(reader.error);
+        reader.readAsDataURL(blob);
+    });
+}
+
+async function readBody(response) {
+    const length = Number(response.headers.get("Content-Length"));
+    if (length > maxBytes) {
+        await response.body.cancel();
+        return {tooLarge: true, size: length};
+    }
+    const reader = response.body.getReader();
+    const chunks = [];
+    let size = 0;
+    for (;;) {
+        const {done, value} = await reader.read();
+        if (done) {
+            break;
+        }
+        size += value.length;
+        if (size > maxBytes) {
+            await reader.cancel();
+            return {tooLarge: true, size: size};
+        }
+        chunks.push(value);
+    }
+    return {body: await encode(new Blob(chunks)), size: size};
+}
+
+async function fetchAll() {
+    const results = [];
+    for (const url of urls) {
+        const response = await fetch(url, {credentials: "include"});
+        results.push({
+            url: response.url,
+            status: response.status,
+            contentType: response.headers.get("Content-Type") || "",
+            ...(await readBody(response)),
+        });
+    }
+    return results;
+}
+
+fetchAll().then(done, (error) => done({error: String(error)}));
+"""
+
+
+class ExportTooLargeError(Exception):
+    """An export is over the size kept in memory and has to go to disk"""
+
+    def __init__(self, url, size):
+        super().__init__(f"Export of {size} bytes from {url} is too large to capture")
+        self.url = url
+        self.size = size
+
+
+def capture_exports(driver, urls, timeout=CAPTURE_TIMEOUT, max_bytes=CAPTURE_MAX_BYTES):
+    """Fetch export URLs from the page open in the driver and return their bodies.
+
+    The requests are sent by the page, with its cookies and session, so they get
+    the same response as clicking the export link, but the bodies come back in
+    memory instead of through the download directory. This needs no download
+    directory and lets several exports share one page.
+
+    Args:
+        driver: WebDriver with a page of the same site open
+        urls (list): Absolute export URLs, fetched one after the other
+        max_bytes (int): Largest body returned, ExportTooLargeError is raised for
+                         larger ones
+
+    Returns:
+        list: Body of each URL as bytes, in the order of urls
+    """
+    driver.set_script_timeout(timeout)
+    responses = driver.execute_async_script(FETCH_SCRIPT, list(urls), max_bytes)
+    if isinstance(responses, dict) and "error" in responses:
+        raise RuntimeError(f"Browser fetch failed: {responses['error']}")
+
+    bodies = []
+    for response in responses:
+        if response["status"] != 200:
+            # Raised like requests does, so the scheduler backs off on 429/5xx
+            http_response = requests.Response()
+            http_response.status_code = response["status"]
+            http_response.url = response["url"]
+            raise requests.HTTPError(
+                f"{response['status']} error fetching {response['url']} in the browser",
+                response=http_response,
+            )
+        check_csv_content_type(response["contentType"], response["url"])
+        if response.get("tooLarge"):
+            raise ExportTooLargeError(response["url"], response["size"])
+        bodies.append(base64.b64decode(response["body"]))
+    return bodies
@@ -0,0 +1,139 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import time
+
+DOWNLOAD_TIMEOUT_BASE = 10  # seconds, for small or unknown-size files
+DOWNLOAD_MIN_THROUGHPUT = 100 * 1024  # bytes/second assumed when sizing the timeout
+DOWNLOAD_STALL_TIMEOUT = 10  # seconds without progress before giving up
+POLL_INTERVAL = 0.1  # seconds, when inotify is not available
+PARTIAL_SUFFIX = ".part"
+
+# inotify(7) event masks
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+
+def get_download_timeout(expected_size=None):
+    """Get how long to wait for a download of roughly expected_size bytes"""
+    if not expected_size:
+        return DOWNLOAD_TIMEOUT_BASE
+    return DOWNLOAD_TIMEOUT_BASE + expected_size / DOWNLOAD_MIN_THROUGHPUT
+
+
+class DirectoryWatch:
+    """Wake up on file changes in a directory, with inotify on Linux and polling
+    everywhere else"""
+
+    def __init__(self, path):
+        self.fd = None
+        libc_name = ctypes.util.find_library("c")
+        if not libc_name:
+            return
+
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            return
+
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0:
+            return
+
+        mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        if libc.inotify_add_watch(fd, os.fsencode(path), mask) < 0:
+            os.close(fd)
+            return
+
+        self.fd = fd
+
+    def wait(self, timeout):
+        """Block until something changes in the directory or timeout expires"""
+        if self.fd is None:
+            time.sleep(min(timeout, POLL_INTERVAL))
+            return
+
+        ready, _, _ = select.select([self.fd], [], [], max(timeout, 0))
+        if ready:
+            # Drain the queued events, the directory is re-checked by the caller
+            try:
+                while os.read(self.fd, 64 * 1024):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def get_partial_size(download_dir, names):
+    """Total size of in-progress .part files"""
+    total = 0
+    for name in names:
+        if name.endswith(PARTIAL_SUFFIX):
+            try:
+                total += os.path.getsize(os.path.join(download_dir, name))
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def find_completed_download(download_dir, files_before):
+    """Get the name of a finished new file, or None while it is still being written.
+
+    Firefox writes into a .part file next to an empty placeholder and renames it
+    over the placeholder once the download is closed.
+    """
+    names = set(os.listdir(download_dir))
+    if any(name.endswith(PARTIAL_SUFFIX) for name in names):
+        return None, names
+
+    for name in names - files_before:
+        try:
+            if os.path.getsize(os.path.join(download_dir, name)) > 0:
+                return name, names
+        except FileNotFoundError:
+            pass
+    return None, names
+
+
+def wait_for_download(download_dir, files_before, expected_size=None):
+    """Wait until a new file in download_dir is completely written.
+
+    Args:
+        download_dir (str): Directory the browser downloads into
+        files_before (set): Directory listing taken before the download started
+        expected_size (int): Approximate size in bytes, used to scale the timeout
+
+    Returns:
+        str: Path of the downloaded file, or None if it did not finish in time
+    """
+    deadline = time.monotonic() + get_download_timeout(expected_size)
+    last_partial_size = 0
+
+    with DirectoryWatch(download_dir) as watch:
+        while True:
+            name, names = find_completed_download(download_dir, files_before)
+            if name:
+                return os.path.join(download_dir, name)
+
+            # Keep waiting for as long as a large download is making progress
+            now = time.monotonic()
+            partial_size = get_partial_size(download_dir, names)
+            if partial_size > last_partial_size:
+                last_partial_size = partial_size
+                deadline = max(deadline, now + DOWNLOAD_STALL_TIMEOUT)
+
+            if now >= deadline:
+                return None
+            watch.wait(deadline - now)
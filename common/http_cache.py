@@ -0,0 +1,147 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from common.atomic_write import atomic_write_bytes, atomic_write_json
+from common.scheduler import mark_cached, mark_fetched
+from common.web_scraping import HTTP_CACHE_DIR
+
+HTTP_CACHE_MAX_BYTES = 256 * 1024 * 1024  # Least recently used entries go first
+HTTP_CACHE_TTL = {
+    "region": 24 * 3600,  # The station list rarely changes
+    "graph": 6 * 3600,
+}
+HTTP_CACHE_DEFAULT_TTL = 3600  # seconds, for URL classes not listed above
+
+
+class HttpCache:
+    """On-disk cache of HTTP responses, revalidated with ETag/Last-Modified.
+
+    Each entry is a body file plus a JSON metadata file named after the URL hash.
+    Responses younger than their URL class TTL are served without any request;
+    older ones are revalidated with a conditional GET. The body file's mtime is
+    its last access time, used for LRU eviction once the cache outgrows max_bytes.
+    The cache size is scanned once and then kept as a running total, so the
+    directory is only scanned again when the total goes over max_bytes.
+    """
+
+    def __init__(self, cache_dir=HTTP_CACHE_DIR, max_bytes=HTTP_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._size = None  # Bytes of the body files, None until scanned
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _get_paths(self, url):
+        name = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.cache_dir, name)
+        return f"{base}.json", f"{base}.body"
+
+    def _load(self, url):
+        meta_path, body_path = self._get_paths(url)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            with open(body_path, "rb") as f:
+                body = f.read()
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None, None
+        if meta.get("url") != url:
+            return None, None
+        return meta, body
+
+    def _store(self, url, url_class, response):
+        meta_path, body_path = self._get_paths(url)
+        meta = {
+            "url": url,
+            "url_class": url_class,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "encoding": response.encoding,
+            "stored_at": time.time(),
+        }
+        try:
+            replaced = os.path.getsize(body_path)
+        except FileNotFoundError:
+            replaced = 0
+        atomic_write_bytes(body_path, response.content)
+        atomic_write_json(meta_path, meta)
+
+        with self._lock:
+            if self._size is not None:
+                self._size += len(response.content) - replaced
+            full = self._size is None or self._size > self.max_bytes
+        if full:
+            self._evict()
+        return meta
+
+    def _touch(self, url):
+        _, body_path = self._get_paths(url)
+        try:
+            os.utime(body_path)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        """Remove least recently used entries until the cache fits max_bytes.
+        Entries written by other processes are counted here too."""
+        with self._lock:
+            entries = []
+            total = 0
+            for entry in os.scandir(self.cache_dir):
+                if not entry.name.endswith(".body"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+            entries.sort()
+            for _, size, body_path in entries:
+                if total <= self.max_bytes:
+                    break
+                for path in (body_path, body_path[: -len(".body")] + ".json"):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                total -= size
+            self._size = total
+
+    def get_text(self, session, url, url_class, timeout=None, revalidate=False):
+        """Get the text of url, from the cache when it is fresh or still valid.
+
+        With revalidate, cached responses are always checked with the server
+        first, however fresh they are.
+        """
+        meta, body = self._load(url)
+        ttl = HTTP_CACHE_TTL.get(url_class, HTTP_CACHE_DEFAULT_TTL)
+
+        if meta and not revalidate and time.time() - meta["stored_at"] < ttl:
+            self._touch(url)
+            mark_cached()
+            return body.decode(meta.get("encoding") or "utf-8", errors="replace")
+
+        headers = {}
+        if meta and meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta and meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+        mark_fetched()
+        response = session.get(url, headers=headers, timeout=timeout)
+
+        if response.status_code == 304 and meta:
+            meta["stored_at"] = time.time()
+            meta_path, _ = self._get_paths(url)
+            atomic_write_json(meta_path, meta)
+            self._touch(url)
+            return body.decode(meta.get("encoding") or "utf-8", errors="replace")
+
+        response.raise_for_status()
+        self._store(url, url_class, response)
+        return response.text
@@ -0,0 +1,240 @@
+import hashlib
+import html
+import os
+import re
+import tempfile
+import threading
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from common.http_cache import HttpCache
+
+HTTP_TIMEOUT = 30  # seconds
+HTTP_POOL_SIZE = 16  # Connections kept alive per host
+HTTP_CHUNK_SIZE = 64 * 1024
+# Downloads up to this size stay in memory until their hash shows they are new
+SPOOL_SIZE = 16 * 1024 * 1024
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0"
+
+# Cache region and graph pages on disk
+USE_HTTP_CACHE = True
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+_cache = None
+
+
+def get_session():
+    """Get the process-wide pooled HTTP session, creating it on first use"""
+    global _session, _session_pid
+
+    with _session_lock:
+        # A session inherited through fork must not share sockets with the parent
+        if _session is None or _session_pid != os.getpid():
+            session = requests.Session()
+            session.headers.update({"User-Agent": USER_AGENT})
+
+            # Only retry connection problems here, HTTP 429/5xx backoff is
+            # handled by the download scheduler
+            retry = Retry(
+                total=3,
+                connect=3,
+                read=0,
+                status=0,
+                backoff_factor=1,
+                allowed_methods=("GET", "HEAD"),
+            )
+            adapter = HTTPAdapter(
+                pool_connections=HTTP_POOL_SIZE,
+                pool_maxsize=HTTP_POOL_SIZE,
+                max_retries=retry,
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+
+            _session = session
+            _session_pid = os.getpid()
+
+    return _session
+
+
+ATTRIBUTE_PATTERN = re.compile(
+    r"""([^\s"'>/=]+)(?:\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+)))?"""
+)
+TAG_NAME_PATTERN = re.compile(r"^<[^\s/>]+")
+CHARREF_PATTERN = re.compile(r"&(#[0-9]+|#[xX][0-9a-fA-F]+|[a-zA-Z][a-zA-Z0-9]*);")
+
+
+def get_raw_attrs(parser):
+    """Parse the attributes of the current start tag like a browser does.
+
+    HTMLParser decodes legacy entities without a trailing semicolon, which turns
+    the "&macro=" query parameter of SINCA links into "¯o=". Browsers only decode
+    terminated character references inside attribute values.
+    """
+    tag_text = parser.get_starttag_text() or ""
+    # Skip the tag name itself
+    attrs_text = TAG_NAME_PATTERN.sub("", tag_text, count=1).rstrip(">").rstrip("/")
+
+    attrs = {}
+    for match in ATTRIBUTE_PATTERN.finditer(attrs_text):
+        name = match.group(1).lower()
+        value = next((g for g in match.groups()[1:] if g is not None), "")
+        attrs.setdefault(
+            name, CHARREF_PATTERN.sub(lambda m: html.unescape(m.group(0)), value)
+        )
+    return attrs
+
+
+class ExcelLinkParser(HTMLParser):
+    """Find the href of the Excel/CSV export link in a graph page"""
+
+    def __init__(self):
+        super().__init__()
+        self._in_excel_span = False
+        self.href = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = get_raw_attrs(self)
+        if tag == "span" and "icon-file-excel" in (attrs.get("class") or "").split():
+            self._in_excel_span = True
+        elif tag == "a" and self._in_excel_span and self.href is None:
+            self.href = attrs.get("href")
+
+    def handle_endtag(self, tag):
+        if tag == "span":
+            self._in_excel_span = False
+
+
+DATE_PARAM_PATTERN = re.compile(r"([?&])(from|to)=\d*")
+
+
+def with_date_range(url, from_date, to_date):
+    """Replace the from/to query parameters (YYMMDD) of a SINCA URL"""
+    dates = {"from": from_date, "to": to_date}
+    return DATE_PARAM_PATTERN.sub(
+        lambda m: f"{m.group(1)}{m.group(2)}={dates[m.group(2)]}", url
+    )
+
+
+# Averaging period at the end of a macro like "PM25.diario.anual.ic"
+MACRO_PERIOD_PATTERN = re.compile(
+    r"([?&]macro=[^&]*\.)(diario|trimestral|anual)(?=\.ic(?:&|$)|&|$)"
+)
+
+
+def get_url_period(url):
+    """Get the averaging period of the macro of a SINCA URL, None if it has none"""
+    match = MACRO_PERIOD_PATTERN.search(url)
+    return match.group(2) if match else None
+
+
+def with_period(url, period):
+    """Switch the averaging period of the macro of a SINCA URL.
+
+    The graph page and its CSV export only differ between periods in the macro,
+    so a single station contaminant URL serves every period.
+    """
+    return MACRO_PERIOD_PATTERN.sub(lambda m: f"{m.group(1)}{period}", url, count=1)
+
+
+def get_cache():
+    """Get the process-wide HTTP cache, creating it on first use"""
+    global _cache
+
+    with _session_lock:
+        if _cache is None:
+            _cache = HttpCache()
+    return _cache
+
+
+def fetch_text(url, url_class=None, revalidate=False):
+    """Fetch a page over HTTP and return its decoded text.
+
+    Pages with a url_class ("region", "graph") go through the on-disk cache,
+    revalidated with the server whatever their age when revalidate is set.
+    """
+    if USE_HTTP_CACHE and url_class:
+        return get_cache().get_text(
+            get_session(), url, url_class, HTTP_TIMEOUT, revalidate
+        )
+
+    response = get_session().get(url, timeout=HTTP_TIMEOUT)
+    response.raise_for_status()
+    return response.text
+
+
+def resolve_csv_url(graph_url):
+    """Resolve the CSV export URL linked from a contaminant graph page.
+
+    Args:
+        graph_url (str): The apub.htmlindico2.cgi URL stored in stations_data.json
+
+    Returns:
+        str: Absolute URL of the CSV export
+    """
+    parser = ExcelLinkParser()
+    parser.feed(fetch_text(graph_url, "graph"))
+    parser.close()
+
+    if not parser.href:
+        raise ValueError(f"No CSV export link found in {graph_url}")
+
+    return urljoin(graph_url, parser.href)
+
+
+def check_csv_content_type(content_type, url):
+    """Raise ValueError when an export answered with an HTML page, which is how
+    the server reports errors, with a 200 status"""
+    if "html" in content_type:
+        raise ValueError(f"Expected CSV but got {content_type} from {url}")
+
+
+def download_to_file(url, dest_path):
+    """Stream a URL to dest_path, writing to a .part file and renaming at the end"""
+    tmp_path = f"{dest_path}.part"
+
+    with get_session().get(url, stream=True, timeout=HTTP_TIMEOUT) as response:
+        response.raise_for_status()
+
+        check_csv_content_type(response.headers.get("Content-Type", ""), url)
+
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in response.iter_content(HTTP_CHUNK_SIZE):
+                    f.write(chunk)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    os.replace(tmp_path, dest_path)
+    return dest_path
+
+
+def download_to_store(url, dest_path, store):
+    """Stream a URL into a BlobStore and link it at dest_path.
+
+    The content is hashed while it streams into memory, so a download whose
+    content is already stored is not written to disk at all.
+
+    Returns:
+        str: sha256 of the content
+    """
+    with get_session().get(url, stream=True, timeout=HTTP_TIMEOUT) as response:
+        response.raise_for_status()
+
+        check_csv_content_type(response.headers.get("Content-Type", ""), url)
+
+        digest = hashlib.sha256()
+        with tempfile.SpooledTemporaryFile(SPOOL_SIZE, dir=store.tmp_dir) as f:
+            for chunk in response.iter_content(HTTP_CHUNK_SIZE):
+                digest.update(chunk)
+                f.write(chunk)
+            f.seek(0)
+            return store.put_stream(f, dest_path, digest.hexdigest())
@@ -0,0 +1,95 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from common.atomic_write import atomic_write_json
+from common.web_scraping import MANIFEST_PATH
+
+# Seconds between manifest writes while downloads complete; flush() writes the
+# rest at the end of a run
+MANIFEST_SAVE_INTERVAL = 10.0
+
+
+def get_manifest_key(region_code, station_name, contaminant_code, period):
+    """Key identifying one station/contaminant/period download"""
+    return f"{region_code}|{station_name}|{contaminant_code}|{period}"
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    """Get the sha256 hex digest of a file"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadManifest:
+    """Record of completed downloads, so sweeps can resume.
+
+    Changes are written at most every MANIFEST_SAVE_INTERVAL seconds, so a
+    sweep doesn't rewrite the whole file after each download; call flush() once
+    the run is done. An interrupted run only downloads its last few series again.
+    """
+
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        self._dirty = False
+        self._saved_at = time.monotonic()
+
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                try:
+                    self.entries = json.load(f)
+                except json.JSONDecodeError as e:
+                    print(f"Ignoring invalid manifest {path}: {e}")
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            return dict(entry) if entry else None
+
+    @staticmethod
+    def is_file_intact(entry):
+        """Check that the recorded file still exists with the recorded size"""
+        path = entry.get("path")
+        return (
+            bool(path)
+            and os.path.exists(path)
+            and os.path.getsize(path) == entry.get("size")
+        )
+
+    def record(self, key, path, contaminant_data, period, sha256=None):
+        """Record a completed download. The file is hashed unless its sha256 is
+        given."""
+        entry = {
+            "path": path,
+            "size": os.path.getsize(path),
+            "sha256": sha256 or hash_file(path),
+            "from_date": contaminant_data.get("from_date"),
+            "to_date": contaminant_data.get("to_date"),
+            "period": period,
+            "fetched_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        with self._lock:
+            self.entries[key] = entry
+            self._dirty = True
+            if time.monotonic() - self._saved_at >= MANIFEST_SAVE_INTERVAL:
+                self._save()
+        return entry
+
+    def flush(self):
+        """Write the entries recorded since the last save"""
+        with self._lock:
+            if self._dirty:
+                self._save()
+
+    def _save(self):
+        atomic_write_json(self.path, self.entries)
+        self._dirty = False
+        self._saved_at = time.monotonic()
@@ -0,0 +1,89 @@
+import json
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from common.atomic_write import atomic_write_bytes, atomic_write_json
+from common.sinca_csv import FLAG_MISSING, parse_sinca_csv
+from common.web_scraping import PARQUET_DIR
+
+INGESTED_FILENAME = "_ingested.json"  # Source hash of every written file
+
+SCHEMA = pa.schema(
+    [
+        ("timestamp", pa.timestamp("s")),
+        ("value", pa.float64()),
+        ("flag", pa.int8()),
+        ("station", pa.string()),
+        ("station_key", pa.string()),
+    ]
+)
+
+
+def read_sinca_csv_table(path):
+    """Read a SINCA CSV export into a typed table of timestamp, value and flag.
+
+    Missing values and flags are stored as nulls.
+    """
+    series = parse_sinca_csv(path)
+    missing = series.flags == FLAG_MISSING
+    return pa.table(
+        {
+            "timestamp": pa.array(series.timestamps, pa.timestamp("s")),
+            "value": pa.array(series.values, pa.float64(), mask=missing),
+            "flag": pa.array(series.flags, pa.int8(), mask=missing),
+        }
+    )
+
+
+def get_partition_dir(region_code, contaminant, period, dataset_dir=PARQUET_DIR):
+    """Directory of a region/contaminant/period partition, in hive layout"""
+    return os.path.join(
+        dataset_dir,
+        f"region={region_code}",
+        f"contaminant={contaminant}",
+        f"period={period}",
+    )
+
+
+def load_ingested(dataset_dir=PARQUET_DIR):
+    path = os.path.join(dataset_dir, INGESTED_FILENAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_ingested(ingested, dataset_dir=PARQUET_DIR):
+    atomic_write_json(os.path.join(dataset_dir, INGESTED_FILENAME), ingested)
+
+
+def write_station_series(
+    csv_path,
+    region_code,
+    contaminant,
+    period,
+    station_name,
+    station_key,
+    file_stem,
+    dataset_dir=PARQUET_DIR,
+):
+    """Write one downloaded CSV as the station's file in its dataset partition.
+
+    Each station has a single file per partition, so re-ingesting a series
+    replaces it instead of appending duplicate rows.
+    """
+    table = read_sinca_csv_table(csv_path)
+    table = table.append_column(
+        "station", pa.array([station_name] * len(table), pa.string())
+    ).append_column("station_key", pa.array([station_key] * len(table), pa.string()))
+    table = table.cast(SCHEMA)
+
+    partition_dir = get_partition_dir(region_code, contaminant, period, dataset_dir)
+    os.makedirs(partition_dir, exist_ok=True)
+    path = os.path.join(partition_dir, f"{file_stem}.parquet")
+    buffer = pa.BufferOutputStream()
+    pq.write_table(table, buffer, compression="zstd")
+    atomic_write_bytes(path, buffer.getvalue())
+    return path
@@ -0,0 +1,168 @@
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+from common.http_fetch import get_raw_attrs
+
+# Elements that never get an end tag
+VOID_ELEMENTS = {
+    "area",
+    "base",
+    "br",
+    "col",
+    "embed",
+    "hr",
+    "img",
+    "input",
+    "link",
+    "meta",
+    "source",
+    "track",
+    "wbr",
+}
+
+
+class RegionPageParser(HTMLParser):
+    """Extract the station rows of a SINCA region page in a single pass.
+
+    Mirrors the selectors used with Selenium: "caption#tableRows" for the number
+    of stations and "#tablaRegional > tbody > tr" for the station rows.
+    """
+
+    def __init__(self, base_url):
+        super().__init__()
+        self.base_url = base_url
+        self.caption_text = None
+        self.rows = []
+
+        self._in_caption = False
+        self._caption_parts = []
+        self._table_depth = 0  # Nesting depth inside #tablaRegional, 0 when outside
+        self._in_header = False
+        self._stack = []  # Open tags inside the current row
+        self._row = None
+        self._first_link_seen = False
+        self._name_parts = None  # Text of the row's first link while inside it
+
+    def _close_row(self):
+        if self._row is not None:
+            self.rows.append(self._row)
+        self._row = None
+        self._stack = []
+        self._first_link_seen = False
+        self._name_parts = None
+
+    def handle_starttag(self, tag, attrs):
+        if not (tag in ("caption", "table") or self._table_depth):
+            return
+        attrs = get_raw_attrs(self)
+
+        if tag == "caption" and attrs.get("id") == "tableRows":
+            self._in_caption = True
+            return
+
+        if tag == "table":
+            if self._table_depth:
+                self._table_depth += 1
+            elif attrs.get("id") == "tablaRegional":
+                self._table_depth = 1
+            return
+
+        # Only direct rows of #tablaRegional are stations
+        if self._table_depth != 1:
+            return
+
+        if tag in ("thead", "tfoot"):
+            self._in_header = True
+        elif tag == "tbody":
+            self._in_header = False
+        elif tag == "tr":
+            self._close_row()
+            if not self._in_header:
+                self._row = {
+                    "name": None,
+                    "ficha_url": None,
+                    "links": [],
+                    "badges": set(),
+                }
+        elif self._row is not None:
+            if tag == "td":
+                # Cells have an optional end tag
+                self._stack = []
+            self._handle_row_tag(tag, attrs)
+
+    def _handle_row_tag(self, tag, attrs):
+        parent = self._stack[-1] if self._stack else None
+        if tag not in VOID_ELEMENTS:
+            self._stack.append(tag)
+
+        if tag == "span" and attrs.get("title"):
+            self._row["badges"].add(attrs["title"])
+        elif tag == "a":
+            href = attrs.get("href")
+            url = urljoin(self.base_url, href) if href is not None else None
+            if not self._first_link_seen:
+                # The first link holds the station name and its ficha
+                self._first_link_seen = True
+                self._row["ficha_url"] = url
+                self._name_parts = []
+            if parent == "td" and url:
+                self._row["links"].append(url)
+
+    def handle_endtag(self, tag):
+        if self._in_caption and tag == "caption":
+            self._in_caption = False
+            self.caption_text = "".join(self._caption_parts).strip()
+            return
+
+        if not self._table_depth:
+            return
+
+        if tag == "table":
+            self._table_depth -= 1
+            if not self._table_depth:
+                self._close_row()
+            return
+
+        if self._table_depth != 1:
+            return
+
+        if tag in ("thead", "tfoot", "tbody"):
+            self._in_header = False
+        elif tag == "tr":
+            self._close_row()
+        elif self._row is not None:
+            if tag == "a" and self._name_parts is not None:
+                # Collapse whitespace like the rendered text Selenium returns
+                self._row["name"] = " ".join("".join(self._name_parts).split())
+                self._name_parts = None
+            if tag in self._stack:
+                # Also close any unclosed children
+                del self._stack[len(self._stack) - 1 - self._stack[::-1].index(tag) :]
+
+    def handle_data(self, data):
+        if self._in_caption:
+            self._caption_parts.append(data)
+        elif self._name_parts is not None:
+            self._name_parts.append(data)
+
+
+def parse_region_page(html, base_url):
+    """Parse a region page into its station count and station rows.
+
+    Args:
+        html (str): Page source, from driver.page_source or an HTTP response
+        base_url (str): URL of the page, used to make links absolute
+
+    Returns:
+        dict: "number_stations" (str or None) and "rows", a list of dicts with the
+              station "name", "ficha_url", all cell "links" and span "badges"
+    """
+    parser = RegionPageParser(base_url)
+    parser.feed(html)
+    parser.close()
+
+    number_stations = None
+    if parser.caption_text and ":" in parser.caption_text:
+        number_stations = parser.caption_text.split(":")[1].strip()
+
+    return {"number_stations": number_stations, "rows": parser.rows}
@@ -0,0 +1,239 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from requests.exceptions import RequestException
+
+from common.atomic_write import atomic_write_bytes
+from common.scheduler import (
+    BACKOFF_BASE,
+    BACKOFF_MAX,
+    RETRY_STATUS_CODES,
+    backoff_delay,
+    get_status_code,
+)
+from common.telemetry import increment
+from common.web_scraping import DEAD_LETTER_PATH
+
+MAX_ATTEMPTS = 4  # Attempts of a task, including the first one
+
+# Circuit breaker: pause every task when too many of the recent ones fail
+BREAKER_WINDOW = 50  # Recent task outcomes considered
+BREAKER_MIN_CALLS = 10  # Outcomes needed before the breaker may open
+BREAKER_ERROR_RATE = 0.5  # Share of failed outcomes that opens the breaker
+BREAKER_OPEN_DURATION = 30.0  # seconds paused before a probe task is let through
+BREAKER_MAX_OPEN_DURATION = 600.0  # seconds, the pause doubles after failed probes
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class RetryableError(Exception):
+    """A task failed in a way that is worth trying again"""
+
+
+# Network, file system and transient task errors; HTTP errors are only retried
+# with one of RETRY_STATUS_CODES
+RETRYABLE_ERRORS = (RequestException, OSError, RetryableError)
+
+
+class RetryPolicy:
+    """Decide whether and when a failed task is tried again.
+
+    Args:
+        max_attempts (int): Attempts of a task, including the first one
+        base_delay (float): Backoff of the first retry in seconds, before jitter
+        max_delay (float): Cap of the backoff in seconds
+        retryable (tuple): Exception types worth retrying
+
+    Unset arguments default to the module constants as they are when the policy
+    is created.
+    """
+
+    def __init__(
+        self, max_attempts=None, base_delay=None, max_delay=None, retryable=None
+    ):
+        self.max_attempts = max_attempts or MAX_ATTEMPTS
+        self.base_delay = BACKOFF_BASE if base_delay is None else base_delay
+        self.max_delay = BACKOFF_MAX if max_delay is None else max_delay
+        self.retryable = retryable or RETRYABLE_ERRORS
+
+    def is_retryable(self, error):
+        status = get_status_code(error)
+        if status is not None and status not in RETRY_STATUS_CODES:
+            # 404 and the like fail the same way every time
+            return False
+        return isinstance(error, self.retryable)
+
+    def should_retry(self, error, attempt):
+        """Check whether to retry after the given attempt (1-based) failed"""
+        return attempt < self.max_attempts and self.is_retryable(error)
+
+    def get_delay(self, attempt):
+        """Jittered exponential backoff before the retry following attempt"""
+        return backoff_delay(attempt - 1, self.base_delay, self.max_delay)
+
+
+class CircuitBreaker:
+    """Pause all tasks while the error rate of the recent ones is too high.
+
+    The breaker opens when at least BREAKER_ERROR_RATE of the last BREAKER_WINDOW
+    outcomes failed. While open no task starts. After the open duration a single
+    probe task is let through: its success closes the breaker and its failure
+    opens it again for twice as long.
+    """
+
+    def __init__(
+        self,
+        name="downloads",
+        window=None,
+        min_calls=None,
+        error_rate=None,
+        open_duration=None,
+        max_open_duration=None,
+    ):
+        self.name = name
+        self.min_calls = min_calls or BREAKER_MIN_CALLS
+        self.error_rate = error_rate or BREAKER_ERROR_RATE
+        self.base_open_duration = open_duration or BREAKER_OPEN_DURATION
+        self.max_open_duration = max_open_duration or BREAKER_MAX_OPEN_DURATION
+        self.open_duration = self.base_open_duration
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=window or BREAKER_WINDOW)
+        self._opened_at = None
+        self._probing = False
+        self._condition = asyncio.Condition()
+
+    async def wait(self):
+        """Wait until a task may start.
+
+        Returns:
+            bool: Whether the task is the probe, which must report its outcome
+        """
+        async with self._condition:
+            while True:
+                if self.state == CLOSED:
+                    return False
+
+                if self.state == OPEN:
+                    remaining = self._opened_at + self.open_duration - time.monotonic()
+                    if remaining > 0:
+                        try:
+                            await asyncio.wait_for(self._condition.wait(), remaining)
+                        except asyncio.TimeoutError:
+                            pass
+                        continue
+                    self._set_state(HALF_OPEN, "sending a probe task")
+
+                if not self._probing:
+                    self._probing = True
+                    return True
+                await self._condition.wait()
+
+    async def record(self, ok, probe=False):
+        """Record the outcome of a task started after wait()"""
+        async with self._condition:
+            if probe:
+                self._probing = False
+                if ok:
+                    self._outcomes.clear()
+                    self.open_duration = self.base_open_duration
+                    self._set_state(CLOSED, "probe task succeeded")
+                else:
+                    self.open_duration = min(
+                        self.max_open_duration, self.open_duration * 2
+                    )
+                    self._open("probe task failed")
+                self._condition.notify_all()
+                return
+
+            # Tasks started before the breaker opened don't count
+            if self.state != CLOSED:
+                return
+
+            self._outcomes.append(ok)
+            calls = len(self._outcomes)
+            failures = self._outcomes.count(False)
+            if calls >= self.min_calls and failures >= self.error_rate * calls:
+                self._open(f"{failures}/{calls} recent tasks failed")
+
+    def _open(self, reason):
+        self._opened_at = time.monotonic()
+        self._set_state(
+            OPEN, f"{reason}, pausing tasks for {self.open_duration:.0f} seconds"
+        )
+
+    def _set_state(self, state, reason):
+        self.state = state
+        increment("circuit_breaker_transitions_total", breaker=self.name, state=state)
+        print(f"Circuit breaker for {self.name} {state.replace('_', '-')}: {reason}")
+
+
+class DeadLetterQueue:
+    """Tasks that failed for good, one JSON line each, to be replayed later.
+
+    Lines are only appended while tasks run. A task failing again is appended
+    again, and the last line of a key wins when loading.
+    """
+
+    def __init__(self, path=DEAD_LETTER_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def add(self, key, task, error):
+        """Append a failed task and the error that made it fail"""
+        record = {
+            "key": key,
+            "task": task,
+            "error": str(error),
+            "error_type": type(error).__name__,
+            "failed_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+        increment("dead_letters_total")
+
+    def load(self):
+        """Get the latest record of every failed task, by key"""
+        records = {}
+        with self._lock:
+            if not os.path.exists(self.path):
+                return records
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A line cut short by a crash
+                        continue
+                    records[record["key"]] = record
+        return records
+
+    def remove(self, keys):
+        """Drop the records of keys that have since succeeded"""
+        keys = set(keys)
+        with self._lock:
+            if not keys or not os.path.exists(self.path):
+                return 0
+
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+            kept = []
+            for line in lines:
+                try:
+                    if json.loads(line)["key"] in keys:
+                        continue
+                except json.JSONDecodeError:
+                    continue
+                kept.append(line)
+
+            atomic_write_bytes(self.path, "".join(kept).encode("utf-8"))
+        return len(lines) - len(kept)
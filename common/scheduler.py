@@ -0,0 +1,321 @@
+import asyncio
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from urllib.parse import urlsplit
+
+from requests.exceptions import ConnectionError, Timeout
+
+from common.telemetry import increment
+
+MAX_CONCURRENCY = 64  # Tasks in flight across all hosts
+PER_HOST_CONCURRENCY = 16  # Ceiling of the adaptive per-host limit
+MIN_HOST_CONCURRENCY = 1  # Floor of the adaptive per-host limit
+INITIAL_HOST_CONCURRENCY = 4
+REQUESTS_PER_SECOND = 4.0  # Sustained task start rate
+RATE_BURST = 8  # Tasks that may start back to back after an idle period
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0  # seconds
+BACKOFF_MAX = 60.0  # seconds
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Adaptive limit: grow while latency holds, shrink on overload
+LATENCY_TOLERANCE = 2.0  # Recent latency over baseline latency counted as congestion
+LATENCY_DECREASE_FACTOR = 0.9
+OVERLOAD_DECREASE_FACTOR = 0.5
+RECENT_LATENCY_WEIGHT = 0.2  # EWMA weight of the recent latency
+BASELINE_LATENCY_WEIGHT = 0.002  # Weight of recent latency when the baseline rises
+
+
+class TokenBucket:
+    """Token bucket limiting how fast tasks may start"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            while True:
+                now = loop.time()
+                if self._updated is not None:
+                    elapsed = now - self._updated
+                    self._tokens = min(
+                        self.capacity, self._tokens + elapsed * self.rate
+                    )
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def get_host(url):
+    """Get the host a URL points to, used as the per-host concurrency key"""
+    return urlsplit(url or "").netloc or None
+
+
+def get_status_code(exception):
+    """Get the HTTP status code carried by a requests exception, if any"""
+    response = getattr(exception, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def is_overload_error(exception):
+    """Check whether an exception means the server is overloaded or unreachable,
+    so the task should be retried later with less concurrency"""
+    if get_status_code(exception) in RETRY_STATUS_CODES:
+        return True
+    return isinstance(exception, (Timeout, ConnectionError, TimeoutError))
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, maximum=BACKOFF_MAX):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(maximum, base * 2**attempt))
+
+
+# What the task running in each worker thread did, see mark_cached
+_task_state = threading.local()
+
+
+def mark_cached():
+    """Report that the task running in this thread was served from local files,
+    like an up-to-date manifest entry or a fresh cached page.
+
+    Its duration says nothing about the server, so a task that only reports
+    cached work is not used as a latency sample by the adaptive limit.
+    """
+    _task_state.cached = True
+
+
+def mark_fetched():
+    """Report that the task running in this thread sent a request to the server,
+    so its duration is a latency sample even when it also reported cached work"""
+    _task_state.fetched = True
+
+
+def _run_task(func, args):
+    """Run func(*args) and get its result and whether it only did cached work"""
+    _task_state.cached = _task_state.fetched = False
+    result = func(*args)
+    return result, _task_state.cached and not _task_state.fetched
+
+
+def timed(func, latencies):
+    """Wrap func so the wall time of every call is appended to latencies"""
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    return wrapper
+
+
+class AdaptiveLimiter:
+    """Limit of tasks in flight against one host, adjusted from task outcomes.
+
+    Starts in slow start, adding one slot per success, and then grows by one slot
+    per limit's worth of successes (AIMD). The limit is multiplied by
+    OVERLOAD_DECREASE_FACTOR on overload errors and by LATENCY_DECREASE_FACTOR when
+    the recent latency exceeds LATENCY_TOLERANCE times the baseline latency. At
+    most one decrease happens per recent latency, so a burst of failures from the
+    same window only counts once.
+    """
+
+    def __init__(self, name, floor, ceiling, initial=None):
+        self.name = name
+        self.floor = floor
+        self.ceiling = max(floor, ceiling)
+        initial = INITIAL_HOST_CONCURRENCY if initial is None else initial
+        self.limit = float(min(self.ceiling, max(floor, initial)))
+        self.in_flight = 0
+        self.recent_latency = None
+        self.baseline_latency = None
+        self._slow_start = True
+        self._last_decrease = None
+        self._condition = asyncio.Condition()
+
+    @property
+    def current(self):
+        """Number of tasks allowed in flight right now"""
+        return int(self.limit)
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.current)
+            self.in_flight += 1
+
+    async def release(self, latency=None, overloaded=False, reason=None):
+        """Free a slot and adjust the limit from the task outcome.
+
+        Args:
+            latency (float): Seconds the task took, None when it failed or did
+                             no network work
+            overloaded (bool): The task failed because the host is overloaded
+            reason (str): Why the task failed, for the log
+        """
+        async with self._condition:
+            limited = self.in_flight >= self.current
+            self.in_flight -= 1
+            if overloaded:
+                self._decrease(OVERLOAD_DECREASE_FACTOR, reason or "overload")
+            elif latency is not None:
+                self._on_success(latency, limited)
+            self._condition.notify_all()
+
+    def _on_success(self, latency, limited):
+        if self.recent_latency is None:
+            self.recent_latency = self.baseline_latency = latency
+        self.recent_latency += RECENT_LATENCY_WEIGHT * (latency - self.recent_latency)
+        # The baseline follows recent latency down at once and up only slowly, so
+        # it estimates the latency of an unloaded server
+        self.baseline_latency = min(
+            self.recent_latency,
+            self.baseline_latency
+            + BASELINE_LATENCY_WEIGHT * (self.recent_latency - self.baseline_latency),
+        )
+
+        if self.recent_latency > self.baseline_latency * LATENCY_TOLERANCE:
+            self._decrease(
+                LATENCY_DECREASE_FACTOR,
+                f"latency {self.recent_latency:.2f}s over baseline "
+                f"{self.baseline_latency:.2f}s",
+            )
+        elif limited:
+            # Only grow when the limit was what held tasks back
+            step = 1 if self._slow_start else 1 / self.limit
+            self._set_limit(self.limit + step, "increase")
+
+    def _decrease(self, factor, reason):
+        now = time.monotonic()
+        cooldown = self.recent_latency or 0
+        if self._last_decrease is not None and now - self._last_decrease < cooldown:
+            return
+        self._last_decrease = now
+        self._slow_start = False
+        self._set_limit(self.limit * factor, f"decrease ({reason})")
+
+    def _set_limit(self, limit, decision):
+        previous = self.current
+        self.limit = min(self.ceiling, max(self.floor, limit))
+        if self.current != previous:
+            direction = "up" if self.current > previous else "down"
+            increment("concurrency_changes_total", host=self.name, direction=direction)
+            print(
+                f"Concurrency for {self.name}: {previous} -> {self.current}, {decision}"
+            )
+
+
+class DownloadScheduler:
+    """Run blocking I/O tasks from one process under global and per-host caps.
+
+    Each task runs in a worker thread. Task starts are paced by a token bucket,
+    tasks in flight per host follow an AdaptiveLimiter and tasks failing because
+    the host is overloaded are retried with jittered exponential backoff. Tasks
+    calling mark_cached and not mark_fetched don't adjust the limit. A
+    RetryPolicy widens the retries to other errors, and a CircuitBreaker pauses
+    every task while too many fail.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=None,
+        per_host_concurrency=None,
+        requests_per_second=None,
+        burst=None,
+        max_retries=None,
+        min_host_concurrency=None,
+        retry_policy=None,
+        circuit_breaker=None,
+    ):
+        # Unset limits read the module constants now rather than at import time
+        self.max_concurrency = max_concurrency or MAX_CONCURRENCY
+        self.per_host_concurrency = per_host_concurrency or PER_HOST_CONCURRENCY
+        self.min_host_concurrency = min_host_concurrency or MIN_HOST_CONCURRENCY
+        self.max_retries = MAX_RETRIES if max_retries is None else max_retries
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self._global = asyncio.Semaphore(self.max_concurrency)
+        self._hosts = {}
+        self._bucket = TokenBucket(
+            requests_per_second or REQUESTS_PER_SECOND, burst or RATE_BURST
+        )
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+
+    def _host_limiter(self, host):
+        if host not in self._hosts:
+            self._hosts[host] = AdaptiveLimiter(
+                host, self.min_host_concurrency, self.per_host_concurrency
+            )
+        return self._hosts[host]
+
+    async def run(self, func, *args, host=None):
+        """Run func(*args) in a worker thread and return its result"""
+        loop = asyncio.get_running_loop()
+        limiter = self._host_limiter(host)
+
+        breaker = self.circuit_breaker
+        policy = self.retry_policy
+        attempt = 0
+        while True:
+            attempt += 1
+            # Paused tasks wait before taking any slot
+            probe = await breaker.wait() if breaker else False
+            async with self._global:
+                await limiter.acquire()
+                succeeded = False
+                latency = None
+                error = None
+                try:
+                    await self._bucket.acquire()
+                    start = loop.time()
+                    result, cached = await loop.run_in_executor(
+                        self._executor, partial(_run_task, func, args)
+                    )
+                    succeeded = True
+                    if not cached:
+                        latency = loop.time() - start
+                    return result
+                except Exception as e:
+                    if is_overload_error(e):
+                        status = get_status_code(e)
+                        error = f"HTTP {status}" if status else type(e).__name__
+                    if policy:
+                        retry = policy.should_retry(e, attempt)
+                        max_attempts = policy.max_attempts
+                    else:
+                        retry = error is not None and attempt <= self.max_retries
+                        max_attempts = self.max_retries + 1
+                    if not retry:
+                        raise
+                    reason = error or f"{type(e).__name__}: {e}"
+                finally:
+                    await limiter.release(latency, error is not None, error)
+                    if breaker:
+                        await breaker.record(succeeded, probe)
+
+            # Back off outside the limits so other tasks keep flowing
+            delay = policy.get_delay(attempt) if policy else backoff_delay(attempt - 1)
+            increment("retries_total", host=host)
+            print(
+                f"{reason} from {host}, retrying in {delay:.1f} seconds "
+                f"(attempt {attempt + 1}/{max_attempts})"
+            )
+            await asyncio.sleep(delay)
+
+    def get_host_limits(self):
+        """Current concurrency limit of every host seen so far"""
+        return {host: limiter.current for host, limiter in self._hosts.items()}
+
+    def close(self):
+        self._executor.shutdown(wait=True)
@@ -0,0 +1,144 @@
+import io
+from typing import NamedTuple
+
+import numpy as np
+
+CHUNK_SIZE = 4 * 1024 * 1024  # bytes read per chunk
+
+FLAG_MISSING = -1
+FLAG_VALIDATED = 0
+FLAG_PRELIMINARY = 1
+FLAG_UNVALIDATED = 2
+
+
+class SincaSeries(NamedTuple):
+    """A parsed SINCA export.
+
+    timestamps (datetime64[s]), values (float64, NaN when missing) and flags
+    (int8: FLAG_VALIDATED, FLAG_PRELIMINARY, FLAG_UNVALIDATED or FLAG_MISSING),
+    telling which column each value was taken from.
+    """
+
+    timestamps: np.ndarray
+    values: np.ndarray
+    flags: np.ndarray
+
+
+def get_value_columns(header):
+    """Get the column indexes of the validated, preliminary and unvalidated values.
+
+    Columns missing from the header are None. Exports without a recognizable
+    header use the default layout: date;time;validated;preliminary;unvalidated
+    """
+    names = [name.strip().lower() for name in header.split(";")]
+    columns = {}
+    for i, name in enumerate(names):
+        if "no validados" in name:
+            columns.setdefault(FLAG_UNVALIDATED, i)
+        elif "preliminares" in name:
+            columns.setdefault(FLAG_PRELIMINARY, i)
+        elif "validados" in name:
+            columns.setdefault(FLAG_VALIDATED, i)
+
+    if not columns:
+        return [2, 3, 4]
+    return [
+        columns.get(flag)
+        for flag in (FLAG_VALIDATED, FLAG_PRELIMINARY, FLAG_UNVALIDATED)
+    ]
+
+
+def _to_timestamps(dates, times):
+    """Convert YYMMDD and HHMM integers to datetime64[s]"""
+    years = dates // 10000
+    # strptime's pivot for two-digit years: 69-99 -> 19xx, 00-68 -> 20xx
+    years = np.where(years >= 69, 1900 + years, 2000 + years)
+    months = (dates // 100) % 100
+    days = dates % 100
+
+    month_starts = ((years - 1970) * 12 + months - 1).astype("datetime64[M]")
+    day_starts = month_starts.astype("datetime64[D]") + (days - 1)
+    seconds = (times // 100) * 3600 + (times % 100) * 60
+    return day_starts.astype("datetime64[s]") + seconds.astype("timedelta64[s]")
+
+
+def parse_block(block, value_columns):
+    """Parse a block of complete CSV lines (without header) into a SincaSeries.
+
+    The block is normalized with bytes operations (decimal commas to dots, empty
+    fields to "nan") so NumPy's C tokenizer can read it straight into float
+    arrays, without a Python object per row or field.
+    """
+    block = block.replace(b"\r", b"").replace(b",", b".")
+    if not block.endswith(b"\n"):
+        block += b"\n"
+    # Runs of empty fields need two passes since replacements do not overlap
+    block = block.replace(b";;", b";nan;").replace(b";;", b";nan;")
+    block = block.replace(b";\n", b";nan\n")
+
+    present_columns = [column for column in value_columns if column is not None]
+    table = np.loadtxt(
+        io.BytesIO(block),
+        delimiter=";",
+        usecols=[0, 1] + present_columns,
+        dtype=np.float64,
+        comments=None,
+        ndmin=2,
+    )
+
+    dates = table[:, 0].astype(np.int64)
+    # Averaged periods may leave the time empty
+    times = np.nan_to_num(table[:, 1]).astype(np.int64)
+    timestamps = _to_timestamps(dates, times)
+
+    values = np.full(len(table), np.nan)
+    flags = np.full(len(table), FLAG_MISSING, dtype=np.int8)
+    # Fill from the last column back so the first present value wins
+    columns = {column: i + 2 for i, column in enumerate(present_columns)}
+    for flag in (FLAG_UNVALIDATED, FLAG_PRELIMINARY, FLAG_VALIDATED):
+        if value_columns[flag] is None:
+            continue
+        column_values = table[:, columns[value_columns[flag]]]
+        present = ~np.isnan(column_values)
+        values[present] = column_values[present]
+        flags[present] = flag
+
+    return SincaSeries(timestamps, values, flags)
+
+
+def iter_sinca_csv(path, chunk_size=CHUNK_SIZE):
+    """Stream a SINCA CSV export as SincaSeries chunks of complete lines"""
+    with open(path, "rb") as f:
+        header = f.readline().decode("latin-1")
+        value_columns = get_value_columns(header)
+
+        # The first line may already be data when the export has no header
+        leftover = b""
+        if header[:1].isdigit():
+            leftover = header.encode("latin-1")
+
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+
+            data = leftover + chunk
+            cut = data.rfind(b"\n") + 1
+            leftover = data[cut:]
+            if cut:
+                yield parse_block(data[:cut], value_columns)
+
+        if leftover.strip():
+            yield parse_block(leftover, value_columns)
+
+
+def parse_sinca_csv(path, chunk_size=CHUNK_SIZE):
+    """Parse a whole SINCA CSV export into one SincaSeries"""
+    chunks = list(iter_sinca_csv(path, chunk_size))
+    if not chunks:
+        return SincaSeries(
+            np.empty(0, "datetime64[s]"), np.empty(0), np.empty(0, np.int8)
+        )
+    if len(chunks) == 1:
+        return chunks[0]
+    return SincaSeries(*(np.concatenate(arrays) for arrays in zip(*chunks)))
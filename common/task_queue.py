@@ -0,0 +1,226 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from common.web_scraping import QUEUE_PATH
+
+VISIBILITY_TIMEOUT = 300  # seconds a lease lasts without a heartbeat
+MAX_ATTEMPTS = 5  # Leases of a task before it is marked as failed
+BUSY_TIMEOUT = 60  # seconds to wait for another node's write lock
+
+PENDING = "pending"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    task_key TEXT NOT NULL UNIQUE,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    result TEXT,
+    error TEXT,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tasks_state ON tasks (state, lease_expires);
+"""
+
+
+def get_worker_id():
+    """Identify this worker across nodes by host name and process id"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class TaskQueue:
+    """Lease-based task queue in a SQLite file, shared by several nodes.
+
+    A lease hides a task from other workers until it expires. Workers extend
+    their leases with heartbeats, so the tasks of a dead worker become leasable
+    again after the visibility timeout. Only the current lease owner may complete
+    or fail a task, so a worker that lost its lease cannot overwrite the result
+    of the one that took over. Lease expiry uses wall clock time, so the clocks
+    of all nodes must be synchronized.
+
+    The file can live on a shared volume. It uses a rollback journal instead of
+    WAL, since WAL needs shared memory that network file systems do not provide.
+    """
+
+    def __init__(self, path=QUEUE_PATH, visibility_timeout=VISIBILITY_TIMEOUT):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Transactions are opened explicitly, so leasing can take the write lock
+        # before reading
+        self.connection = sqlite3.connect(
+            path, timeout=BUSY_TIMEOUT, isolation_level=None, check_same_thread=False
+        )
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=DELETE")
+        self.connection.executescript(SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _transaction(self, query, params=(), many=False):
+        with self._lock:
+            db = self.connection
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                if many:
+                    cursor = db.executemany(query, params)
+                else:
+                    cursor = db.execute(query, params)
+                rows = cursor.fetchall()
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            return cursor.rowcount, rows
+
+    def enqueue(self, tasks):
+        """Add tasks given as (task_key, payload) pairs.
+
+        A key already queued with the same payload is skipped. One with a new
+        payload, like a series whose date range grew, gets it and goes back to
+        pending with a new set of attempts, unless a worker holds its lease.
+
+        Returns:
+            int: Tasks added or sent back to pending
+        """
+        now = time.time()
+        rows = [(key, json.dumps(payload), now) for key, payload in tasks]
+        added, _ = self._transaction(
+            """
+            INSERT INTO tasks (task_key, payload, updated_at) VALUES (?, ?, ?)
+            ON CONFLICT (task_key) DO UPDATE SET
+                payload = excluded.payload,
+                state = 'pending',
+                attempts = 0,
+                result = NULL,
+                error = NULL,
+                updated_at = excluded.updated_at
+            WHERE state != 'leased' AND payload != excluded.payload
+            """,
+            rows,
+            many=True,
+        )
+        return added
+
+    def lease(self, worker_id, count=1):
+        """Lease up to count pending tasks or tasks whose lease expired.
+
+        Returns:
+            list: (task_id, payload) pairs
+        """
+        now = time.time()
+        _, rows = self._transaction(
+            """
+            UPDATE tasks SET
+                state = 'leased',
+                lease_owner = ?,
+                lease_expires = ?,
+                attempts = attempts + 1,
+                updated_at = ?
+            WHERE id IN (
+                SELECT id FROM tasks
+                WHERE state = 'pending'
+                    OR (state = 'leased' AND lease_expires < ?)
+                ORDER BY id
+                LIMIT ?
+            )
+            RETURNING id, payload, attempts
+            """,
+            (worker_id, now + self.visibility_timeout, now, now, count),
+        )
+
+        leased = []
+        for row in sorted(rows, key=lambda row: row["id"]):
+            if row["attempts"] > MAX_ATTEMPTS:
+                self.fail(worker_id, row["id"], "Too many attempts", retry=False)
+            else:
+                leased.append((row["id"], json.loads(row["payload"])))
+        return leased
+
+    def heartbeat(self, worker_id, task_ids):
+        """Extend the leases of task_ids still held by worker_id.
+
+        Returns:
+            set: Ids whose lease was extended; the rest were lost to other workers
+        """
+        if not task_ids:
+            return set()
+        now = time.time()
+        placeholders = ", ".join("?" * len(task_ids))
+        _, rows = self._transaction(
+            f"""
+            UPDATE tasks SET lease_expires = ?, updated_at = ?
+            WHERE lease_owner = ? AND state = 'leased' AND id IN ({placeholders})
+            RETURNING id
+            """,
+            (now + self.visibility_timeout, now, worker_id, *task_ids),
+        )
+        return {row["id"] for row in rows}
+
+    def complete(self, worker_id, task_id, result=None):
+        """Mark a leased task as done. Returns False if the lease was lost."""
+        updated, _ = self._transaction(
+            """
+            UPDATE tasks SET state = 'done', result = ?, error = NULL,
+                lease_owner = NULL, lease_expires = NULL, updated_at = ?
+            WHERE id = ? AND lease_owner = ? AND state = 'leased'
+            """,
+            (result, time.time(), task_id, worker_id),
+        )
+        return updated == 1
+
+    def fail(self, worker_id, task_id, error, retry=True):
+        """Release a leased task after an error, back to pending when retry is set
+        and it has attempts left. Returns False if the lease was lost."""
+        updated, _ = self._transaction(
+            """
+            UPDATE tasks SET
+                state = CASE WHEN ? AND attempts < ? THEN 'pending' ELSE 'failed' END,
+                error = ?, lease_owner = NULL, lease_expires = NULL, updated_at = ?
+            WHERE id = ? AND lease_owner = ? AND state = 'leased'
+            """,
+            (retry, MAX_ATTEMPTS, error, time.time(), task_id, worker_id),
+        )
+        return updated == 1
+
+    def requeue_failed(self):
+        """Give failed tasks a new set of attempts"""
+        updated, _ = self._transaction(
+            "UPDATE tasks SET state = 'pending', attempts = 0, updated_at = ? "
+            "WHERE state = 'failed'",
+            (time.time(),),
+        )
+        return updated
+
+    def get_counts(self):
+        """Number of tasks in each state"""
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT state, COUNT(*) AS count FROM tasks GROUP BY state"
+            ).fetchall()
+        counts = dict.fromkeys((PENDING, LEASED, DONE, FAILED), 0)
+        counts.update({row["state"]: row["count"] for row in rows})
+        return counts
+
+    def is_drained(self):
+        """Check that no task is pending or leased by any worker"""
+        counts = self.get_counts()
+        return not counts[PENDING] and not counts[LEASED]
@@ -0,0 +1,166 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from common.atomic_write import atomic_write_bytes
+
+METRIC_PREFIX = "sinca_"
+# Upper bounds in seconds of the phase duration histogram buckets
+HISTOGRAM_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_lock = threading.Lock()
+_local = threading.local()  # Stack of open span names of each thread
+_trace_fd = None
+_counters = {}  # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+
+
+def start_trace(path):
+    """Append every finished span to path as a JSON line from now on"""
+    global _trace_fd
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+    with _lock:
+        if _trace_fd is not None:
+            os.close(_trace_fd)
+        _trace_fd = fd
+
+
+def stop_trace():
+    global _trace_fd
+
+    with _lock:
+        if _trace_fd is not None:
+            os.close(_trace_fd)
+            _trace_fd = None
+
+
+def _get_labels_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def increment(name, value=1, **labels):
+    """Add value to a counter"""
+    key = (name, _get_labels_key(labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """Record value in a histogram"""
+    key = (name, _get_labels_key(labels))
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * len(HISTOGRAM_BUCKETS), 0.0, 0]
+        for i, bound in enumerate(HISTOGRAM_BUCKETS):
+            if value <= bound:
+                histogram[0][i] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+def _write_trace(record):
+    line = (json.dumps(record, ensure_ascii=False, default=str) + "\n").encode("utf-8")
+    with _lock:
+        if _trace_fd is not None:
+            # A single write per line keeps lines whole with O_APPEND
+            os.write(_trace_fd, line)
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time a phase, recording it in the phase metrics and the trace.
+
+    Yields the attributes dict, so the phase can add attributes it only learns
+    while running. Spans nest per thread and record their parent's name.
+    """
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    parent = stack[-1] if stack else None
+    stack.append(name)
+
+    started_at = time.time()
+    start = time.perf_counter()
+    error = None
+    try:
+        yield attributes
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        stack.pop()
+
+        status = "error" if error else "ok"
+        observe("phase_duration_seconds", duration, phase=name)
+        increment("phase_total", phase=name, status=status)
+
+        record = {
+            "name": name,
+            "parent": parent,
+            "start": started_at,
+            "duration": duration,
+            "status": status,
+            "pid": os.getpid(),
+            "thread": threading.current_thread().name,
+        }
+        if error:
+            record["error"] = error
+        record.update(attributes)
+        _write_trace(record)
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def format_metrics():
+    """Render all counters and histograms in the Prometheus text format"""
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted(
+            (key, (list(buckets), total, count))
+            for key, (buckets, total, count) in _histograms.items()
+        )
+
+    lines = []
+    typed = set()
+    for (name, labels), value in counters:
+        metric = f"{METRIC_PREFIX}{name}"
+        if metric not in typed:
+            typed.add(metric)
+            lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric}{_format_labels(labels)} {value}")
+
+    for (name, labels), (buckets, total, count) in histograms:
+        metric = f"{METRIC_PREFIX}{name}"
+        if metric not in typed:
+            typed.add(metric)
+            lines.append(f"# TYPE {metric} histogram")
+        for bound, bucket_count in zip(HISTOGRAM_BUCKETS, buckets):
+            bucket_labels = _format_labels(labels, [("le", str(bound))])
+            lines.append(f"{metric}_bucket{bucket_labels} {bucket_count}")
+        lines.append(
+            f"{metric}_bucket{_format_labels(labels, [('le', '+Inf')])} {count}"
+        )
+        lines.append(f"{metric}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{metric}_count{_format_labels(labels)} {count}")
+
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path):
+    """Write the current metrics to path, replacing it atomically"""
+    atomic_write_bytes(path, format_metrics().encode("utf-8"))
@@ -0,0 +1,266 @@
+import io
+import json
+import os
+import threading
+
+import numpy as np
+
+from common.aggregation import (
+    DAILY_LIMITS,
+    PERIOD_MONTHS,
+    load_aggregates,
+    save_aggregates,
+    update_aggregates,
+)
+from common.atomic_write import atomic_write_bytes, atomic_write_json
+from common.catalog import get_region_code
+from common.sinca_csv import SincaSeries, parse_sinca_csv
+from common.web_scraping import TIMESERIES_DIR
+
+INDEX_FILENAME = "index.json"
+ARRAY_NAMES = SincaSeries._fields  # timestamps, values, flags
+
+
+def get_series_key(region_code, station_key, contaminant_code, period):
+    """Key identifying one station/contaminant/period series in the store"""
+    return f"{get_region_code(region_code)}|{station_key}|{contaminant_code}|{period}"
+
+
+def to_datetime64(value):
+    """Convert a date given as a string ("2019", "2019-06-01"), a year, a datetime
+    or a datetime64 to datetime64[s]"""
+    if isinstance(value, int):
+        value = str(value)
+    return np.datetime64(value, "s")
+
+
+class TimeSeriesStore:
+    """Downloaded series as memory-mapped NumPy arrays, for range queries.
+
+    Each series is kept as timestamps.npy, values.npy and flags.npy sorted by
+    timestamp, under region/contaminant/period/station_key. The index.json
+    sidecar maps series keys to their directory, date range and the hash of the
+    CSV they were parsed from.
+
+    Queries return slices of the memory-mapped arrays, so only the pages of the
+    requested range are read, and windows queried again are served from the page
+    cache. The slices are read-only.
+
+    Daily series also keep their quarterly and annual aggregates, in
+    trimestral.npz and anual.npz next to their arrays. Only the periods touched
+    by a new version of the series are computed again.
+    """
+
+    def __init__(self, root=TIMESERIES_DIR):
+        self.root = root
+        self.index_path = os.path.join(root, INDEX_FILENAME)
+        self._lock = threading.Lock()
+        self.index = {}  # Series key -> entry
+        self._index_mtime = None
+        self._series = {}  # Series key -> SincaSeries of memory-mapped arrays
+
+        os.makedirs(root, exist_ok=True)
+        self.refresh()
+
+    def refresh(self):
+        """Reload the index when another process ingested series since"""
+        try:
+            mtime = os.stat(self.index_path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if mtime == self._index_mtime:
+                return
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            # Reopen the series whose files were replaced
+            for key in list(self._series):
+                if index.get(key) != self.index.get(key):
+                    del self._series[key]
+            self.index = index
+            self._index_mtime = mtime
+
+    def ingest(
+        self,
+        csv_path,
+        region_code,
+        station_key,
+        contaminant_code,
+        period,
+        station_name=None,
+        sha256=None,
+    ):
+        """Parse a downloaded CSV into the store, replacing the series it had.
+
+        Args:
+            csv_path (str): SINCA CSV export
+            sha256 (str): Hash of the CSV, the CSV is skipped when the series was
+                          already parsed from the same content
+
+        Returns:
+            bool: Whether the series was written
+        """
+        key = get_series_key(region_code, station_key, contaminant_code, period)
+        entry = self.index.get(key)
+        if sha256 and entry and entry.get("sha256") == sha256:
+            return False
+
+        # Mappings of the replaced files stay readable, for updating aggregates
+        old_series = self.get_series(key) if entry and period == "diario" else None
+
+        series = parse_sinca_csv(csv_path)
+        timestamps = series.timestamps
+        if np.any(timestamps[1:] < timestamps[:-1]):
+            order = np.argsort(timestamps, kind="stable")
+            series = SincaSeries(*(array[order] for array in series))
+
+        series_dir = os.path.join(
+            get_region_code(region_code), contaminant_code, period, str(station_key)
+        )
+        full_dir = os.path.join(self.root, series_dir)
+        os.makedirs(full_dir, exist_ok=True)
+        for name, array in zip(ARRAY_NAMES, series):
+            path = os.path.join(full_dir, f"{name}.npy")
+            # Replace the file instead of overwriting it, readers may have it mapped
+            buffer = io.BytesIO()
+            np.save(buffer, array)
+            atomic_write_bytes(path, buffer.getvalue())
+
+        if period == "diario":
+            limit = DAILY_LIMITS.get(contaminant_code)
+            for aggregate_period in PERIOD_MONTHS:
+                path = os.path.join(full_dir, f"{aggregate_period}.npz")
+                previous = load_aggregates(path) if old_series else None
+                save_aggregates(
+                    path,
+                    update_aggregates(
+                        previous, old_series, series, aggregate_period, limit
+                    ),
+                )
+
+        timestamps = series.timestamps
+        entry = {
+            "region_code": get_region_code(region_code),
+            "station_key": str(station_key),
+            "station_name": station_name,
+            "contaminant_code": contaminant_code,
+            "period": period,
+            "dir": series_dir,
+            "rows": len(timestamps),
+            "start": str(timestamps[0]) if len(timestamps) else None,
+            "end": str(timestamps[-1]) if len(timestamps) else None,
+            "sha256": sha256,
+        }
+        with self._lock:
+            self.index[key] = entry
+            self._series.pop(key, None)
+            self._save()
+        return True
+
+    def get_series(self, key):
+        """Get a whole series as memory-mapped arrays, None if it isn't stored"""
+        with self._lock:
+            if key in self._series:
+                return self._series[key]
+            entry = self.index.get(key)
+            if entry is None:
+                return None
+
+            series_dir = os.path.join(self.root, entry["dir"])
+            series = SincaSeries(
+                *(
+                    np.load(os.path.join(series_dir, f"{name}.npy"), mmap_mode="r")
+                    for name in ARRAY_NAMES
+                )
+            )
+            self._series[key] = series
+            return series
+
+    def find(self, contaminants=None, regions=None, stations=None, periods=None):
+        """Get the keys of the stored series matching all the given filters.
+
+        Args:
+            contaminants (list): Contaminant codes, like "PM25" or "0003"
+            regions (list): Region codes, with or without the "R" prefix
+            stations (list): Station keys or names
+            periods (list): Averaging periods
+        """
+        self.refresh()
+        if regions:
+            regions = {get_region_code(region) for region in regions}
+        stations = set(stations or ())
+
+        keys = []
+        with self._lock:
+            for key, entry in self.index.items():
+                if contaminants and entry["contaminant_code"] not in contaminants:
+                    continue
+                if regions and entry["region_code"] not in regions:
+                    continue
+                if stations and not (
+                    entry["station_key"] in stations
+                    or entry["station_name"] in stations
+                ):
+                    continue
+                if periods and entry["period"] not in periods:
+                    continue
+                keys.append(key)
+        return sorted(keys)
+
+    def get_range(self, key, start=None, end=None):
+        """Get the part of a series from start (included) to end (excluded).
+
+        Returns:
+            SincaSeries: Views of the memory-mapped arrays, nothing is copied
+        """
+        series = self.get_series(key)
+        if series is None:
+            raise KeyError(key)
+
+        timestamps = series.timestamps
+        first = 0
+        last = len(timestamps)
+        if start is not None:
+            first = np.searchsorted(timestamps, to_datetime64(start), side="left")
+        if end is not None:
+            last = np.searchsorted(timestamps, to_datetime64(end), side="left")
+        return SincaSeries(*(array[first:last] for array in series))
+
+    def query(
+        self,
+        contaminants=None,
+        regions=None,
+        stations=None,
+        periods=None,
+        start=None,
+        end=None,
+    ):
+        """Get the start/end range of every series matching the filters.
+
+        Example, PM25 of all region M stations from 2019 through 2023:
+
+            store.query(["PM25"], ["M"], periods=["diario"], start=2019, end=2024)
+
+        Returns:
+            dict: Series key -> SincaSeries of views of the memory-mapped arrays
+        """
+        return {
+            key: self.get_range(key, start, end)
+            for key in self.find(contaminants, regions, stations, periods)
+        }
+
+    def get_aggregates(self, key, period):
+        """Get the quarterly ("trimestral") or annual ("anual") aggregates of a
+        daily series, None if the series isn't stored"""
+        entry = self.get_entry(key)
+        if entry is None:
+            return None
+        return load_aggregates(os.path.join(self.root, entry["dir"], f"{period}.npz"))
+
+    def get_entry(self, key):
+        with self._lock:
+            return self.index.get(key)
+
+    def _save(self):
+        atomic_write_json(self.index_path, self.index)
+        self._index_mtime = os.stat(self.index_path).st_mtime_ns
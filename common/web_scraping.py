@@ -1,22 +1,78 @@
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.firefox.service import Service
-from selenium.webdriver.firefox.options import Options
-from webdriver_manager.firefox import GeckoDriverManager
 import os
+import re
 import time
 import platform
-from requests.exceptions import ConnectionError
+import itertools
+import shutil
+import subprocess
+import threading
+from glob import glob
+from urllib.parse import quote, urlsplit
+
+from common.telemetry import span
+
+# Selenium, webdriver_manager and requests are imported where a browser is
+# started, so scripts that never need one start without loading them
+
+# Base URL of the SINCA site, overridable to point the scrapers at a local server
+SINCA_HOST = os.environ.get("SINCA_HOST", "https://sinca.mma.gob.cl").rstrip("/")
 
 DATA_DIR = "./data"
 STATIONS_DIR = f"{DATA_DIR}/stations"
 CSV_CONTAMINANTS_DIR = f"{DATA_DIR}/contaminants"
+PARQUET_DIR = f"{DATA_DIR}/parquet"  # Dataset partitioned by region/contaminant/period
+BLOB_DIR = f"{DATA_DIR}/blobs"  # Downloaded files stored by content hash
+TIMESERIES_DIR = f"{DATA_DIR}/timeseries"  # Memory-mapped series for queries
 DRIVER_CACHE_DIR = "./.driver_cache"  # Local cache directory for the driver
+HTTP_CACHE_DIR = "./.http_cache"  # Local cache directory for fetched pages
 
 STATIONS_FILENAME = "stations_data.json"
 STATIONS_PATH = f"{STATIONS_DIR}/{STATIONS_FILENAME}"
+# Station catalog, stations_data.json is exported from it
+CATALOG_FILENAME = "stations.sqlite"
+CATALOG_PATH = f"{STATIONS_DIR}/{CATALOG_FILENAME}"
+
+# Shared download queue for running on several nodes, usually on a shared volume
+QUEUE_FILENAME = "task_queue.sqlite"
+QUEUE_PATH = f"{DATA_DIR}/{QUEUE_FILENAME}"
+
+# Downloads that failed for good, replayed by download_csv.py --retry-failed
+DEAD_LETTER_FILENAME = "dead_letter.jsonl"
+DEAD_LETTER_PATH = f"{DATA_DIR}/{DEAD_LETTER_FILENAME}"
+
+# Span trace and metrics of the last runs
+TELEMETRY_DIR = f"{DATA_DIR}/telemetry"
+TRACE_PATH = f"{TELEMETRY_DIR}/trace.jsonl"
+METRICS_PATH = f"{TELEMETRY_DIR}/metrics.prom"
+
+# Record of downloaded files, kept next to the contaminants directory
+MANIFEST_FILENAME = "contaminants_manifest.json"
+MANIFEST_PATH = f"{DATA_DIR}/{MANIFEST_FILENAME}"
+
+# Start browsers with the lean profile: eager page loads, no images, fonts, media,
+# stylesheets or third-party requests, no caches and a single content process
+LEAN_PROFILE = True
+# Hosts the lean profile may connect to, besides SINCA_HOST
+ALLOWED_HOSTS = ("localhost", "127.0.0.1")
+# Unreachable proxy that requests to other hosts are sent to, so they fail at once
+BLOCKING_PROXY = "127.0.0.1:9"
+
+# Limits of each browser, None for no limit. The memory limit covers the resident
+# memory of the browser and its content processes; the pool recycles browsers that
+# exceed it. The CPU limit pins them to the given cores, e.g. {0, 1}
+BROWSER_MEMORY_LIMIT_MB = 1024
+BROWSER_CPU_CORES = None
+
+# Oldest GeckoDriver accepted from the cache
+MIN_GECKODRIVER_VERSION = (0, 30, 0)
+GECKODRIVER_VERSION_PATTERN = re.compile(r"geckodriver (\d+(?:\.\d+)*)")
+DRIVER_CHECK_TIMEOUT = 10  # seconds for geckodriver --version
+
+# Numbers the download directories of drivers started by this process
+_driver_counter = itertools.count()
+# Whether this process already has a working cached GeckoDriver
+_driver_resolved = False
+_driver_lock = threading.Lock()
 
 
 def get_cached_driver_path():
@@ -32,10 +88,238 @@ def get_cached_driver_path():
     return os.path.join(DRIVER_CACHE_DIR, driver_name)
 
 
-def setup_driver(download_dir=None):
-    """Setup and return a Firefox driver with proper options"""
+def check_cached_driver(path=None):
+    """Validate the cached GeckoDriver binary without starting a browser.
+
+    Returns:
+        str: Version of the driver, None when it is missing, not executable,
+             does not run or is older than MIN_GECKODRIVER_VERSION
+    """
+    path = path or get_cached_driver_path()
+    if not os.path.isfile(path):
+        return None
+    if not os.access(path, os.X_OK):
+        print(f"Cached GeckoDriver at {path} is not executable")
+        return None
+
+    try:
+        result = subprocess.run(
+            [path, "--version"],
+            capture_output=True,
+            text=True,
+            timeout=DRIVER_CHECK_TIMEOUT,
+            check=True,
+        )
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"Cached GeckoDriver at {path} does not run: {e}")
+        return None
+
+    match = GECKODRIVER_VERSION_PATTERN.search(result.stdout)
+    if not match:
+        print(f"Could not read the version of the cached GeckoDriver at {path}")
+        return None
+    version = match.group(1)
+    if tuple(int(part) for part in version.split(".")) < MIN_GECKODRIVER_VERSION:
+        print(f"Cached GeckoDriver {version} is too old")
+        return None
+    return version
+
+
+def install_driver():
+    """Download GeckoDriver and copy it to the driver cache"""
+    from webdriver_manager.firefox import GeckoDriverManager
+
+    os.makedirs(DRIVER_CACHE_DIR, exist_ok=True)
+    cached_driver = get_cached_driver_path()
+
+    print("Downloading GeckoDriver...")
+    driver_path = GeckoDriverManager().install()
+    shutil.copy2(driver_path, cached_driver)
+    # Ensure the driver is executable
+    os.chmod(cached_driver, 0o755)
+    print(f"GeckoDriver cached at: {cached_driver}")
+    return cached_driver
+
+
+def ensure_driver_cached():
+    """Ensure a working GeckoDriver is cached before parallel processing,
+    downloading it when needed. No browser is started."""
+    global _driver_resolved
+
+    version = check_cached_driver()
+    if version:
+        print(f"Using cached GeckoDriver {version} at {get_cached_driver_path()}")
+        _driver_resolved = True
+        return True
+
+    try:
+        install_driver()
+    except Exception as e:
+        print(f"Error caching driver: {e}")
+        return False
+    _driver_resolved = check_cached_driver() is not None
+    return _driver_resolved
+
+
+def resolve_driver():
+    """Check the cached GeckoDriver, downloading it when needed, the first time
+    this process starts a browser"""
+    global _driver_resolved
+
+    with _driver_lock:
+        if _driver_resolved:
+            return
+        if check_cached_driver():
+            print("Using cached GeckoDriver")
+        else:
+            install_driver()
+        _driver_resolved = True
+
+
+def prepare_driver(http_engine):
+    """Get GeckoDriver ready at the start of a run that drives browsers from the
+    start, raising when it is not available.
+
+    Runs over HTTP only start browsers for the Selenium fallback, which resolves
+    the driver when it starts the first one, so they skip the check here.
+    """
+    if not http_engine and not ensure_driver_cached():
+        raise Exception("Failed to cache GeckoDriver")
+
+
+def get_blocking_pac(allowed_hosts):
+    """Proxy auto-config script sending every host but allowed_hosts to
+    BLOCKING_PROXY, as a data URL"""
+    hosts = ", ".join(f'"{host}"' for host in allowed_hosts)
+    script = (
+        "function FindProxyForURL(url, host) {"
+        f" if ([{hosts}].indexOf(host) >= 0) return 'DIRECT';"
+        f" return 'PROXY {BLOCKING_PROXY}'; }}"
+    )
+    return f"data:text/javascript,{quote(script)}"
+
+
+def set_lean_preferences(options):
+    """Trim a Firefox profile down to what the scrapers need"""
+    # Return from driver.get() once the DOM is ready, without waiting for
+    # subresources
+    options.page_load_strategy = "eager"
+
+    # Images, downloadable fonts, media and stylesheets are never looked at
+    options.set_preference("permissions.default.image", 2)
+    options.set_preference("permissions.default.stylesheet", 2)
+    options.set_preference("gfx.downloadable_fonts.enabled", False)
+    options.set_preference("browser.display.use_document_fonts", 0)
+    options.set_preference("media.autoplay.default", 5)
+    options.set_preference("media.preload.default", 0)
+    options.set_preference("media.preload.auto", 0)
+
+    # Only the SINCA host is reachable, which also silences update checks,
+    # telemetry and safe browsing lookups
+    allowed_hosts = (urlsplit(SINCA_HOST).hostname, *ALLOWED_HOSTS)
+    options.set_preference("network.proxy.type", 2)
+    options.set_preference(
+        "network.proxy.autoconfig_url", get_blocking_pac(allowed_hosts)
+    )
+    options.set_preference("network.proxy.failover_direct", False)
+    options.set_preference("network.prefetch-next", False)
+    options.set_preference("network.dns.disablePrefetch", True)
+    options.set_preference("network.http.speculative-parallel-limit", 0)
+    options.set_preference("browser.safebrowsing.malware.enabled", False)
+    options.set_preference("browser.safebrowsing.phishing.enabled", False)
+    options.set_preference("app.update.enabled", False)
+    options.set_preference("toolkit.telemetry.enabled", False)
+    options.set_preference("datareporting.policy.dataSubmissionEnabled", False)
+
+    # Every page is visited once, caches and history are never reused
+    options.set_preference("browser.cache.disk.enable", False)
+    options.set_preference("browser.cache.memory.enable", False)
+    options.set_preference("browser.cache.offline.enable", False)
+    options.set_preference("browser.sessionhistory.max_entries", 1)
+    options.set_preference("browser.sessionhistory.max_total_viewers", 0)
+    options.set_preference("browser.sessionstore.resume_from_crash", False)
+
+    # A single content process per browser instead of one per site
+    options.set_preference("dom.ipc.processCount", 1)
+    options.set_preference("dom.ipc.processPrelaunch.enabled", False)
+    options.set_preference("fission.autostart", False)
+
+
+def get_browser_pids(driver):
+    """Get the process ids of the browser of a driver and its content processes.
+
+    Content processes are found through /proc, elsewhere only the browser itself
+    is returned.
+    """
+    pid = driver.capabilities.get("moz:processID")
+    if not pid:
+        return []
+
+    pids = [pid]
+    for pid in pids:
+        for children_path in glob(f"/proc/{pid}/task/*/children"):
+            try:
+                with open(children_path) as f:
+                    pids.extend(int(child) for child in f.read().split())
+            except OSError:
+                continue
+    return pids
+
+
+def get_browser_memory(driver):
+    """Get the resident memory in MB of the browser of a driver and its content
+    processes, 0 where /proc is not available"""
+    total_kb = 0
+    for pid in get_browser_pids(driver):
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total_kb += int(line.split()[1])
+                        break
+        except OSError:
+            continue
+    return total_kb / 1024
+
+
+def limit_browser_cpu(driver, cores):
+    """Pin the browser of a driver to cores; content processes started later
+    inherit it"""
+    if not hasattr(os, "sched_setaffinity"):
+        print("CPU limits are only supported on Linux")
+        return
+    for pid in get_browser_pids(driver):
+        try:
+            os.sched_setaffinity(pid, cores)
+        except OSError as e:
+            print(f"Could not limit the CPUs of process {pid}: {e}")
+
+
+def setup_driver(download_dir=None, lean=None, cpu_cores=None):
+    """Setup and return a Firefox driver with proper options.
+
+    Args:
+        download_dir (str): Base directory of the driver's download directory
+        lean (bool): Use the lean profile, LEAN_PROFILE when None
+        cpu_cores (set): Cores the browser may run on, BROWSER_CPU_CORES when None
+    """
+    with span("setup_driver"):
+        return _setup_driver(
+            download_dir,
+            LEAN_PROFILE if lean is None else lean,
+            BROWSER_CPU_CORES if cpu_cores is None else cpu_cores,
+        )
+
+
+def _setup_driver(download_dir, lean, cpu_cores):
+    from requests.exceptions import ConnectionError
+    from selenium import webdriver
+    from selenium.webdriver.firefox.service import Service
+
     options = webdriver.FirefoxOptions()
     options.add_argument("--headless")  # Enable headless mode
+    if lean:
+        set_lean_preferences(options)
 
     # Create cache directory if it doesn't exist
     os.makedirs(DRIVER_CACHE_DIR, exist_ok=True)
@@ -57,9 +341,11 @@ def setup_driver(download_dir=None):
 
     # Configure download behavior
     if download_dir:
-        # Create a process-specific subdirectory
+        # Create a driver-specific subdirectory, several drivers can share a process
         process_id = os.getpid()
-        process_download_dir = os.path.join(download_dir, f"process_{process_id}")
+        process_download_dir = os.path.join(
+            download_dir, f"process_{process_id}_{next(_driver_counter)}"
+        )
         os.makedirs(process_download_dir, exist_ok=True)
 
         download_dir = os.path.abspath(process_download_dir)
@@ -87,23 +373,17 @@ def setup_driver(download_dir=None):
                 time.sleep(retry_delay)
                 retry_delay *= 2  # Exponential backoff
 
-            if os.path.exists(cached_driver) and os.access(cached_driver, os.X_OK):
-                print("Using cached GeckoDriver")
-                service = Service(cached_driver)
-            else:
-                print("Downloading GeckoDriver...")
-                # Download the driver
-                driver_path = GeckoDriverManager().install()
-                # Copy to our cache location
-                import shutil
-
-                shutil.copy2(driver_path, cached_driver)
-                # Ensure the driver is executable
-                os.chmod(cached_driver, 0o755)
-                print(f"GeckoDriver cached at: {cached_driver}")
+            with span("driver_resolution"):
+                resolve_driver()
                 service = Service(cached_driver)
 
-            return webdriver.Firefox(service=service, options=options)
+            with span("firefox_launch"):
+                driver = webdriver.Firefox(service=service, options=options)
+            # Remember where this driver saves files
+            driver.download_dir = download_dir
+            if cpu_cores:
+                limit_browser_cpu(driver, cpu_cores)
+            return driver
 
         except ConnectionError as e:
             print(f"Connection error while downloading driver: {e}")
@@ -0,0 +1,442 @@
+"""Keep the downloads up to date from a long-running process.
+
+    python daemon.py --interval 3600 --periods diario --status-port 8765
+
+The region pages are polled on a schedule and compared with the catalog. Only
+the station contaminants that are new, whose data grew or whose last download
+did not finish are downloaded, by
+workers that stay warm between polls: the HTTP session, the scheduler's limits
+and the browsers of the Selenium fallback are kept instead of started again.
+
+    GET /health   200 while polls keep succeeding, 503 otherwise
+    GET /status   JSON with the state of the last and next polls
+    GET /metrics  Prometheus text metrics
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import signal
+import threading
+from datetime import datetime
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import time
+
+from common.blob_store import get_blob_store
+from common.browser_pool import DRIVER_MAX_TASKS, init_worker, shutdown_pool
+from common.catalog import StationCatalog, get_region_code
+from common.manifest import DownloadManifest
+from common.resilience import CircuitBreaker, DeadLetterQueue, RetryPolicy
+from common.scheduler import DownloadScheduler, get_host
+from common.telemetry import format_metrics, increment, span
+from common.web_scraping import (
+    CSV_CONTAMINANTS_DIR,
+    STATIONS_PATH,
+    prepare_driver,
+)
+from download_csv import (
+    BROWSER_CONCURRENCY,
+    USE_BLOB_STORE,
+    USE_HTTP_ENGINE,
+    WRITE_PARQUET,
+    WRITE_TIMESERIES,
+    build_tasks,
+    get_retryable_task_errors,
+    group_tasks_by_pair,
+    is_task_done,
+    periodosPromedioOpcion,
+    process_station_contaminant_periods,
+    write_parquet_dataset,
+    write_timeseries_store,
+)
+from get_all_stations_data import mapaRegionUrls, process_region
+from pipeline import PIPELINE_QUEUE_SIZE, download
+
+POLL_INTERVAL = 3 * 3600  # seconds between the starts of two polls
+STATUS_HOST = "127.0.0.1"
+STATUS_PORT = 8765
+# Polls missed before /health reports the service as unhealthy
+HEALTH_MISSED_POLLS = 2
+
+
+def parse_to_date(to_date):
+    """Parse a YYMMDD catalog date, None when it is missing or invalid"""
+    try:
+        return datetime.strptime(to_date, "%y%m%d")
+    except (TypeError, ValueError):
+        return None
+
+
+def get_changed_pairs(previous, region_data):
+    """Compare a freshly scraped region with its date ranges in the catalog.
+
+    Args:
+        previous (dict): StationCatalog.get_date_ranges() of the region
+        region_data (dict): Scraped region, as returned by process_region
+
+    Returns:
+        set: (station_key, contaminant_code) of the new pairs and of those whose
+             to_date advanced
+    """
+    changed = set()
+    for station in region_data.get("stations", {}).values():
+        for contaminant_code, dates in station.get("contaminants", {}).items():
+            pair = (station["key"], contaminant_code)
+            if pair not in previous:
+                changed.add(pair)
+                continue
+
+            old_to_date = parse_to_date(previous[pair][1])
+            new_to_date = parse_to_date(dates.get("to_date"))
+            if new_to_date and (old_to_date is None or new_to_date > old_to_date):
+                changed.add(pair)
+    return changed
+
+
+class DaemonStatus:
+    """State of the service, updated by the event loop and read by the status
+    server thread"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._fields = {
+            "state": "starting",
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "polls": 0,
+            "last_poll_at": None,
+            "last_poll_duration": None,
+            "last_poll_changed": None,
+            "last_error": None,
+            "next_poll_at": None,
+            "queued": 0,
+            "successful_downloads": 0,
+            "failed_downloads": 0,
+        }
+        self._last_success = time()
+
+    def update(self, **fields):
+        with self._lock:
+            self._fields.update(fields)
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self._fields[name] += value
+
+    def poll_succeeded(self):
+        with self._lock:
+            self._last_success = time()
+
+    def is_healthy(self):
+        with self._lock:
+            age = time() - self._last_success
+        return age < self.interval * HEALTH_MISSED_POLLS
+
+    def to_dict(self):
+        with self._lock:
+            return dict(self._fields)
+
+
+def start_status_server(status, breaker, queue, host=STATUS_HOST, port=STATUS_PORT):
+    """Serve /health, /status and /metrics from a background thread"""
+
+    class StatusHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/health":
+                healthy = status.is_healthy()
+                self._send(200 if healthy else 503, "ok\n" if healthy else "stale\n")
+            elif self.path == "/status":
+                body = {
+                    **status.to_dict(),
+                    "queue_size": queue.qsize(),
+                    "circuit_breaker": breaker.state,
+                }
+                self._send(200, json.dumps(body, indent=4) + "\n", "application/json")
+            elif self.path == "/metrics":
+                self._send(200, format_metrics(), "text/plain; version=0.0.4")
+            else:
+                self._send(404, "not found\n")
+
+        def _send(self, code, text, content_type="text/plain"):
+            body = text.encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Health checks would flood the output
+            pass
+
+    server = ThreadingHTTPServer((host, port), StatusHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Status endpoint listening on http://{host}:{server.server_port}/status")
+    return server
+
+
+async def poll(catalog, scheduler, queue, manifest, region_urls, periods, filters):
+    """Scrape the regions and queue the station contaminants that changed.
+
+    Pairs the manifest has no up-to-date file for are queued too, so downloads
+    that failed or were dead-lettered are retried every poll until they succeed,
+    even when their dates don't move again.
+
+    Returns:
+        list: Download tasks queued, one per station contaminant and period
+    """
+    queued = []
+    # Region pages are cached for a day, revalidate them so every poll sees
+    # the dates that moved since the last one
+    futures = [
+        scheduler.run(
+            process_region, region_code, region_url, True, host=get_host(region_url)
+        )
+        for region_code, region_url in region_urls.items()
+    ]
+
+    for future in asyncio.as_completed(futures):
+        try:
+            region_code, result = await future
+        except Exception as e:
+            print(f"Error processing region: {e}")
+            continue
+        if not result:
+            continue
+
+        changed = get_changed_pairs(catalog.get_date_ranges(region_code), result)
+        catalog.upsert_region(region_code, result)
+
+        tasks = []
+        for period in periods:
+            for task in build_tasks(catalog, period, [region_code], **filters):
+                if (task[2]["key"], task[3]) in changed or not is_task_done(
+                    task, manifest
+                ):
+                    tasks.append(task)
+        increment("changed_pairs_total", len(changed), region=region_code)
+        if tasks:
+            print(f"Region {region_code}: {len(tasks)} downloads to refresh")
+
+        queued += tasks
+        for task in group_tasks_by_pair(tasks):
+            await queue.put(task)
+
+    return queued
+
+
+def export_results(catalog, tasks, manifest, local_aggregates=False):
+    """Write the outputs of the downloads of a poll"""
+    manifest.flush()
+    catalog.export_json(STATIONS_PATH)
+    if WRITE_PARQUET:
+        write_parquet_dataset(tasks, manifest)
+    if WRITE_TIMESERIES or local_aggregates:
+        write_timeseries_store(tasks, manifest)
+    if USE_BLOB_STORE:
+        get_blob_store().collect_garbage()
+
+
+async def run_daemon(
+    catalog,
+    manifest,
+    periods,
+    regions=None,
+    contaminants=None,
+    stations=None,
+    interval=POLL_INTERVAL,
+    status_port=STATUS_PORT,
+    stop_event=None,
+    local_aggregates=False,
+):
+    """Poll and download until stop_event is set, which cancels the current poll"""
+    region_urls = mapaRegionUrls
+    if regions:
+        codes = {get_region_code(region) for region in regions}
+        region_urls = {code: url for code, url in region_urls.items() if code in codes}
+    filters = {"contaminants": contaminants, "stations": stations}
+    stop_event = stop_event or asyncio.Event()
+
+    breaker = CircuitBreaker()
+    scheduler = DownloadScheduler(
+        retry_policy=RetryPolicy(retryable=get_retryable_task_errors()),
+        circuit_breaker=breaker,
+    )
+    # Browsers are recycled by the pool but not shut down between polls
+    init_worker(
+        CSV_CONTAMINANTS_DIR,
+        DRIVER_MAX_TASKS,
+        eager=not USE_HTTP_ENGINE,
+        max_drivers=BROWSER_CONCURRENCY,
+    )
+
+    queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    dead_letters = DeadLetterQueue()
+    counts = {"successful": 0, "failed": 0, "succeeded_keys": []}
+    process_task = partial(process_station_contaminant_periods, manifest=manifest)
+    downloaders = [
+        asyncio.create_task(
+            download(scheduler, process_task, queue, manifest, dead_letters, counts)
+        )
+        for _ in range(scheduler.max_concurrency)
+    ]
+
+    status = DaemonStatus(interval)
+    server = start_status_server(status, breaker, queue, port=status_port)
+
+    try:
+        while not stop_event.is_set():
+            started = time()
+            status.update(state="polling")
+            successful, failed = counts["successful"], counts["failed"]
+
+            async def refresh():
+                with span("poll"):
+                    tasks = await poll(
+                        catalog,
+                        scheduler,
+                        queue,
+                        manifest,
+                        region_urls,
+                        periods,
+                        filters,
+                    )
+                    status.update(state="downloading", queued=len(tasks))
+                    await queue.join()
+                    await asyncio.to_thread(
+                        export_results, catalog, tasks, manifest, local_aggregates
+                    )
+                return tasks
+
+            cycle = asyncio.create_task(refresh())
+            stopped = asyncio.create_task(stop_event.wait())
+            try:
+                await asyncio.wait(
+                    {cycle, stopped}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if stop_event.is_set():
+                    cycle.cancel()
+                    break
+                tasks = cycle.result()
+            except Exception as e:
+                print(f"Poll failed: {e}")
+                status.update(last_error=str(e))
+            else:
+                status.poll_succeeded()
+                status.update(last_poll_changed=len(tasks))
+            finally:
+                stopped.cancel()
+                dead_letters.remove(counts["succeeded_keys"])
+                counts["succeeded_keys"].clear()
+
+            status.add(
+                polls=1,
+                successful_downloads=counts["successful"] - successful,
+                failed_downloads=counts["failed"] - failed,
+            )
+            next_poll = started + interval
+            status.update(
+                state="idle",
+                last_poll_at=datetime.fromtimestamp(started).isoformat(
+                    timespec="seconds"
+                ),
+                last_poll_duration=round(time() - started, 2),
+                next_poll_at=datetime.fromtimestamp(next_poll).isoformat(
+                    timespec="seconds"
+                ),
+            )
+            print(
+                f"Poll done in {time() - started:.1f} seconds, "
+                f"{counts['successful'] - successful} downloads refreshed"
+            )
+
+            try:
+                await asyncio.wait_for(stop_event.wait(), max(0, next_poll - time()))
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        status.update(state="stopping")
+        for downloader in downloaders:
+            downloader.cancel()
+        server.shutdown()
+        await asyncio.to_thread(scheduler.close)
+        await asyncio.to_thread(shutdown_pool)
+        await asyncio.to_thread(manifest.flush)
+        if USE_BLOB_STORE:
+            await asyncio.to_thread(get_blob_store().flush)
+
+
+async def serve(args):
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop_event.set)
+
+    periods = list(dict.fromkeys(args.periods))
+    if args.local_aggregates:
+        # The time-series store aggregates the daily series into the others
+        periods = ["diario"]
+
+    with StationCatalog() as catalog:
+        await run_daemon(
+            catalog,
+            DownloadManifest(),
+            periods,
+            args.regions,
+            args.contaminants,
+            args.stations,
+            args.interval,
+            args.status_port,
+            stop_event,
+            args.local_aggregates,
+        )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=POLL_INTERVAL,
+        help="Seconds between the starts of two polls of the region pages",
+    )
+    parser.add_argument(
+        "--status-port",
+        type=int,
+        default=STATUS_PORT,
+        help=f"Port of the health/status endpoint on {STATUS_HOST}",
+    )
+    parser.add_argument(
+        "--periods",
+        nargs="+",
+        choices=periodosPromedioOpcion.values(),
+        default=list(periodosPromedioOpcion.values()),
+        help="Averaging periods to download, all by default",
+    )
+    parser.add_argument(
+        "--local-aggregates",
+        action="store_true",
+        help="Only download the daily series and compute the quarterly and annual "
+        "ones from it",
+    )
+    parser.add_argument("--regions", nargs="+", help="Region codes like M or RM")
+    parser.add_argument("--contaminants", nargs="+", help="Contaminant codes")
+    parser.add_argument("--stations", nargs="+", help="Station names or keys")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    prepare_driver(USE_HTTP_ENGINE)
+
+    os.makedirs(CSV_CONTAMINANTS_DIR, exist_ok=True)
+    asyncio.run(serve(args))
+    print("Daemon stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,56 @@
-from time import sleep, time
+from time import time
 from datetime import datetime
+import argparse
 import json
 import os
 import re
-import concurrent.futures
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+import asyncio
+import io
+import sys
+from functools import partial
 from common.web_scraping import (
     CSV_CONTAMINANTS_DIR,
+    DEAD_LETTER_PATH,
+    METRICS_PATH,
     STATIONS_PATH,
-    setup_driver,
-    get_cached_driver_path,
+    TRACE_PATH,
+    prepare_driver,
+)
+from common.http_fetch import (
+    download_to_file,
+    download_to_store,
+    get_url_period,
+    resolve_csv_url,
+    with_date_range,
+    with_period,
+)
+from common.atomic_write import atomic_write_bytes
+from common.blob_store import get_blob_store
+from common.catalog import StationCatalog
+from common.telemetry import increment, span, start_trace, stop_trace, write_metrics
+from common.manifest import DownloadManifest, get_manifest_key
+from common.download_capture import ExportTooLargeError, capture_exports
+from common.download_watch import wait_for_download
+from common.browser_pool import (
+    DRIVER_MAX_TASKS,
+    borrow_driver,
+    init_worker,
+    shutdown_pool,
+)
+from common.scheduler import (
+    DownloadScheduler,
+    get_host,
+    is_overload_error,
+    mark_cached,
+    mark_fetched,
+    timed,
+)
+from common.resilience import (
+    RETRYABLE_ERRORS,
+    CircuitBreaker,
+    DeadLetterQueue,
+    RetryableError,
+    RetryPolicy,
 )
 
 
@@ -33,6 +72,34 @@ mapaContaminanteCodigo = {
 
 periodosPromedioOpcion = {1: "diario", 2: "trimestral", 3: "anual"}
 
+# Download over plain HTTP first and only fall back to Selenium when that fails
+USE_HTTP_ENGINE = True
+# Convert downloaded CSVs into the Parquet dataset after downloading
+WRITE_PARQUET = True
+# Parse downloaded CSVs into the memory-mapped series queried by dashboards
+WRITE_TIMESERIES = True
+# Keep downloaded CSVs in the content-addressed blob store, linked from their
+# usual names, so unchanged downloads are not written again
+USE_BLOB_STORE = True
+# In the Selenium fallback, fetch the export from the page into memory instead
+# of clicking the link and watching the browser's download directory
+CAPTURE_DOWNLOADS = True
+# Browsers alive at once for the Selenium fallback
+BROWSER_CONCURRENCY = max(1, (os.cpu_count() or 1) // 2)
+# Export link of the graph pages
+CSV_LINK_SELECTOR = "body > table > tbody > tr > td > table:nth-child(3) > tbody > tr:nth-child(1) > td > label > span.icon-file-excel > a"
+
+
+def get_retryable_task_errors():
+    """Errors after which a station contaminant is downloaded again; browser
+    errors (timeouts, crashed sessions) included.
+
+    Selenium is only imported here, so importing this module never loads it.
+    """
+    from selenium.common.exceptions import WebDriverException
+
+    return RETRYABLE_ERRORS + (WebDriverException,)
+
 
 def ask_for_period_option():
     option = input(
@@ -51,223 +118,928 @@ def clean_filename(text):
     return text.strip("_")
 
 
+def build_csv_filename(
+    region_code, station_name, contaminant_code, contaminant_data, period
+):
+    """Build the final CSV filename from station and contaminant information"""
+    # Get dates from contaminant data
+    from_date = contaminant_data.get("from_date", "unknown")
+    to_date = contaminant_data.get("to_date", "unknown")
+
+    # Create new filename with all components
+    clean_station = clean_filename(station_name)
+    contaminant_name = mapaContaminanteCodigo.get(contaminant_code)
+    return f"{region_code}_{clean_station}_{contaminant_name}_{from_date}_{to_date}_{period}.csv"
+
+
+def print_download_info(
+    region_code, station_name, contaminant_code, contaminant_data, file_path
+):
+    print(f"Downloaded and renamed:")
+    print(f"Region: {region_code}")
+    print(f"Station: {station_name}")
+    print(f"Contaminant: {mapaContaminanteCodigo.get(contaminant_code)}")
+    print(
+        f"Date range: {contaminant_data.get('from_date', 'unknown')} to {contaminant_data.get('to_date', 'unknown')}"
+    )
+    print(f"New filename: {os.path.basename(file_path)}")
+    print(f"Full path: {file_path}")
+
+
+class PeriodSession:
+    """Navigation state shared by the periods of one station contaminant.
+
+    The CSV export link is resolved from the first graph page and reused for the
+    other periods by switching its macro. The Selenium fallback keeps a single
+    borrowed driver for all periods.
+    """
+
+    def __init__(self):
+        self.csv_url = None
+        self._borrow = None
+        self._driver = None
+
+    def get_csv_url(self, graph_url, period, contaminant_data):
+        """Get the CSV export URL of a period, fetching a graph page only once"""
+        if self.csv_url is None or get_url_period(self.csv_url) is None:
+            # Export links without a macro period can't be switched, resolve
+            # them from every graph page
+            with span("resolve_csv_url"):
+                self.csv_url = resolve_csv_url(graph_url)
+            return self.csv_url
+
+        csv_url = with_period(self.csv_url, period)
+        from_date = contaminant_data.get("from_date")
+        to_date = contaminant_data.get("to_date")
+        if from_date and to_date:
+            csv_url = with_date_range(csv_url, from_date, to_date)
+        return csv_url
+
+    def get_driver(self):
+        """Borrow a driver from the pool on first use and keep it"""
+        if self._borrow is None:
+            borrow = borrow_driver()
+            self._driver = borrow.__enter__()
+            self._borrow = borrow
+        return self._driver
+
+    def release_driver(self, error=None):
+        """Give the driver back to the pool, which checks its health after an error"""
+        if self._borrow is None:
+            return
+        borrow, self._borrow, self._driver = self._borrow, None, None
+        if error is None:
+            borrow.__exit__(None, None, None)
+        else:
+            borrow.__exit__(type(error), error, error.__traceback__)
+
+    def close(self):
+        self.release_driver()
+
+
+def download_csv_http(
+    url,
+    region_code,
+    station_name,
+    contaminant_code,
+    contaminant_data,
+    period,
+    session=None,
+):
+    """Download CSV file over HTTP without a browser, resolving the export link from the graph page"""
+    if session is not None:
+        csv_url = session.get_csv_url(url, period, contaminant_data)
+    else:
+        with span("resolve_csv_url"):
+            csv_url = resolve_csv_url(url)
+
+    new_filename = build_csv_filename(
+        region_code, station_name, contaminant_code, contaminant_data, period
+    )
+    new_file_path = os.path.join(CSV_CONTAMINANTS_DIR, new_filename)
+
+    with span("http_download") as attributes:
+        if USE_BLOB_STORE:
+            download_to_store(csv_url, new_file_path, get_blob_store())
+        else:
+            download_to_file(csv_url, new_file_path)
+        attributes["size"] = os.path.getsize(new_file_path)
+
+    print_download_info(
+        region_code, station_name, contaminant_code, contaminant_data, new_file_path
+    )
+    return new_file_path
+
+
+def download_csv_capture(
+    driver,
+    url,
+    region_code,
+    station_name,
+    contaminant_code,
+    contaminant_data,
+    period,
+    session=None,
+):
+    """Download CSV file through the browser, keeping the export in memory.
+
+    The export link is fetched by the page itself, so nothing goes through the
+    driver's download directory. Once a graph page of the station contaminant
+    is open, the other periods are fetched from it without loading theirs.
+    Exports over CAPTURE_MAX_BYTES are downloaded by clicking the link instead.
+    """
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    csv_url = None
+    if (
+        session is not None
+        and session.csv_url
+        and get_url_period(session.csv_url)
+        and get_host(driver.current_url) == get_host(session.csv_url)
+    ):
+        csv_url = session.get_csv_url(url, period, contaminant_data)
+
+    if csv_url is None:
+        with span("driver_get"):
+            driver.get(url)
+        with span("button_wait"):
+            link = WebDriverWait(driver, 10).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, CSV_LINK_SELECTOR))
+            )
+        # The href property is absolute, unlike the attribute
+        csv_url = link.get_property("href")
+        if session is not None:
+            session.csv_url = csv_url
+
+    new_filename = build_csv_filename(
+        region_code, station_name, contaminant_code, contaminant_data, period
+    )
+    new_file_path = os.path.join(CSV_CONTAMINANTS_DIR, new_filename)
+
+    with span("capture_download") as attributes:
+        try:
+            (content,) = capture_exports(driver, [csv_url])
+        except ExportTooLargeError as e:
+            print(f"{e}, downloading it through the browser instead")
+            return download_csv(
+                driver,
+                url,
+                region_code,
+                station_name,
+                contaminant_code,
+                contaminant_data,
+                period,
+                expected_size=e.size,
+            )
+        attributes["size"] = len(content)
+
+        if USE_BLOB_STORE:
+            get_blob_store().put_stream(io.BytesIO(content), new_file_path)
+        else:
+            atomic_write_bytes(new_file_path, content)
+
+    print_download_info(
+        region_code, station_name, contaminant_code, contaminant_data, new_file_path
+    )
+    return new_file_path
+
+
 def download_csv(
-    driver, url, region_code, station_name, contaminant_code, contaminant_data, period
+    driver,
+    url,
+    region_code,
+    station_name,
+    contaminant_code,
+    contaminant_data,
+    period,
+    expected_size=None,
 ):
     """Download CSV file and rename it with station and contaminant information"""
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
     base_download_dir = CSV_CONTAMINANTS_DIR
-    process_id = os.getpid()
-    # Get the process-specific download directory
-    download_dir = os.path.join(base_download_dir, f"process_{process_id}")
+    # Get the driver-specific download directory
+    download_dir = driver.download_dir
 
     # Get list of files before download
     files_before = set(os.listdir(download_dir))  # Changed from base_download_dir
 
     # Perform the download
-    driver.get(url)
+    with span("driver_get"):
+        driver.get(url)
 
-    # Wait for any loading screen to disappear
+    # Wait for any loading screen to disappear. The page shows it from a script,
+    # so it can cover the button under the lean profile too; the wait returns at
+    # once when it is already hidden
     try:
-        screen_overlay = WebDriverWait(driver, 10).until(
-            EC.invisibility_of_element_located((By.CLASS_NAME, "screen"))
-        )
+        with span("overlay_wait"):
+            screen_overlay = WebDriverWait(driver, 10).until(
+                EC.invisibility_of_element_located((By.CLASS_NAME, "screen"))
+            )
     except Exception as e:
         print(f"Warning: Loading screen handling error: {e}")
 
     # Wait for the download button and try different methods to click it
-    csvFileSel = "body > table > tbody > tr > td > table:nth-child(3) > tbody > tr:nth-child(1) > td > label > span.icon-file-excel > a"
     try:
-        download_button = WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.CSS_SELECTOR, csvFileSel))
+        with span("button_wait_click"):
+            download_button = WebDriverWait(driver, 10).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, CSV_LINK_SELECTOR))
+            )
+
+            # Try clicking with JavaScript if normal click doesn't work
+            try:
+                download_button.click()
+            except Exception as e:
+                print("Regular click failed, trying JavaScript click...")
+                driver.execute_script("arguments[0].click();", download_button)
+
+    except Exception as e:
+        print(f"Error clicking download button: {e}")
+        raise
+
+    # Wait for the browser to finish writing the file and rename it
+    with span("download_wait", expected_size=expected_size):
+        original_file_path = wait_for_download(
+            download_dir, files_before, expected_size
         )
+    if not original_file_path:
+        print("No new file detected after download attempt")
+        return None
+
+    # Place the final file in the base download directory
+    new_filename = build_csv_filename(
+        region_code, station_name, contaminant_code, contaminant_data, period
+    )
+    new_file_path = os.path.join(base_download_dir, new_filename)
+
+    # Rename the file
+    with span("rename"):
+        if USE_BLOB_STORE:
+            get_blob_store().put_file(original_file_path, new_file_path)
+        else:
+            os.replace(original_file_path, new_file_path)
+
+    print_download_info(
+        region_code,
+        station_name,
+        contaminant_code,
+        contaminant_data,
+        new_file_path,
+    )
+
+    return new_file_path
 
-        # Try clicking with JavaScript if normal click doesn't work
+
+def fetch_station_contaminant(
+    url,
+    region_code,
+    station_name,
+    contaminant_code,
+    contaminant_data,
+    period,
+    expected_size=None,
+    session=None,
+):
+    """Fetch a single station-contaminant CSV, over HTTP when possible and
+    otherwise with a pooled driver. A PeriodSession shares the export link and
+    the driver with the other periods of the station contaminant."""
+    if USE_HTTP_ENGINE:
         try:
-            download_button.click()
+            return download_csv_http(
+                url,
+                region_code,
+                station_name,
+                contaminant_code,
+                contaminant_data,
+                period,
+                session,
+            )
         except Exception as e:
-            print("Regular click failed, trying JavaScript click...")
-            driver.execute_script("arguments[0].click();", download_button)
+            # The server is overloaded or unreachable, let the scheduler back off
+            if is_overload_error(e):
+                raise
+            print(
+                f"HTTP download failed for {region_code} - {station_name} - {contaminant_code}: {e}. Falling back to Selenium..."
+            )
+
+    if CAPTURE_DOWNLOADS:
+        download = partial(download_csv_capture, session=session)
+    else:
+        download = partial(download_csv, expected_size=expected_size)
 
+    if session is None:
+        with borrow_driver() as driver:
+            return download(
+                driver,
+                url,
+                region_code,
+                station_name,
+                contaminant_code,
+                contaminant_data,
+                period,
+            )
+
+    try:
+        return download(
+            session.get_driver(),
+            url,
+            region_code,
+            station_name,
+            contaminant_code,
+            contaminant_data,
+            period,
+        )
     except Exception as e:
-        print(f"Error clicking download button: {e}")
+        session.release_driver(e)
         raise
 
-    # Wait for new file to appear and rename it
-    max_wait = 5  # Maximum seconds to wait for download
-    while max_wait > 0:
-        sleep(1)
-        # Check for new files in the process-specific directory
-        files_after = set(os.listdir(download_dir))  # Changed from base_download_dir
-        new_files = files_after - files_before
-
-        if new_files:
-            original_file = next(iter(new_files))
-            original_file_path = os.path.join(download_dir, original_file)
-
-            # Get dates from contaminant data
-            from_date = contaminant_data.get("from_date", "unknown")
-            to_date = contaminant_data.get("to_date", "unknown")
-
-            # Create new filename with all components
-            clean_station = clean_filename(station_name)
-            contaminant_name = mapaContaminanteCodigo.get(contaminant_code)
-            new_filename = f"{region_code}_{clean_station}_{contaminant_name}_{from_date}_{to_date}_{period}.csv"
-            # Place the final file in the base download directory
-            new_file_path = os.path.join(base_download_dir, new_filename)
-
-            # Rename the file
-            if os.path.exists(new_file_path):
-                os.remove(new_file_path)
-            os.rename(original_file_path, new_file_path)
-
-            # Clean up process directory if empty
-            if not os.listdir(download_dir):
-                os.rmdir(download_dir)
-
-            print(f"Downloaded and renamed:")
-            print(f"Region: {region_code}")
-            print(f"Station: {station_name}")
-            print(f"Contaminant: {contaminant_name}")
-            print(f"Date range: {from_date} to {to_date}")
-            print(f"New filename: {new_filename}")
-            print(f"Full path: {new_file_path}")
-
-            return new_file_path
-
-        max_wait -= 1
-
-    print("No new file detected after download attempt")
-    return None
-
-
-def ensure_driver_cached():
-    """Ensure GeckoDriver is downloaded and cached before parallel processing"""
-    print("Ensuring GeckoDriver is cached...")
-    driver = None
+
+def get_delta_from_date(to_date, period):
+    """Get the first date to fetch when extending a series that ended at to_date.
+
+    Averaging periods are recomputed by the server over the requested range, so
+    the delta starts at the beginning of the quarter or year containing to_date.
+    """
+    date = datetime.strptime(to_date, "%y%m%d")
+    if period == "trimestral":
+        date = date.replace(month=3 * ((date.month - 1) // 3) + 1, day=1)
+    elif period == "anual":
+        date = date.replace(month=1, day=1)
+    return date.strftime("%y%m%d")
+
+
+def plan_download(entry, contaminant_data, period):
+    """Decide how to bring a download up to date.
+
+    Returns:
+        tuple: ("skip", None), ("full", None) or ("delta", from_date)
+    """
+    if not entry or not DownloadManifest.is_file_intact(entry):
+        return "full", None
+
+    from_date = contaminant_data.get("from_date")
+    to_date = contaminant_data.get("to_date")
+
+    if entry.get("from_date") != from_date or not to_date:
+        return "full", None
+    if entry.get("to_date") == to_date:
+        return "skip", None
+    if not entry.get("to_date") or datetime.strptime(
+        entry["to_date"], "%y%m%d"
+    ) > datetime.strptime(to_date, "%y%m%d"):
+        return "full", None
+
+    return "delta", get_delta_from_date(entry["to_date"], period)
+
+
+def get_row_key(line):
+    """Sortable (date, time) key of a SINCA CSV row with a YYMMDD date"""
+    fields = line.split(";")
+    date = fields[0].strip()
+    # Two-digit years follow strptime's pivot: 69-99 -> 19xx, 00-68 -> 20xx
+    century = "19" if date[:2] >= "69" else "20"
+    return century + date, fields[1].strip() if len(fields) > 1 else ""
+
+
+def merge_csv_series(existing_path, delta_path, dest_path):
+    """Merge a delta download into an existing SINCA CSV.
+
+    Rows are keyed by their date and time columns. Existing rows from the first
+    delta row onwards are replaced by the delta rows.
+    """
+    with open(existing_path, "r", encoding="latin-1", newline="") as f:
+        existing_lines = f.read().splitlines()
+    with open(delta_path, "r", encoding="latin-1", newline="") as f:
+        delta_lines = f.read().splitlines()
+
+    header, existing_rows = existing_lines[:1], existing_lines[1:]
+    delta_rows = [line for line in delta_lines[1:] if line.strip()]
+
+    if delta_rows:
+        first_key = get_row_key(delta_rows[0])
+        existing_rows = [
+            line for line in existing_rows if get_row_key(line) < first_key
+        ]
+
+    content = "\n".join(header + existing_rows + delta_rows) + "\n"
+    atomic_write_bytes(dest_path, content.encode("latin-1"))
+
+    os.remove(delta_path)
+    if os.path.abspath(existing_path) != os.path.abspath(dest_path):
+        os.remove(existing_path)
+    return dest_path
+
+
+def process_station_contaminant(
+    region_code,
+    station_name,
+    station_data,
+    contaminant_code,
+    contaminant_data,
+    period,
+    manifest=None,
+    session=None,
+):
+    """Process a single station-contaminant combination, skipping it when the
+    manifest shows it is up to date and fetching only new dates when it has grown.
+    Errors are raised for the scheduler's retry policy to handle."""
+    file_path = None
     try:
-        driver = setup_driver()
-        cached_path = get_cached_driver_path()
-        if os.path.exists(cached_path):
-            print(f"GeckoDriver successfully cached at: {cached_path}")
-            return True
-    except Exception as e:
-        print(f"Error caching driver: {e}")
-        return False
+        with span(
+            "download_task",
+            region=region_code,
+            station=station_name,
+            contaminant=contaminant_code,
+            period=period,
+        ) as attributes:
+            file_path = _process_station_contaminant(
+                region_code,
+                station_name,
+                station_data,
+                contaminant_code,
+                contaminant_data,
+                period,
+                manifest,
+                attributes,
+                session,
+            )
     finally:
-        if driver:
-            driver.quit()
+        result = "ok" if file_path else "failed"
+        increment("tasks_total", stage="download", result=result)
+    return file_path
 
 
-def process_station_contaminant(
-    region_code, station_name, station_data, contaminant_code, contaminant_data, period
+def process_station_contaminant_periods(
+    region_code,
+    station_name,
+    station_data,
+    contaminant_code,
+    contaminant_data,
+    periods,
+    manifest=None,
+):
+    """Process every requested period of a station contaminant in one session.
+
+    Returns:
+        list: File path of each period, None for the periods that failed
+    """
+    session = PeriodSession()
+    try:
+        return [
+            process_station_contaminant(
+                region_code,
+                station_name,
+                station_data,
+                contaminant_code,
+                contaminant_data,
+                period,
+                manifest,
+                session,
+            )
+            for period in periods
+        ]
+    finally:
+        session.close()
+
+
+def _process_station_contaminant(
+    region_code,
+    station_name,
+    station_data,
+    contaminant_code,
+    contaminant_data,
+    period,
+    manifest,
+    attributes,
+    session,
 ):
-    """Process a single station-contaminant combination with its own driver instance"""
-    driver = None
+    # The catalog keeps the URL of one period, switch its macro to this one
+    url = with_period(contaminant_data.get("graph_url"), period)
+    key = get_manifest_key(region_code, station_name, contaminant_code, period)
+    entry = manifest.get(key) if manifest else None
+
+    action, delta_from = plan_download(entry, contaminant_data, period)
+    attributes["action"] = action
+    if action == "skip":
+        print(f"Up to date, skipping: {os.path.basename(entry['path'])}")
+        mark_cached()
+        return entry["path"]
+    mark_fetched()
+
+    fetch_data = contaminant_data
+    if action == "delta":
+        print(
+            f"Fetching new data for {region_code} - {station_name} - {contaminant_code} "
+            f"from {delta_from} to {contaminant_data.get('to_date')}"
+        )
+        fetch_data = dict(contaminant_data, from_date=delta_from)
+        url = with_date_range(url, delta_from, contaminant_data.get("to_date"))
+
     try:
-        driver = setup_driver(CSV_CONTAMINANTS_DIR)
-        return download_csv(
-            driver,
-            contaminant_data.get("graph_url"),
+        # The previous size of a full download scales the browser's wait
+        expected_size = entry.get("size") if entry and action == "full" else None
+        file_path = fetch_station_contaminant(
+            url,
             region_code,
             station_name,
             contaminant_code,
-            contaminant_data,
+            fetch_data,
             period,
+            expected_size,
+            session,
         )
     except Exception as e:
-        print(
-            f"Error processing {region_code} - {station_name} - {contaminant_code}: {e}"
+        if not is_overload_error(e):
+            print(
+                f"Error processing {region_code} - {station_name} - {contaminant_code}: {e}"
+            )
+        raise
+
+    if not file_path:
+        raise RetryableError(
+            f"No file was downloaded for {region_code} - {station_name} - {contaminant_code}"
         )
-        return None
+
+    final_path = os.path.join(
+        CSV_CONTAMINANTS_DIR,
+        build_csv_filename(
+            region_code, station_name, contaminant_code, contaminant_data, period
+        ),
+    )
+    if action == "delta":
+        with span("merge"):
+            file_path = merge_csv_series(entry["path"], file_path, final_path)
+            if USE_BLOB_STORE:
+                # The merged series is new content, store it as its own blob
+                get_blob_store().put_file(file_path)
+        print(f"Merged new data into: {os.path.basename(file_path)}")
+    elif entry and entry.get("path") != file_path and os.path.exists(entry["path"]):
+        # The date range changed, drop the file named after the old range
+        os.remove(entry["path"])
+
+    if manifest:
+        sha256 = get_blob_store().get_hash(file_path) if USE_BLOB_STORE else None
+        manifest.record(key, file_path, contaminant_data, period, sha256)
+    return file_path
+
+
+def write_parquet_dataset(tasks, manifest):
+    """Add the downloaded CSVs of tasks to the Parquet dataset, partitioned by
+    region/contaminant/period. Files already ingested with the same hash are skipped."""
+    try:
+        from common.parquet_store import (
+            load_ingested,
+            save_ingested,
+            write_station_series,
+        )
+    except ImportError as e:
+        print(f"Parquet export skipped, pyarrow is not available: {e}")
+        return 0
+
+    ingested = load_ingested()
+    written = 0
+
+    for region_code, station_name, station_data, contaminant_code, _, period in tasks:
+        key = get_manifest_key(region_code, station_name, contaminant_code, period)
+        entry = manifest.get(key)
+        if not entry or not DownloadManifest.is_file_intact(entry):
+            continue
+        if ingested.get(key) == entry["sha256"]:
+            continue
+
+        try:
+            write_station_series(
+                entry["path"],
+                region_code,
+                mapaContaminanteCodigo.get(contaminant_code, contaminant_code),
+                period,
+                station_name,
+                station_data.get("key"),
+                clean_filename(station_name),
+            )
+        except Exception as e:
+            print(f"Error writing {os.path.basename(entry['path'])} to Parquet: {e}")
+            continue
+
+        ingested[key] = entry["sha256"]
+        written += 1
+
+    save_ingested(ingested)
+    print(f"Parquet dataset updated with {written} series")
+    return written
+
+
+def write_timeseries_store(tasks, manifest):
+    """Parse the downloaded CSVs of tasks into the time-series store. Files already
+    parsed with the same hash are skipped."""
+    from common.timeseries_store import TimeSeriesStore
+
+    store = TimeSeriesStore()
+    written = 0
+
+    for region_code, station_name, station_data, contaminant_code, _, period in tasks:
+        key = get_manifest_key(region_code, station_name, contaminant_code, period)
+        entry = manifest.get(key)
+        if not entry or not DownloadManifest.is_file_intact(entry):
+            continue
+
+        try:
+            if store.ingest(
+                entry["path"],
+                region_code,
+                station_data.get("key"),
+                contaminant_code,
+                period,
+                station_name,
+                entry["sha256"],
+            ):
+                written += 1
+        except Exception as e:
+            print(f"Error adding {os.path.basename(entry['path'])} to the series: {e}")
+
+    print(f"Time-series store updated with {written} series")
+    return written
+
+
+def build_tasks(
+    catalog, period, regions=None, contaminants=None, stations=None, updated_since=None
+):
+    """Build the download tasks of the station contaminants matching the filters.
+
+    Args:
+        catalog (StationCatalog): Catalog filled by get_all_stations_data
+        period (str): Averaging period, one of periodosPromedioOpcion
+        regions (list): Region codes like "M" or "RM", all when None
+        contaminants (list): Contaminant codes like "PM25", all when None
+        stations (list): Station names or keys, all when None
+        updated_since (str): ISO date, only series whose dates changed since then
+
+    Returns:
+        list: (region_code, station_name, station_data, contaminant_code,
+              contaminant_data, period) tuples
+    """
+    return [
+        (*row, period)
+        for row in catalog.iter_station_contaminants(
+            regions, contaminants, stations, updated_since
+        )
+    ]
+
+
+def group_tasks_by_pair(tasks):
+    """Merge the tasks of each station contaminant into a single task.
+
+    Returns:
+        list: (region_code, station_name, station_data, contaminant_code,
+              contaminant_data, periods) tuples, in the order of the first task
+              of each pair
+    """
+    groups = {}
+    for (
+        region_code,
+        station_name,
+        station_data,
+        contaminant_code,
+        contaminant_data,
+        period,
+    ) in tasks:
+        key = (region_code, station_name, contaminant_code)
+        if key not in groups:
+            groups[key] = (
+                region_code,
+                station_name,
+                station_data,
+                contaminant_code,
+                contaminant_data,
+                [],
+            )
+        if period not in groups[key][5]:
+            groups[key][5].append(period)
+    return list(groups.values())
+
+
+def get_task_key(task):
+    region_code, station_name, _, contaminant_code, _, period = task
+    return get_manifest_key(region_code, station_name, contaminant_code, period)
+
+
+def is_task_done(task, manifest):
+    """Check whether the manifest has an up-to-date file for a task"""
+    entry = manifest.get(get_task_key(task))
+    return plan_download(entry, task[4], task[5])[0] == "skip"
+
+
+async def run_pair(scheduler, process_task, task, manifest, dead_letters=None):
+    """Run the task of a station contaminant and all its periods on the scheduler.
+
+    Returns:
+        tuple: The task and the file path of each of its periods, None for the
+               periods that failed, which are added to dead_letters
+    """
+    try:
+        return task, await scheduler.run(
+            process_task, *task, host=get_host(task[4].get("graph_url"))
+        )
+    except Exception as e:
+        print(f"Task failed: {e}")
+        # Periods done before the failure are kept, the rest dead-lettered
+        results = []
+        for period in task[5]:
+            period_task = (*task[:5], period)
+            if is_task_done(period_task, manifest):
+                results.append(manifest.get(get_task_key(period_task))["path"])
+                continue
+            results.append(None)
+            if dead_letters is not None:
+                dead_letters.add(get_task_key(period_task), period_task, e)
+        return task, results
+
+
+async def run_downloads(tasks, manifest, latencies=None, dead_letters=None):
+    """Download all tasks from this process and return (successful, failed) counts.
+
+    The periods of a station contaminant are downloaded together in one session,
+    and retried together with the periods already done skipped. Tasks still
+    failing are added to dead_letters, tasks that succeed are removed from it.
+    When latencies is a list, the duration of every pair attempt is appended to it.
+    """
+    scheduler = DownloadScheduler(
+        retry_policy=RetryPolicy(retryable=get_retryable_task_errors()),
+        circuit_breaker=CircuitBreaker(),
+    )
+    print(
+        f"Using up to {scheduler.max_concurrency} concurrent downloads "
+        f"({scheduler.min_host_concurrency}-{scheduler.per_host_concurrency} per host, "
+        "adapted to the server's response)"
+    )
+
+    # Drivers are shared by the scheduler threads and only started when a
+    # download has to fall back to Selenium
+    init_worker(
+        CSV_CONTAMINANTS_DIR,
+        DRIVER_MAX_TASKS,
+        eager=not USE_HTTP_ENGINE,
+        max_drivers=BROWSER_CONCURRENCY,
+    )
+
+    process_task = partial(process_station_contaminant_periods, manifest=manifest)
+    if latencies is not None:
+        process_task = timed(process_task, latencies)
+
+    successful_downloads = 0
+    failed_downloads = 0
+    succeeded_keys = []
+
+    futures = [
+        run_pair(scheduler, process_task, task, manifest, dead_letters)
+        for task in group_tasks_by_pair(tasks)
+    ]
+
+    try:
+        # Process completed tasks as they finish
+        for future in asyncio.as_completed(futures):
+            task, results = await future
+            for period, result in zip(task[5], results):
+                if result:
+                    successful_downloads += 1
+                    succeeded_keys.append(get_task_key((*task[:5], period)))
+                    print(f"Successfully downloaded: {os.path.basename(result)}")
+                else:
+                    failed_downloads += 1
     finally:
-        if driver:
-            driver.quit()
+        await asyncio.to_thread(scheduler.close)
+        await asyncio.to_thread(shutdown_pool)
+        await asyncio.to_thread(manifest.flush)
+        if USE_BLOB_STORE:
+            await asyncio.to_thread(get_blob_store().flush)
+        if dead_letters is not None:
+            dead_letters.remove(succeeded_keys)
+
+    for host, limit in scheduler.get_host_limits().items():
+        print(f"Final concurrency for {host}: {limit}")
+
+    return successful_downloads, failed_downloads
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Download the CSV series of the stations in the catalog"
+    )
+    parser.add_argument(
+        "--periods",
+        nargs="+",
+        choices=periodosPromedioOpcion.values(),
+        help="Averaging periods to download; asked for when run from a terminal, "
+        "all periods otherwise",
+    )
+    parser.add_argument("--regions", nargs="+", help="Region codes like M or RM")
+    parser.add_argument("--contaminants", nargs="+", help="Contaminant codes")
+    parser.add_argument("--stations", nargs="+", help="Station names or keys")
+    parser.add_argument(
+        "--updated-since",
+        help="ISO date, only series whose dates changed since then",
+    )
+    parser.add_argument(
+        "--retry-failed",
+        action="store_true",
+        help=f"Only replay the downloads that failed before, from {DEAD_LETTER_PATH}",
+    )
+    parser.add_argument(
+        "--local-aggregates",
+        action="store_true",
+        help="Only download the daily series and compute the quarterly and annual "
+        "ones from it",
+    )
+    return parser.parse_args()
+
+
+def get_periods(args):
+    """Get the periods to download from the arguments or the user"""
+    if args.local_aggregates:
+        # The time-series store aggregates the daily series into the other periods
+        return ["diario"]
+    if args.periods:
+        return list(dict.fromkeys(args.periods))
+    if sys.stdin.isatty():
+        opcion = ask_for_period_option()
+        return [periodosPromedioOpcion[int(opcion)]]
+    # Run by cron or another scheduler, nobody can answer the prompt
+    return list(periodosPromedioOpcion.values())
 
 
 def main():
+    args = parse_args()
     start_time = time()
     start_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print(f"Starting downloads at: {start_datetime}")
 
-    try:
-        # First ensure driver is cached
-        if not ensure_driver_cached():
-            raise Exception("Failed to cache GeckoDriver")
-
-        # Check if file exists
-        if not os.path.exists(STATIONS_PATH):
-            raise FileNotFoundError(
-                f"The file {STATIONS_PATH} does not exist. Please get all stations data first."
-            )
+    successful_downloads = 0
+    failed_downloads = 0
+    start_trace(TRACE_PATH)
 
-        # read json file
-        with open(STATIONS_PATH, "r", encoding="utf-8") as f:
-            try:
-                stations_data = json.loads(f.read())
-                if not isinstance(stations_data, dict):
-                    raise TypeError(
-                        "JSON data must be an object/dictionary at root level"
-                    )
-            except json.JSONDecodeError as je:
-                print(f"Invalid JSON format: {je}")
-                raise
+    try:
+        prepare_driver(USE_HTTP_ENGINE)
 
         # Create downloads directory if it doesn't exist
         os.makedirs(CSV_CONTAMINANTS_DIR, exist_ok=True)
+        dead_letters = DeadLetterQueue()
 
-        # Create a list of all tasks to process
-        tasks = []
-        opcion = ask_for_period_option()
-        period = periodosPromedioOpcion[int(opcion)]
-
-        for region_code, region_data in stations_data.items():
-            if not isinstance(region_data, dict) or "stations" not in region_data:
-                continue
-
-            for station_name, station_data in region_data["stations"].items():
-                for contaminant_code, contaminant_data in station_data.get(
-                    "contaminants", {}
-                ).items():
-                    tasks.append(
-                        (
-                            region_code,
-                            station_name,
-                            station_data,
-                            contaminant_code,
-                            contaminant_data,
-                            period,
+        if args.retry_failed:
+            tasks = [tuple(record["task"]) for record in dead_letters.load().values()]
+            print(f"Retrying {len(tasks)} failed downloads...")
+        else:
+            with StationCatalog() as catalog:
+                if catalog.is_empty():
+                    # Catalogs are created by get_all_stations_data, older runs
+                    # only left the JSON file behind
+                    if not os.path.exists(STATIONS_PATH):
+                        raise FileNotFoundError(
+                            f"The file {STATIONS_PATH} does not exist. Please get all stations data first."
                         )
+                    print(f"Importing {STATIONS_PATH} into {catalog.path}")
+                    catalog.import_json(STATIONS_PATH)
+
+                periods = get_periods(args)
+                tasks = []
+                for period in periods:
+                    tasks += build_tasks(
+                        catalog,
+                        period,
+                        args.regions,
+                        args.contaminants,
+                        args.stations,
+                        args.updated_since,
                     )
+            print(f"Processing {len(tasks)} downloads for {', '.join(periods)}...")
 
-        print(f"Processing {len(tasks)} downloads...")
-
-        # Maximum number of concurrent processes based on CPU cores (divided by 2 for resource management)
-        max_workers = min(len(tasks), os.cpu_count() or 1) // 2
-        print(f"Using {max_workers} concurrent workers")
-
-        successful_downloads = 0
-        failed_downloads = 0
-
-        # Process tasks concurrently
-        with concurrent.futures.ProcessPoolExecutor(
-            max_workers=max_workers
-        ) as executor:
-            futures = []
-            for task in tasks:
-                futures.append(executor.submit(process_station_contaminant, *task))
-
-            # Process completed tasks as they finish
-            for future in concurrent.futures.as_completed(futures):
-                try:
-                    result = future.result()
-                    if result:
-                        successful_downloads += 1
-                        print(f"Successfully downloaded: {os.path.basename(result)}")
-                    else:
-                        failed_downloads += 1
-                except Exception as e:
-                    failed_downloads += 1
-                    print(f"Task failed: {e}")
+        # Completed downloads are recorded as they finish so reruns skip them
+        manifest = DownloadManifest()
+        with span("downloads", tasks=len(tasks)):
+            successful_downloads, failed_downloads = asyncio.run(
+                run_downloads(tasks, manifest, dead_letters=dead_letters)
+            )
+        if failed_downloads:
+            print(
+                f"{failed_downloads} failed downloads saved to {DEAD_LETTER_PATH}, "
+                "replay them with --retry-failed"
+            )
+
+        if WRITE_PARQUET:
+            with span("parquet_export"):
+                write_parquet_dataset(tasks, manifest)
+
+        if WRITE_TIMESERIES or args.local_aggregates:
+            with span("timeseries_export"):
+                write_timeseries_store(tasks, manifest)
+
+        if USE_BLOB_STORE:
+            # Files replaced by merges or newer date ranges leave blobs behind
+            removed = get_blob_store().collect_garbage()
+            print(f"Removed {removed} unreferenced blobs")
 
     except FileNotFoundError as e:
         print(f"Error: {e}")
@@ -290,6 +1062,10 @@ def main():
     print(f"Failed downloads: {failed_downloads}")
     print(f"Total downloads attempted: {successful_downloads + failed_downloads}")
 
+    stop_trace()
+    write_metrics(METRICS_PATH)
+    print(f"Phase timings saved to {TRACE_PATH} and {METRICS_PATH}")
+
 
 if __name__ == "__main__":
     main()
@@ -1,19 +1,32 @@
 import os
 import re
-import json
-import concurrent.futures
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+import asyncio
 from urllib.parse import quote
 from common.web_scraping import (
-    STATIONS_DIR,
-    setup_driver,
+    SINCA_HOST,
     STATIONS_PATH,
-    get_cached_driver_path,
+    METRICS_PATH,
+    TRACE_PATH,
+    prepare_driver,
 )
+from common.browser_pool import (
+    DRIVER_MAX_TASKS,
+    borrow_driver,
+    init_worker,
+    shutdown_pool,
+)
+from common.scheduler import (
+    DownloadScheduler,
+    get_host,
+    is_overload_error,
+    timed,
+)
+from common.catalog import StationCatalog
+from common.http_fetch import fetch_text
+from common.telemetry import increment, span, start_trace, stop_trace, write_metrics
+from common.region_parser import parse_region_page
 
-base_url = "https://sinca.mma.gob.cl/index.php/region/index/id/"
+base_url = f"{SINCA_HOST}/index.php/region/index/id/"
 
 
 def getMacroURL(current_region_code, station_key, contaminant_code, periodo_promedio):
@@ -58,20 +71,30 @@ regiones = [
 ]
 mapaRegionUrls = {f"R{region}": f"{base_url}{region}" for region in regiones}
 
+# Fetch region pages over plain HTTP first and only fall back to Selenium
+USE_HTTP_ENGINE = True
 
-def get_tipo_estacion(estacion, nombre_tipo):
 
-    try:
-        estacion.find_element(
-            By.CSS_SELECTOR, f"span[title='{tiposEstacion[nombre_tipo]}']"
-        )
-        return True
-    except:
-        return False
+# Single pattern scanning a station URL once for every field of interest
+URL_DATA_PATTERN = re.compile(
+    r"/(?P<region_code>[IVXRM]+)(?=/)(?=/(?P<station_key>[^/]+)/Cal/)?"
+    r"|/id/(?P<station_id>\d+)"
+    r"|macro=(?=(?P<contaminant_code>[^\.]+)\.)"
+    r"|&from=(?P<from_date>\d{6})(?=&)"
+    r"|&to=(?P<to_date>\d{6})(?=&)"
+)
+URL_DATA_FIELDS = (
+    "region_code",
+    "station_key",
+    "station_id",
+    "contaminant_code",
+    "from_date",
+    "to_date",
+)
 
 
 def extract_url_data(link):
-    """Extract all relevant data from a station URL using regex patterns.
+    """Extract all relevant data from a station URL in a single regex scan.
 
     Args:
         link (str): The URL to parse
@@ -80,137 +103,153 @@ def extract_url_data(link):
         dict: Dictionary containing extracted data (region_code, station_key, station_id,
               contaminant_code, from_date, to_date)
     """
-    # Define all regex patterns
-    REGION_CODE_PATTERN = r"/([IVXRM]+)/"
-    STATION_KEY_PATTERN = r"/[IVXRM]+/([^/]+)/Cal/"
-    STATION_ID_PATTERN = r"/id/(\d+)"
-    CONTAMINANT_PATTERN = r"macro=([^\.]+)\."
-    FROM_DATE_PATTERN = r"\&from=(\d{6})\&"
-    TO_DATE_PATTERN = r"\&to=(\d{6})\&"
-
     # Initialize result dictionary
-    result = {
-        "region_code": None,
-        "station_key": None,
-        "station_id": None,
-        "contaminant_code": None,
-        "from_date": None,
-        "to_date": None,
-    }
+    result = dict.fromkeys(URL_DATA_FIELDS)
 
-    # Extract data using regex patterns
-    region_match = re.search(REGION_CODE_PATTERN, link)
-    station_key_match = re.search(STATION_KEY_PATTERN, link)
-    station_id_match = re.search(STATION_ID_PATTERN, link)
-    contaminant_match = re.search(CONTAMINANT_PATTERN, link)
-    from_match = re.search(FROM_DATE_PATTERN, link)
-    to_match = re.search(TO_DATE_PATTERN, link)
-
-    # Update result dictionary with matched groups
-    if region_match:
-        result["region_code"] = region_match.group(1)
-    if station_key_match:
-        result["station_key"] = station_key_match.group(1)
-    if station_id_match:
-        result["station_id"] = station_id_match.group(1)
-    if contaminant_match:
-        result["contaminant_code"] = contaminant_match.group(1)
-    if from_match:
-        result["from_date"] = from_match.group(1)
-    if to_match:
-        result["to_date"] = to_match.group(1)
+    # The first occurrence of each field wins
+    for match in URL_DATA_PATTERN.finditer(link):
+        for field, value in match.groupdict().items():
+            if value is not None and result[field] is None:
+                result[field] = value
 
     return result
 
 
+def buildGraphUrl(region_code, station_key, station_name, contaminant_code, dates):
+    """Build the apub.htmlindico2.cgi graph URL of a station contaminant"""
+    encoded_station_name = quote(station_name)
+    macroURL = getMacroURL(
+        region_code,
+        station_key,
+        contaminant_code,
+        periodosPromedio["anual"],
+    )
+    return (
+        f"{SINCA_HOST}/cgi-bin/APUB-MMA/apub.htmlindico2.cgi"
+        f"?page=pageRight"
+        f"&header={encoded_station_name}"
+        f"&gsize=1495x708"
+        f"&period=specified"
+        f"&from={dates['from_date']}"
+        f"&to={dates['to_date']}"
+        f"{macroURL}"
+        f"&limgfrom=&limgto=&limdfrom=&limdto=&rsrc=&stnkey="
+    )
+
+
 def getRegionStations(driver, regionUrl):
-    stations_by_region = {}
-    contaminants = {}
+    """Render a region page with Selenium and parse its source in one pass"""
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
     if not regionUrl:
         print("Invalid region URL")
         return
 
-    try:
-        # Navigate to the page
+    # Navigate to the page
+    with span("driver_get"):
         driver.get(regionUrl)
-        # Wait for the caption element to be present
-        caption = WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.CSS_SELECTOR, "caption#tableRows"))
-        )
-
-        # Get the caption text and extract just the number
-        caption_text = caption.text
-        numberStations = caption_text.split(":")[1].strip()
-
-        selector_estacion = "#tablaRegional > tbody > tr"
-        selector_tags_link_estaciones = "#tablaRegional > tbody > tr > td > a"
-
+    try:
+        # Wait for the caption and the table rows to be present
+        with span("table_wait"):
+            WebDriverWait(driver, 10).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, "caption#tableRows"))
+            )
+            WebDriverWait(driver, 10).until(
+                EC.presence_of_all_elements_located(
+                    (By.CSS_SELECTOR, "#tablaRegional > tbody > tr")
+                )
+            )
     except Exception as e:
         print(f"An error occurred: {e}")
 
-    try:
-        # Create empty lists to store station data
-        estaciones_info_basica = []
-        estaciones_ids = []
-        estaciones_keys = []
-        current_region_code = None
+    with span("page_source"):
+        html = driver.page_source
+    return parseRegionStations(html, regionUrl)
 
-        # Wait for the table rows to be present
-        estaciones = WebDriverWait(driver, 10).until(
-            EC.presence_of_all_elements_located((By.CSS_SELECTOR, selector_estacion))
-        )
-        tags_link_estaciones = WebDriverWait(driver, 10).until(
-            EC.presence_of_all_elements_located(
-                (By.CSS_SELECTOR, selector_tags_link_estaciones)
-            )
-        )
-        # Get station basic data
-        for estacion in estaciones:
-            # Get the name of the station
-            nombre = estacion.find_element(By.CSS_SELECTOR, "a")
-            ficha_url = nombre.get_attribute("href")
-
-            # Get types of station by checking element existence
-            estaciones_info_basica.append(
-                {
-                    "nombre": nombre.text.strip(),
-                    "ficha_url": ficha_url,
-                    "en_linea": get_tipo_estacion(estacion, tiposEstacion["en línea"]),
-                    "estacion_meteorologica": get_tipo_estacion(
-                        estacion, tiposEstacion["estación meteorológica"]
-                    ),
-                    "estacion_publica": get_tipo_estacion(
-                        estacion, tiposEstacion["estación pública"]
-                    ),
-                }
-            )
 
-        urls_estaciones = [link.get_attribute("href") for link in tags_link_estaciones]
+def getRegionStationsHttp(regionUrl, revalidate=False):
+    """Fetch a region page over HTTP, without a browser, and parse it. With
+    revalidate, a cached page is checked with the server however fresh it is."""
+    if not regionUrl:
+        print("Invalid region URL")
+        return
+
+    with span("fetch_region"):
+        html = fetch_text(regionUrl, "region", revalidate)
+    return parseRegionStations(html, regionUrl)
+
 
-        for url in urls_estaciones:
-            print(f"\nAnalyzing url: {url}")
+def parseRegionStations(html, regionUrl):
+    """Build the stations of a region from its page source"""
+    stations_by_region = {}
 
-            # Extract all URL data using the new function
-            url_data = extract_url_data(url)
+    with span("parse_region", size=len(html)):
+        page = parse_region_page(html, regionUrl)
+    if not page["rows"]:
+        raise ValueError(f"No station rows found in {regionUrl}")
+    numberStations = page["number_stations"]
 
-            if url_data["region_code"] and url_data["station_key"]:
-                current_region_code = url_data["region_code"]
-                station_key = url_data["station_key"]
-                if station_key not in estaciones_keys:
-                    estaciones_keys.append(station_key)
-                if station_key not in contaminants:
-                    contaminants[station_key] = {}
+    try:
+        # Stations indexed by key, each built from its own row so ids and keys
+        # can never be attached to the wrong station
+        estaciones_por_key = {}
+        station_keys_by_id = {}
+        current_region_code = None
 
-            if url_data["contaminant_code"] and station_key:
-                contaminant_code = url_data["contaminant_code"]
-                if contaminant_code not in contaminants[station_key]:
-                    contaminants[station_key][contaminant_code] = {
-                        "from_date": url_data["from_date"],
-                        "to_date": url_data["to_date"],
-                    }
+        for row in page["rows"]:
+            station_key = None
+            station_id = None
+            contaminants = {}
+
+            for url in row["links"]:
+                print(f"\nAnalyzing url: {url}")
+                url_data = extract_url_data(url)
+
+                if url_data["station_id"] and not station_id:
+                    station_id = url_data["station_id"]
+
+                if url_data["region_code"] and url_data["station_key"]:
+                    current_region_code = url_data["region_code"]
+                    station_key = station_key or url_data["station_key"]
+
+                    contaminant_code = url_data["contaminant_code"]
+                    if contaminant_code and contaminant_code not in contaminants:
+                        contaminants[contaminant_code] = {
+                            "from_date": url_data["from_date"],
+                            "to_date": url_data["to_date"],
+                        }
+
+            if not station_key:
+                print(f"No contaminant links for station {row['name']}, skipping")
+                continue
+
+            if station_id in station_keys_by_id:
+                print(
+                    f"Station id {station_id} appears under keys "
+                    f"{station_keys_by_id[station_id]} and {station_key}"
+                )
+            station_keys_by_id.setdefault(station_id, station_key)
+
+            station = estaciones_por_key.get(station_key)
+            if station is None:
+                # Get types of station from the badges present in the row
+                station = estaciones_por_key[station_key] = {
+                    "name": row["name"],
+                    "en_linea": tiposEstacion["en línea"] in row["badges"],
+                    "estacion_meteorologica": tiposEstacion["estación meteorológica"]
+                    in row["badges"],
+                    "estacion_publica": tiposEstacion["estación pública"]
+                    in row["badges"],
+                    "ficha_url": row["ficha_url"],
+                    "key": station_key,
+                    "id": station_id,
+                    "contaminants": {},
+                }
 
-            if url_data["station_id"]:
-                estaciones_ids.append(url_data["station_id"])
+            for contaminant_code, dates in contaminants.items():
+                station["contaminants"].setdefault(contaminant_code, dates)
 
         if current_region_code:
             # Add numberStations to the dictionary
@@ -218,45 +257,18 @@ def getRegionStations(driver, regionUrl):
             stations_by_region["stations"] = {}
 
             # Add stations under the stations field
-            for i, station_key in enumerate(estaciones_keys):
-                station_info = estaciones_info_basica[i]
-                stations_by_region["stations"][station_info["nombre"]] = {
-                    "name": station_info["nombre"],
-                    "en_linea": station_info["en_linea"],
-                    "estacion_meteorologica": station_info["estacion_meteorologica"],
-                    "estacion_publica": station_info["estacion_publica"],
-                    "ficha_url": station_info["ficha_url"],
-                    "key": station_key,
-                    "id": estaciones_ids[i],
-                    "contaminants": contaminants[station_key],
-                }
-                # Create graph URL for each contaminant
+            for station_key, station in estaciones_por_key.items():
+                stations_by_region["stations"][station["name"]] = station
 
-                if station_key in contaminants:
-                    for contaminant_code, dates in contaminants[station_key].items():
-                        from_date = dates["from_date"]
-                        to_date = dates["to_date"]
-                        encoded_station_name = quote(station_info["nombre"])
-                        macroURL = getMacroURL(
-                            current_region_code,
-                            station_key,
-                            contaminant_code,
-                            periodosPromedio["anual"],
-                        )
-                        contaminant_graph_url = (
-                            f"https://sinca.mma.gob.cl/cgi-bin/APUB-MMA/apub.htmlindico2.cgi"
-                            f"?page=pageRight"
-                            f"&header={encoded_station_name}"
-                            f"&gsize=1495x708"
-                            f"&period=specified"
-                            f"&from={from_date}"
-                            f"&to={to_date}"
-                            f"{macroURL}"
-                            f"&limgfrom=&limgto=&limdfrom=&limdto=&rsrc=&stnkey="
-                        )
-                        contaminants[station_key][contaminant_code][
-                            "graph_url"
-                        ] = contaminant_graph_url
+                # Create graph URL for each contaminant
+                for contaminant_code, dates in station["contaminants"].items():
+                    dates["graph_url"] = buildGraphUrl(
+                        current_region_code,
+                        station_key,
+                        station["name"],
+                        contaminant_code,
+                        dates,
+                    )
         else:
             print("No region code found in the analyzed links")
         return stations_by_region
@@ -266,76 +278,95 @@ def getRegionStations(driver, regionUrl):
         raise
 
 
-def ensure_driver_cached():
-    """Ensure GeckoDriver is downloaded and cached before parallel processing"""
-    print("Ensuring GeckoDriver is cached...")
-    driver = None
-    try:
-        driver = setup_driver()
-        cached_path = get_cached_driver_path()
-        if os.path.exists(cached_path):
-            print(f"GeckoDriver successfully cached at: {cached_path}")
-            return True
-    except Exception as e:
-        print(f"Error caching driver: {e}")
-        return False
-    finally:
-        if driver:
-            driver.quit()
-
+def process_region(region_code, region_url, revalidate=False):
+    """Process a single region over HTTP when possible and otherwise with a pooled
+    driver"""
+    with span("region_task", region=region_code):
+        region_code, result = _process_region(region_code, region_url, revalidate)
+    increment("tasks_total", stage="region", result="ok" if result else "failed")
+    return region_code, result
+
+
+def _process_region(region_code, region_url, revalidate):
+    if USE_HTTP_ENGINE:
+        try:
+            return region_code, getRegionStationsHttp(region_url, revalidate)
+        except Exception as e:
+            # The server is overloaded or unreachable, let the scheduler back off
+            if is_overload_error(e):
+                raise
+            print(
+                f"HTTP scraping failed for region {region_code}: {e}. Falling back to Selenium..."
+            )
 
-def process_region(region_code, region_url):
-    """Process a single region with its own driver instance"""
-    driver = None
     try:
-        driver = setup_driver()
-        result = getRegionStations(driver, region_url)
+        with borrow_driver() as driver:
+            result = getRegionStations(driver, region_url)
         return region_code, result
     except Exception as e:
         print(f"Error processing region {region_code}: {e}")
         return region_code, None
+
+
+async def run_regions(catalog, latencies=None):
+    """Scrape every region from this process, upserting each one into the catalog
+    as soon as it finishes. Returns the codes of the regions that were saved.
+
+    When latencies is a list, the duration of every region attempt is appended to it.
+    """
+    completed = []
+    # Maximum number of browsers based on CPU cores
+    max_workers = min(len(mapaRegionUrls), os.cpu_count() or 1)
+
+    print(f"Processing {len(mapaRegionUrls)} regions with {max_workers} workers")
+
+    scheduler = DownloadScheduler(
+        max_concurrency=max_workers, per_host_concurrency=max_workers
+    )
+    init_worker(None, DRIVER_MAX_TASKS, eager=False, max_drivers=max_workers)
+
+    process_task = process_region
+    if latencies is not None:
+        process_task = timed(process_task, latencies)
+
+    futures = [
+        scheduler.run(process_task, region_code, region_url, host=get_host(region_url))
+        for region_code, region_url in mapaRegionUrls.items()
+    ]
+
+    try:
+        # Process completed tasks as they finish
+        for future in asyncio.as_completed(futures):
+            region_code, result = await future
+            if result:
+                catalog.upsert_region(region_code, result)
+                completed.append(region_code)
+                print(f"Completed processing region: {region_code}")
     finally:
-        if driver:
-            driver.quit()
+        await asyncio.to_thread(scheduler.close)
+        await asyncio.to_thread(shutdown_pool)
+
+    return completed
 
 
 def main():
+    start_trace(TRACE_PATH)
     try:
-        # First ensure driver is cached
-        if not ensure_driver_cached():
-            raise Exception("Failed to cache GeckoDriver")
-
-        stations = {}
-        # Maximum number of concurrent processes based on CPU cores
-        max_workers = min(len(mapaRegionUrls), os.cpu_count() or 1)
-
-        print(f"Processing {len(mapaRegionUrls)} regions with {max_workers} workers")
-
-        with concurrent.futures.ProcessPoolExecutor(
-            max_workers=max_workers
-        ) as executor:
-            # Create future tasks for each region
-            future_to_region = {
-                executor.submit(process_region, region_code, region_url): region_code
-                for region_code, region_url in mapaRegionUrls.items()
-            }
-
-            # Process completed tasks as they finish
-            for future in concurrent.futures.as_completed(future_to_region):
-                region_code = future_to_region[future]
-                result = future.result()[1]  # Get the second element of the tuple
-                if result:
-                    stations[region_code] = result
-                    print(f"Completed processing region: {region_code}")
-
-        # Save results to JSON
-        os.makedirs(STATIONS_DIR, exist_ok=True)
-        with open(STATIONS_PATH, "w", encoding="utf-8") as f:
-            json.dump(stations, f, ensure_ascii=False, indent=4)
+        prepare_driver(USE_HTTP_ENGINE)
+
+        with StationCatalog() as catalog, span("regions"):
+            completed = asyncio.run(run_regions(catalog))
+            print(f"{len(completed)} regions saved to {catalog.path}")
+
+            # The JSON file is kept as an export of the catalog
+            catalog.export_json(STATIONS_PATH)
         print(f"Data successfully saved to {STATIONS_PATH}")
 
     except Exception as e:
         print(f"An error occurred in main: {e}")
+    finally:
+        stop_trace()
+        write_metrics(METRICS_PATH)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,270 @@
+"""Scrape the regions and download their series in a single run.
+
+    python pipeline.py --periods diario anual --regions M V
+
+The station contaminants of a region are queued for download as soon as the
+region is scraped, so downloads start while the slower regions are still being
+scraped instead of after all of them.
+"""
+
+import argparse
+import asyncio
+import os
+from datetime import datetime
+from functools import partial
+from time import time
+
+from common.blob_store import get_blob_store
+from common.browser_pool import DRIVER_MAX_TASKS, init_worker, shutdown_pool
+from common.catalog import StationCatalog, get_region_code
+from common.manifest import DownloadManifest
+from common.resilience import CircuitBreaker, DeadLetterQueue, RetryPolicy
+from common.scheduler import DownloadScheduler, get_host
+from common.telemetry import span, start_trace, stop_trace, write_metrics
+from common.web_scraping import (
+    CSV_CONTAMINANTS_DIR,
+    DEAD_LETTER_PATH,
+    METRICS_PATH,
+    STATIONS_PATH,
+    TRACE_PATH,
+    prepare_driver,
+)
+from download_csv import (
+    BROWSER_CONCURRENCY,
+    USE_BLOB_STORE,
+    USE_HTTP_ENGINE,
+    WRITE_PARQUET,
+    WRITE_TIMESERIES,
+    build_tasks,
+    get_retryable_task_errors,
+    get_task_key,
+    group_tasks_by_pair,
+    periodosPromedioOpcion,
+    process_station_contaminant_periods,
+    run_pair,
+    write_parquet_dataset,
+    write_timeseries_store,
+)
+from get_all_stations_data import mapaRegionUrls, process_region
+
+# Station contaminants waiting for a download slot. Scraping pauses when the
+# queue is full so a fast discovery doesn't pile up tasks in memory.
+PIPELINE_QUEUE_SIZE = 64
+
+
+async def discover(catalog, scheduler, queue, region_urls, periods, filters):
+    """Scrape the regions and queue the tasks of each one as soon as it finishes.
+
+    Returns:
+        list: Download tasks queued, one per station contaminant and period
+    """
+    queued = []
+    futures = [
+        scheduler.run(
+            process_region, region_code, region_url, host=get_host(region_url)
+        )
+        for region_code, region_url in region_urls.items()
+    ]
+
+    for future in asyncio.as_completed(futures):
+        try:
+            region_code, result = await future
+        except Exception as e:
+            print(f"Error processing region: {e}")
+            continue
+        if not result:
+            continue
+
+        catalog.upsert_region(region_code, result)
+        tasks = []
+        for period in periods:
+            tasks += build_tasks(catalog, period, [region_code], **filters)
+        print(f"Completed processing region: {region_code}, {len(tasks)} downloads")
+
+        queued += tasks
+        for task in group_tasks_by_pair(tasks):
+            # Waits while the downloads are behind
+            await queue.put(task)
+
+    return queued
+
+
+async def download(scheduler, process_task, queue, manifest, dead_letters, counts):
+    """Download queued tasks until a None task arrives"""
+    while True:
+        task = await queue.get()
+        try:
+            if task is None:
+                return
+            task, results = await run_pair(
+                scheduler, process_task, task, manifest, dead_letters
+            )
+            for period, result in zip(task[5], results):
+                if result:
+                    counts["successful"] += 1
+                    counts["succeeded_keys"].append(get_task_key((*task[:5], period)))
+                    print(f"Successfully downloaded: {os.path.basename(result)}")
+                else:
+                    counts["failed"] += 1
+        finally:
+            queue.task_done()
+
+
+async def run_pipeline(
+    catalog,
+    manifest,
+    periods,
+    regions=None,
+    contaminants=None,
+    stations=None,
+    dead_letters=None,
+    queue_size=PIPELINE_QUEUE_SIZE,
+):
+    """Scrape the regions and download their series as they are discovered.
+
+    Region pages and downloads share the scheduler, so they share the per-host
+    limits and the circuit breaker too.
+
+    Returns:
+        tuple: Tasks queued, successful and failed download counts
+    """
+    region_urls = mapaRegionUrls
+    if regions:
+        codes = {get_region_code(region) for region in regions}
+        region_urls = {code: url for code, url in region_urls.items() if code in codes}
+    filters = {"contaminants": contaminants, "stations": stations}
+
+    scheduler = DownloadScheduler(
+        retry_policy=RetryPolicy(retryable=get_retryable_task_errors()),
+        circuit_breaker=CircuitBreaker(),
+    )
+    workers = scheduler.max_concurrency
+    print(
+        f"Processing {len(region_urls)} regions with up to {workers} concurrent "
+        f"downloads, {queue_size} queued at most"
+    )
+    init_worker(
+        CSV_CONTAMINANTS_DIR,
+        DRIVER_MAX_TASKS,
+        eager=not USE_HTTP_ENGINE,
+        max_drivers=BROWSER_CONCURRENCY,
+    )
+
+    queue = asyncio.Queue(maxsize=queue_size)
+    counts = {"successful": 0, "failed": 0, "succeeded_keys": []}
+    process_task = partial(process_station_contaminant_periods, manifest=manifest)
+    downloaders = [
+        asyncio.create_task(
+            download(scheduler, process_task, queue, manifest, dead_letters, counts)
+        )
+        for _ in range(workers)
+    ]
+
+    try:
+        tasks = await discover(catalog, scheduler, queue, region_urls, periods, filters)
+        for _ in downloaders:
+            await queue.put(None)
+        await asyncio.gather(*downloaders)
+    finally:
+        for downloader in downloaders:
+            downloader.cancel()
+        await asyncio.to_thread(scheduler.close)
+        await asyncio.to_thread(shutdown_pool)
+        await asyncio.to_thread(manifest.flush)
+        if USE_BLOB_STORE:
+            await asyncio.to_thread(get_blob_store().flush)
+        if dead_letters is not None:
+            dead_letters.remove(counts["succeeded_keys"])
+
+    return tasks, counts["successful"], counts["failed"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--periods",
+        nargs="+",
+        choices=periodosPromedioOpcion.values(),
+        default=list(periodosPromedioOpcion.values()),
+        help="Averaging periods to download, all by default",
+    )
+    parser.add_argument("--regions", nargs="+", help="Region codes like M or RM")
+    parser.add_argument("--contaminants", nargs="+", help="Contaminant codes")
+    parser.add_argument("--stations", nargs="+", help="Station names or keys")
+    parser.add_argument(
+        "--local-aggregates",
+        action="store_true",
+        help="Only download the daily series and compute the quarterly and annual "
+        "ones from it",
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=PIPELINE_QUEUE_SIZE,
+        help="Station contaminants waiting for download before scraping pauses",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    start_time = time()
+    start_datetime = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"Starting pipeline at: {start_datetime}")
+    start_trace(TRACE_PATH)
+
+    try:
+        prepare_driver(USE_HTTP_ENGINE)
+
+        os.makedirs(CSV_CONTAMINANTS_DIR, exist_ok=True)
+        manifest = DownloadManifest()
+        periods = list(dict.fromkeys(args.periods))
+        if args.local_aggregates:
+            # The time-series store aggregates the daily series into the others
+            periods = ["diario"]
+
+        with StationCatalog() as catalog, span("pipeline"):
+            tasks, successful_downloads, failed_downloads = asyncio.run(
+                run_pipeline(
+                    catalog,
+                    manifest,
+                    periods,
+                    args.regions,
+                    args.contaminants,
+                    args.stations,
+                    DeadLetterQueue(),
+                    args.queue_size,
+                )
+            )
+            catalog.export_json(STATIONS_PATH)
+
+        print(f"Successful downloads: {successful_downloads}")
+        print(f"Failed downloads: {failed_downloads}")
+        if failed_downloads:
+            print(
+                f"{failed_downloads} failed downloads saved to {DEAD_LETTER_PATH}, "
+                "replay them with download_csv.py --retry-failed"
+            )
+
+        if WRITE_PARQUET:
+            with span("parquet_export"):
+                write_parquet_dataset(tasks, manifest)
+
+        if WRITE_TIMESERIES or args.local_aggregates:
+            with span("timeseries_export"):
+                write_timeseries_store(tasks, manifest)
+
+        if USE_BLOB_STORE:
+            removed = get_blob_store().collect_garbage()
+            print(f"Removed {removed} unreferenced blobs")
+
+    except Exception as e:
+        print(f"An error occurred in main: {e}")
+    finally:
+        stop_trace()
+        write_metrics(METRICS_PATH)
+        print(f"Total time: {time() - start_time:.2f} seconds")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""Spread downloads over several nodes through a shared task queue.
+
+    python queue_worker.py enqueue --periods diario anual --regions M
+    python queue_worker.py work                  # on every node
+    python queue_worker.py status
+    python queue_worker.py requeue-failed
+
+Point --queue at a file on a volume shared by all nodes. Each node keeps its own
+data directory, manifest and browsers.
+"""
+
+import argparse
+import asyncio
+import os
+from functools import partial
+
+from common.blob_store import get_blob_store
+from common.browser_pool import DRIVER_MAX_TASKS, init_worker, shutdown_pool
+from common.catalog import StationCatalog
+from common.manifest import DownloadManifest, get_manifest_key
+from common.resilience import CircuitBreaker, DeadLetterQueue, RetryPolicy
+from common.scheduler import DownloadScheduler, PER_HOST_CONCURRENCY
+from common.task_queue import VISIBILITY_TIMEOUT, TaskQueue, get_worker_id
+from common.web_scraping import (
+    CSV_CONTAMINANTS_DIR,
+    QUEUE_PATH,
+    STATIONS_PATH,
+    prepare_driver,
+)
+from download_csv import (
+    BROWSER_CONCURRENCY,
+    USE_BLOB_STORE,
+    USE_HTTP_ENGINE,
+    WRITE_PARQUET,
+    WRITE_TIMESERIES,
+    build_tasks,
+    get_retryable_task_errors,
+    periodosPromedioOpcion,
+    process_station_contaminant_periods,
+    run_pair,
+    write_parquet_dataset,
+    write_timeseries_store,
+)
+
+POLL_INTERVAL = 5  # seconds between lease attempts while other workers hold tasks
+LEASE_BATCH = 2 * PER_HOST_CONCURRENCY  # Tasks leased and in flight per worker
+
+
+def enqueue(queue, periods, regions=None, contaminants=None, stations=None, since=None):
+    """Add the download tasks of the catalog matching the filters to the queue"""
+    with StationCatalog() as catalog:
+        if catalog.is_empty():
+            if not os.path.exists(STATIONS_PATH):
+                raise FileNotFoundError(
+                    f"The file {STATIONS_PATH} does not exist. Please get all stations data first."
+                )
+            catalog.import_json(STATIONS_PATH)
+
+        tasks = []
+        for period in periods:
+            tasks += build_tasks(
+                catalog, period, regions, contaminants, stations, since
+            )
+
+    added = queue.enqueue(
+        (get_manifest_key(task[0], task[1], task[3], task[5]), task) for task in tasks
+    )
+    print(
+        f"Queued {added} new or changed tasks "
+        f"({len(tasks) - added} were already queued as they are)"
+    )
+    return added
+
+
+async def heartbeat(queue, worker_id, in_flight):
+    """Keep the leases of in-flight tasks alive until cancelled"""
+    while True:
+        await asyncio.sleep(queue.visibility_timeout / 3)
+        task_ids = list(in_flight)
+        kept = await asyncio.to_thread(queue.heartbeat, worker_id, task_ids)
+        for task_id in set(task_ids) - kept:
+            print(f"Lease of task {task_id} expired, another worker may redo it")
+
+
+async def run_task(
+    queue, worker_id, scheduler, process_task, task_id, task, manifest, dead_letters
+):
+    """Run a leased task and report its outcome to the queue.
+
+    Tasks run like the ones of download_csv.py, as a station contaminant with a
+    single period, and are added to dead_letters when they fail for good.
+    """
+    _, (result,) = await run_pair(
+        scheduler, process_task, (*task[:5], [task[5]]), manifest, dead_letters
+    )
+    if not result:
+        await asyncio.to_thread(queue.fail, worker_id, task_id, "Download failed")
+        print(f"Task {task_id} failed")
+        return None
+    if not await asyncio.to_thread(queue.complete, worker_id, task_id, result):
+        print(f"Task {task_id} finished after its lease was lost, result ignored")
+        return None
+    print(f"Successfully downloaded: {os.path.basename(result)}")
+    return task
+
+
+async def work(queue, worker_id, manifest, batch=LEASE_BATCH, dead_letters=None):
+    """Lease and run tasks until no task is pending or leased by any worker.
+
+    Tasks still failing after the scheduler's retries are failed in the queue
+    and added to dead_letters, tasks that succeed are removed from it.
+
+    Returns:
+        list: Tasks completed by this worker
+    """
+    scheduler = DownloadScheduler(
+        retry_policy=RetryPolicy(retryable=get_retryable_task_errors()),
+        circuit_breaker=CircuitBreaker(),
+    )
+    init_worker(
+        CSV_CONTAMINANTS_DIR,
+        DRIVER_MAX_TASKS,
+        eager=not USE_HTTP_ENGINE,
+        max_drivers=BROWSER_CONCURRENCY,
+    )
+    process_task = partial(process_station_contaminant_periods, manifest=manifest)
+
+    in_flight = {}  # task id -> asyncio task
+    completed = []
+    heartbeat_task = asyncio.create_task(heartbeat(queue, worker_id, in_flight))
+
+    try:
+        while True:
+            if len(in_flight) < batch:
+                leased = await asyncio.to_thread(
+                    queue.lease, worker_id, batch - len(in_flight)
+                )
+                for task_id, task in leased:
+                    in_flight[task_id] = asyncio.create_task(
+                        run_task(
+                            queue,
+                            worker_id,
+                            scheduler,
+                            process_task,
+                            task_id,
+                            task,
+                            manifest,
+                            dead_letters,
+                        )
+                    )
+
+            if not in_flight:
+                if await asyncio.to_thread(queue.is_drained):
+                    break
+                # Other workers hold the remaining tasks, wait in case one dies
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
+
+            done, _ = await asyncio.wait(
+                in_flight.values(),
+                timeout=POLL_INTERVAL,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            for task_id, future in list(in_flight.items()):
+                if future in done:
+                    del in_flight[task_id]
+                    if future.result():
+                        completed.append(future.result())
+    finally:
+        heartbeat_task.cancel()
+        for future in in_flight.values():
+            future.cancel()
+        await asyncio.to_thread(scheduler.close)
+        await asyncio.to_thread(shutdown_pool)
+        await asyncio.to_thread(manifest.flush)
+        if USE_BLOB_STORE:
+            await asyncio.to_thread(get_blob_store().flush)
+        if dead_letters is not None:
+            dead_letters.remove(
+                [
+                    get_manifest_key(task[0], task[1], task[3], task[5])
+                    for task in completed
+                ]
+            )
+
+    return completed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--queue", default=QUEUE_PATH, help="Path of the queue file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    enqueue_parser = commands.add_parser("enqueue", help="Queue download tasks")
+    enqueue_parser.add_argument(
+        "--periods",
+        nargs="+",
+        choices=periodosPromedioOpcion.values(),
+        default=list(periodosPromedioOpcion.values()),
+    )
+    enqueue_parser.add_argument("--regions", nargs="+")
+    enqueue_parser.add_argument("--contaminants", nargs="+")
+    enqueue_parser.add_argument("--stations", nargs="+")
+    enqueue_parser.add_argument("--updated-since")
+
+    work_parser = commands.add_parser("work", help="Run queued tasks")
+    work_parser.add_argument("--worker-id", default=get_worker_id())
+    work_parser.add_argument("--batch", type=int, default=LEASE_BATCH)
+    work_parser.add_argument(
+        "--visibility-timeout", type=float, default=VISIBILITY_TIMEOUT
+    )
+
+    commands.add_parser("status", help="Show the number of tasks in each state")
+    commands.add_parser("requeue-failed", help="Retry the tasks that failed")
+    args = parser.parse_args()
+
+    if args.command == "work":
+        queue = TaskQueue(args.queue, args.visibility_timeout)
+    else:
+        queue = TaskQueue(args.queue)
+
+    with queue:
+        if args.command == "enqueue":
+            enqueue(
+                queue,
+                args.periods,
+                args.regions,
+                args.contaminants,
+                args.stations,
+                args.updated_since,
+            )
+
+        elif args.command == "work":
+            prepare_driver(USE_HTTP_ENGINE)
+            os.makedirs(CSV_CONTAMINANTS_DIR, exist_ok=True)
+
+            print(f"Worker {args.worker_id} leasing from {args.queue}")
+            manifest = DownloadManifest()
+            completed = asyncio.run(
+                work(queue, args.worker_id, manifest, args.batch, DeadLetterQueue())
+            )
+            print(f"Worker {args.worker_id} completed {len(completed)} tasks")
+
+            if WRITE_PARQUET:
+                write_parquet_dataset(completed, manifest)
+            if WRITE_TIMESERIES:
+                write_timeseries_store(completed, manifest)
+
+        elif args.command == "requeue-failed":
+            print(f"Requeued {queue.requeue_failed()} failed tasks")
+
+        counts = queue.get_counts()
+        print(", ".join(f"{state}: {count}" for state, count in counts.items()))
+
+
+if __name__ == "__main__":
+    main()
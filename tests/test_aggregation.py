@@ -0,0 +1,91 @@
+import numpy as np
+
+from common.aggregation import (
+    PERCENTILES,
+    aggregate,
+    load_aggregates,
+    save_aggregates,
+    update_aggregates,
+)
+from common.sinca_csv import FLAG_MISSING, FLAG_VALIDATED, SincaSeries
+
+
+def make_series(start, end, seed=0):
+    timestamps = np.arange(start, end, dtype="datetime64[D]").astype("datetime64[s]")
+    values = np.random.default_rng(seed).uniform(0, 200, len(timestamps))
+    values[::7] = np.nan
+    flags = np.where(np.isnan(values), FLAG_MISSING, FLAG_VALIDATED).astype(np.int8)
+    return SincaSeries(timestamps, values, flags)
+
+
+def assert_aggregates_equal(actual, expected):
+    np.testing.assert_array_equal(actual.starts, expected.starts)
+    for name in expected._fields[1:]:
+        np.testing.assert_allclose(
+            getattr(actual, name), getattr(expected, name), err_msg=name
+        )
+
+
+def test_aggregate_quarters():
+    series = make_series("2022-01-01", "2022-07-01")
+    aggregates = aggregate(series, "trimestral", limit=130.0)
+
+    assert aggregates.starts.tolist() == [
+        np.datetime64("2022-01-01T00:00:00"),
+        np.datetime64("2022-04-01T00:00:00"),
+    ]
+    for i, (start, end, days) in enumerate(
+        [("2022-01-01", "2022-04-01", 90), ("2022-04-01", "2022-07-01", 91)]
+    ):
+        in_period = (series.timestamps >= np.datetime64(start)) & (
+            series.timestamps < np.datetime64(end)
+        )
+        values = series.values[in_period]
+        values = values[~np.isnan(values)]
+        assert aggregates.counts[i] == len(values)
+        assert aggregates.completeness[i] == len(values) / days
+        assert aggregates.exceedances[i] == (values > 130.0).sum()
+        np.testing.assert_allclose(aggregates.means[i], values.mean())
+        np.testing.assert_allclose(
+            aggregates.percentiles[i], np.percentile(values, PERCENTILES)
+        )
+
+
+def test_aggregate_without_limit_or_values():
+    series = make_series("2022-01-01", "2023-01-01")
+    series.values[series.timestamps >= np.datetime64("2022-10-01")] = np.nan
+    aggregates = aggregate(series, "trimestral")
+
+    assert np.isnan(aggregates.exceedances).all()
+    assert aggregates.counts[3] == 0
+    assert np.isnan(aggregates.means[3])
+    assert np.isnan(aggregates.percentiles[3]).all()
+
+
+def test_incremental_update_matches_full_recompute():
+    old_series = make_series("2020-01-01", "2023-06-15")
+    new_series = make_series("2020-01-01", "2024-03-01", seed=1)
+    # Keep the old rows up to a revised value in 2022
+    revised = np.searchsorted(new_series.timestamps, np.datetime64("2022-05-10"))
+    for old, new in zip(old_series, new_series):
+        new[:revised] = old[:revised]
+
+    for period in ("trimestral", "anual"):
+        previous = aggregate(old_series, period, limit=130.0)
+        updated = update_aggregates(
+            previous, old_series, new_series, period, limit=130.0
+        )
+        assert_aggregates_equal(updated, aggregate(new_series, period, limit=130.0))
+        assert (
+            update_aggregates(previous, old_series, old_series, period, limit=130.0)
+            is previous
+        )
+
+
+def test_save_and_load(tmp_path):
+    aggregates = aggregate(make_series("2022-01-01", "2023-01-01"), "anual", 50.0)
+    path = str(tmp_path / "anual.npz")
+
+    assert load_aggregates(path) is None
+    save_aggregates(path, aggregates)
+    assert_aggregates_equal(load_aggregates(path), aggregates)
@@ -0,0 +1,85 @@
+import io
+import json
+import os
+
+from common import blob_store
+from common.blob_store import BlobStore
+
+
+def load_index(store):
+    with open(store.index_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_index_writes_are_deferred_until_flush(tmp_path):
+    store = BlobStore(str(tmp_path / "blobs"))
+    dest_path = str(tmp_path / "data" / "series.csv")
+    digest = store.put_stream(io.BytesIO(b"FECHA;valor\r\n"), dest_path)
+
+    assert not os.path.exists(store.index_path)
+    store.flush()
+    assert load_index(store) == {os.path.normpath(dest_path): digest}
+
+
+def test_relinking_the_same_content_does_not_save(tmp_path, monkeypatch):
+    monkeypatch.setattr(blob_store, "INDEX_SAVE_INTERVAL", 0)
+    store = BlobStore(str(tmp_path / "blobs"))
+    dest_path = str(tmp_path / "series.csv")
+    store.put_stream(io.BytesIO(b"FECHA;valor\r\n"), dest_path)
+
+    saves = []
+    monkeypatch.setattr(store, "_write", lambda index: saves.append(True))
+    store.put_stream(io.BytesIO(b"FECHA;valor\r\n"), dest_path)
+    store.flush()
+    assert saves == []
+
+    # A link replaced by another file is relinked and saved
+    os.remove(dest_path)
+    with open(dest_path, "wb") as f:
+        f.write(b"FECHA;valor\r\n")
+    store.put_stream(io.BytesIO(b"FECHA;valor\r\n"), dest_path)
+    assert saves == [True]
+    assert os.path.samefile(dest_path, store.get_blob_path(store.get_hash(dest_path)))
+
+
+def test_stores_sharing_a_root_keep_each_others_entries(tmp_path):
+    root = str(tmp_path / "blobs")
+    first = BlobStore(root)
+    second = BlobStore(root)
+    first_digest = first.put_stream(io.BytesIO(b"first"), str(tmp_path / "a.csv"))
+    second_digest = second.put_stream(io.BytesIO(b"second"), str(tmp_path / "b.csv"))
+    first.flush()
+    second.flush()
+
+    assert set(load_index(first).values()) == {first_digest, second_digest}
+    # Garbage collection in one of them keeps the blobs of the other
+    assert first.collect_garbage() == 0
+    assert second.has_blob(second_digest)
+
+
+def test_garbage_collection_deletes_old_unreferenced_blobs(tmp_path, monkeypatch):
+    store = BlobStore(str(tmp_path / "blobs"))
+    kept = store.put_stream(io.BytesIO(b"kept"), str(tmp_path / "a.csv"))
+    dropped = store.put_stream(io.BytesIO(b"dropped"), str(tmp_path / "b.csv"))
+    os.remove(tmp_path / "b.csv")
+
+    # Just linked, another process may not have saved its index yet
+    assert store.collect_garbage() == 0
+    assert store.has_blob(dropped)
+
+    monkeypatch.setattr(blob_store, "GC_GRACE_PERIOD", -1)
+    assert store.collect_garbage() == 1
+    assert store.has_blob(kept)
+    assert not store.has_blob(dropped)
+    assert load_index(store) == {os.path.normpath(str(tmp_path / "a.csv")): kept}
+
+
+def test_garbage_collection_is_skipped_without_an_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(blob_store, "GC_GRACE_PERIOD", -1)
+    root = tmp_path / "blobs"
+    digest = BlobStore(str(root)).put_stream(io.BytesIO(b"x"), str(tmp_path / "a.csv"))
+    (root / "index.json").write_text("{truncated")
+
+    store = BlobStore(str(root))
+    assert store.collect_garbage() == 0
+    assert store.has_blob(digest)
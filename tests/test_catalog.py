@@ -0,0 +1,126 @@
+from datetime import datetime
+
+from common import catalog as catalog_module
+from common.catalog import StationCatalog
+
+
+def make_region(to_date="230630", stations=("Parque O'Higgins", "Pudahuel")):
+    return {
+        "number_stations": str(len(stations)),
+        "stations": {
+            name: {
+                "key": f"key{i}",
+                "id": str(i),
+                "ficha_url": f"/ficha/{i}",
+                "en_linea": True,
+                "contaminants": {
+                    "PM10": {"from_date": "200101", "to_date": to_date},
+                    "PM25": {"from_date": "210101", "to_date": "230630"},
+                },
+            }
+            for i, name in enumerate(stations)
+        },
+    }
+
+
+def set_now(monkeypatch, now):
+    class FixedDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return now
+
+    monkeypatch.setattr(catalog_module, "datetime", FixedDatetime)
+
+
+def get_pairs(catalog, **filters):
+    return [
+        (region_code, station_name, contaminant_code)
+        for region_code, station_name, _, contaminant_code, _ in (
+            catalog.iter_station_contaminants(**filters)
+        )
+    ]
+
+
+def test_upsert_replaces_the_region(tmp_path):
+    with StationCatalog(str(tmp_path / "catalog.db")) as catalog:
+        assert catalog.is_empty()
+        catalog.upsert_region("RM", make_region())
+        catalog.upsert_region("RM", make_region(stations=("Pudahuel",)))
+
+        assert not catalog.is_empty()
+        assert catalog.to_dict() == {
+            "RM": {
+                "number_stations": "1",
+                "stations": {
+                    "Pudahuel": {
+                        "name": "Pudahuel",
+                        "en_linea": True,
+                        "estacion_meteorologica": False,
+                        "estacion_publica": False,
+                        "ficha_url": "/ficha/0",
+                        "key": "key0",
+                        "id": "0",
+                        "contaminants": {
+                            "PM10": {
+                                "from_date": "200101",
+                                "to_date": "230630",
+                                "graph_url": None,
+                            },
+                            "PM25": {
+                                "from_date": "210101",
+                                "to_date": "230630",
+                                "graph_url": None,
+                            },
+                        },
+                    }
+                },
+            }
+        }
+        assert catalog.get_date_ranges("M") == {
+            ("key0", "PM10"): ("200101", "230630"),
+            ("key0", "PM25"): ("210101", "230630"),
+        }
+
+
+def test_filters(tmp_path):
+    with StationCatalog(str(tmp_path / "catalog.db")) as catalog:
+        catalog.upsert_region("RM", make_region())
+        catalog.upsert_region("RV", make_region(stations=("Viña del Mar",)))
+
+        assert len(get_pairs(catalog)) == 6
+        assert get_pairs(catalog, regions=["V"]) == [
+            ("RV", "Viña del Mar", "PM10"),
+            ("RV", "Viña del Mar", "PM25"),
+        ]
+        assert get_pairs(catalog, regions=["RM"], contaminants=["PM25"]) == [
+            ("RM", "Parque O'Higgins", "PM25"),
+            ("RM", "Pudahuel", "PM25"),
+        ]
+        # Stations match by name or key
+        assert get_pairs(catalog, stations=["Pudahuel", "key0"]) == [
+            ("RM", "Parque O'Higgins", "PM10"),
+            ("RM", "Parque O'Higgins", "PM25"),
+            ("RM", "Pudahuel", "PM10"),
+            ("RM", "Pudahuel", "PM25"),
+            ("RV", "Viña del Mar", "PM10"),
+            ("RV", "Viña del Mar", "PM25"),
+        ]
+
+
+def test_updated_at_only_moves_when_dates_change(tmp_path, monkeypatch):
+    with StationCatalog(str(tmp_path / "catalog.db")) as catalog:
+        set_now(monkeypatch, datetime(2024, 1, 1))
+        catalog.upsert_region("RM", make_region(stations=("Pudahuel",)))
+
+        set_now(monkeypatch, datetime(2024, 2, 1))
+        catalog.upsert_region("RM", make_region(stations=("Pudahuel",)))
+        assert get_pairs(catalog, updated_since="2024-01-15") == []
+
+        set_now(monkeypatch, datetime(2024, 3, 1))
+        catalog.upsert_region(
+            "RM", make_region(to_date="240229", stations=("Pudahuel",))
+        )
+        assert get_pairs(catalog, updated_since="2024-01-15") == [
+            ("RM", "Pudahuel", "PM10")
+        ]
+        assert len(get_pairs(catalog, updated_since="2024-01-01")) == 2
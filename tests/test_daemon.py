@@ -0,0 +1,121 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from benchmarks import sinca_server
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs one poll of region M in the current directory, downloads what it
+# queued, failing the pairs of the contaminant given as argument, and prints
+# the queued (station key, contaminant, to_date) of every task
+POLL = """
+import asyncio, json, sys
+from functools import partial
+
+from common import scheduler
+
+scheduler.REQUESTS_PER_SECOND = scheduler.RATE_BURST = 1e6
+
+import daemon
+from common.catalog import StationCatalog
+from common.manifest import DownloadManifest
+from common.resilience import DeadLetterQueue
+from common.scheduler import DownloadScheduler
+from download_csv import process_station_contaminant_periods
+
+
+def process_task(*task, manifest):
+    if task[3] in sys.argv[1:]:
+        raise ValueError(f"{task[3]} export failed")
+    return process_station_contaminant_periods(*task, manifest=manifest)
+
+
+async def main():
+    download_scheduler = DownloadScheduler()
+    manifest = DownloadManifest()
+    queue = asyncio.Queue()
+    counts = {"successful": 0, "failed": 0, "succeeded_keys": []}
+    downloader = asyncio.create_task(
+        daemon.download(
+            download_scheduler,
+            partial(process_task, manifest=manifest),
+            queue,
+            manifest,
+            DeadLetterQueue(),
+            counts,
+        )
+    )
+    filters = {"contaminants": None, "stations": None}
+    try:
+        with StationCatalog() as catalog:
+            tasks = await daemon.poll(
+                catalog,
+                download_scheduler,
+                queue,
+                manifest,
+                {"RM": daemon.mapaRegionUrls["RM"]},
+                ["diario"],
+                filters,
+            )
+        await queue.put(None)
+        await downloader
+    finally:
+        download_scheduler.close()
+        manifest.flush()
+    return tasks
+
+
+tasks = asyncio.run(main())
+print(json.dumps([[task[2]["key"], task[3], task[4]["to_date"]] for task in tasks]))
+"""
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(sinca_server, "TO_DATE", sinca_server.TO_DATE)
+    server = sinca_server.start_server(0, 2, ["PM10", "PM25"])
+    yield server
+    server.shutdown()
+
+
+def run_poll(server, work_dir, *failing):
+    env = dict(
+        os.environ,
+        SINCA_HOST=f"http://127.0.0.1:{server.server_port}",
+        PYTHONPATH=REPO_DIR,
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", POLL, *failing],
+        cwd=work_dir,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+        timeout=120,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def test_poll_queues_the_pairs_whose_dates_moved(server, tmp_path):
+    assert len(run_poll(server, tmp_path)) == 4
+    assert run_poll(server, tmp_path) == []
+
+    # The region page is still in the HTTP cache, well within its TTL
+    sinca_server.TO_DATE = "260101"
+    queued = run_poll(server, tmp_path)
+    assert len(queued) == 4
+    assert {to_date for _, _, to_date in queued} == {"260101"}
+
+
+def test_poll_retries_failed_downloads_until_they_succeed(server, tmp_path):
+    assert len(run_poll(server, tmp_path, "PM25")) == 4
+
+    # Their dates didn't move, but the PM25 pairs have no file yet
+    queued = run_poll(server, tmp_path, "PM25")
+    assert sorted(contaminant for _, contaminant, _ in queued) == ["PM25", "PM25"]
+    assert len(run_poll(server, tmp_path)) == 2
+    assert run_poll(server, tmp_path) == []
@@ -0,0 +1,102 @@
+import json
+import shutil
+import subprocess
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from common.download_capture import ExportTooLargeError, capture_exports
+
+pytestmark = pytest.mark.skipif(
+    shutil.which("node") is None, reason="runs the fetch script with Node.js"
+)
+
+# Node.js has fetch and Blob but no FileReader
+FILE_READER = """
+globalThis.FileReader = class {
+    readAsDataURL(blob) {
+        blob.arrayBuffer().then((buffer) => {
+            this.result = "data:;base64," + Buffer.from(buffer).toString("base64");
+            this.onload();
+        });
+    }
+};
+"""
+
+
+class NodeDriver:
+    """Stand-in WebDriver running async scripts with Node.js"""
+
+    def set_script_timeout(self, timeout):
+        self.timeout = timeout
+
+    def execute_async_script(self, script, *args):
+        arguments = json.dumps([*args])
+        code = (
+            FILE_READER
+            + f"(function () {{ const arguments = [...{arguments}, "
+            + "(result) => console.log(JSON.stringify(result))];\n"
+            + script
+            + "})();"
+        )
+        output = subprocess.run(
+            ["node", "-e", code],
+            capture_output=True,
+            text=True,
+            check=True,
+            timeout=self.timeout,
+        )
+        return json.loads(output.stdout)
+
+
+class ExportHandler(BaseHTTPRequestHandler):
+    body = b"FECHA (YYMMDD);HORA (HHMM);Registros validados\r\n" * 100
+    in_flight = 0
+    most_in_flight = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.most_in_flight = max(cls.most_in_flight, cls.in_flight)
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv")
+            if self.path != "/chunked":
+                self.send_header("Content-Length", str(len(self.body)))
+            self.end_headers()
+            self.wfile.write(self.body)
+        finally:
+            with cls.lock:
+                cls.in_flight -= 1
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def host():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ExportHandler)
+    server.daemon_threads = True
+    # Without Content-Length the body ends when the connection closes
+    ExportHandler.protocol_version = "HTTP/1.0"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_exports_are_fetched_one_at_a_time(host):
+    ExportHandler.most_in_flight = 0
+    urls = [f"{host}/export/{i}" for i in range(4)]
+    assert capture_exports(NodeDriver(), urls) == [ExportHandler.body] * 4
+    assert ExportHandler.most_in_flight == 1
+
+
+@pytest.mark.parametrize("path", ["/export", "/chunked"])
+def test_exports_over_the_cap_are_not_captured(host, path):
+    size = len(ExportHandler.body)
+    with pytest.raises(ExportTooLargeError) as error:
+        capture_exports(NodeDriver(), [host + path], max_bytes=size // 2)
+    assert error.value.size > size // 2
@@ -0,0 +1,59 @@
+from download_csv import merge_csv_series, plan_download
+
+
+def make_entry(tmp_path, from_date="200101", to_date="230630"):
+    csv_path = tmp_path / "series.csv"
+    csv_path.write_bytes(b"FECHA;HORA;valor\n")
+    return {
+        "path": str(csv_path),
+        "size": csv_path.stat().st_size,
+        "from_date": from_date,
+        "to_date": to_date,
+    }
+
+
+def test_plan_download(tmp_path):
+    entry = make_entry(tmp_path)
+    current = {"from_date": "200101", "to_date": "230630"}
+    extended = {"from_date": "200101", "to_date": "240315"}
+
+    assert plan_download(None, current, "diario") == ("full", None)
+    assert plan_download(entry, current, "diario") == ("skip", None)
+    assert plan_download(entry, extended, "diario") == ("delta", "230630")
+    # Averaging periods restart at their quarter or year
+    assert plan_download(entry, extended, "trimestral") == ("delta", "230401")
+    assert plan_download(entry, extended, "anual") == ("delta", "230101")
+    # A moved start or a shorter range can't be extended
+    assert plan_download(entry, {**extended, "from_date": "190101"}, "diario") == (
+        "full",
+        None,
+    )
+    assert plan_download(entry, {**current, "to_date": "221231"}, "diario") == (
+        "full",
+        None,
+    )
+
+
+def test_plan_download_refetches_changed_files(tmp_path):
+    entry = make_entry(tmp_path)
+    (tmp_path / "series.csv").write_bytes(b"truncated")
+    current = {"from_date": "200101", "to_date": "230630"}
+    assert plan_download(entry, current, "diario") == ("full", None)
+
+
+def test_merge_csv_series(tmp_path):
+    existing = tmp_path / "existing.csv"
+    delta = tmp_path / "delta.csv"
+    dest = tmp_path / "dest.csv"
+    existing.write_bytes(
+        b"FECHA;HORA;valor\n991231;0000;1\n230101;0000;2\n230102;0000;3\n"
+    )
+    delta.write_bytes(b"FECHA;HORA;valor\n230102;0000;4\n230103;0000;5\n")
+
+    assert merge_csv_series(str(existing), str(delta), str(dest)) == str(dest)
+    # 99 sorts before 23 with the two-digit year pivot
+    assert dest.read_bytes() == (
+        b"FECHA;HORA;valor\n991231;0000;1\n230101;0000;2\n230102;0000;4\n"
+        b"230103;0000;5\n"
+    )
+    assert not existing.exists() and not delta.exists()
@@ -0,0 +1,58 @@
+import os
+
+import requests
+
+from common.http_cache import HttpCache
+
+
+class FakeSession:
+    """Session answering every URL with a body of the given size"""
+
+    def __init__(self, size):
+        self.size = size
+        self.requests = 0
+
+    def get(self, url, headers=None, timeout=None):
+        self.requests += 1
+        response = requests.Response()
+        response.status_code = 200
+        response._content = b"x" * self.size
+        response.encoding = "utf-8"
+        response.url = url
+        return response
+
+
+def get_body_sizes(cache_dir):
+    return [
+        entry.stat().st_size
+        for entry in os.scandir(cache_dir)
+        if entry.name.endswith(".body")
+    ]
+
+
+def test_fresh_pages_are_served_without_requests(tmp_path):
+    cache = HttpCache(str(tmp_path), max_bytes=1000)
+    session = FakeSession(10)
+    assert cache.get_text(session, "http://a/1", "region") == "x" * 10
+    assert cache.get_text(session, "http://a/1", "region") == "x" * 10
+    assert session.requests == 1
+
+    cache.get_text(session, "http://a/1", "region", revalidate=True)
+    assert session.requests == 2
+
+
+def test_cache_is_scanned_only_when_it_outgrows_max_bytes(tmp_path, monkeypatch):
+    cache = HttpCache(str(tmp_path), max_bytes=250)
+    session = FakeSession(100)
+    scans = []
+    evict = cache._evict
+    monkeypatch.setattr(cache, "_evict", lambda: scans.append(1) or evict())
+
+    cache.get_text(session, "http://a/1", "graph")  # First store counts the cache
+    cache.get_text(session, "http://a/2", "graph")
+    assert len(scans) == 1
+    assert cache._size == 200
+
+    cache.get_text(session, "http://a/3", "graph")
+    assert len(scans) == 2
+    assert sum(get_body_sizes(tmp_path)) == cache._size == 200
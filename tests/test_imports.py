@@ -0,0 +1,23 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.mark.parametrize(
+    "module", ["download_csv", "pipeline", "daemon", "queue_worker"]
+)
+def test_import_loads_no_selenium(module):
+    # Run in a fresh interpreter, other tests may have loaded Selenium already
+    code = f"import sys, {module}; print([m for m in sys.modules if 'selenium' in m])"
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=REPO_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert output.strip() == "[]"
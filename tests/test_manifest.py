@@ -0,0 +1,30 @@
+import json
+
+from common import manifest as manifest_module
+from common.manifest import DownloadManifest
+
+
+def test_records_are_saved_on_flush(tmp_path):
+    path = tmp_path / "manifest.json"
+    csv_path = tmp_path / "series.csv"
+    csv_path.write_bytes(b"FECHA;valor\r\n")
+
+    manifest = DownloadManifest(str(path))
+    entry = manifest.record(
+        "RM|A|PM10|diario", str(csv_path), {"to_date": "250101"}, "diario"
+    )
+    assert not path.exists()
+
+    manifest.flush()
+    assert json.loads(path.read_text()) == {"RM|A|PM10|diario": entry}
+    assert DownloadManifest(str(path)).get("RM|A|PM10|diario") == entry
+
+
+def test_records_are_saved_every_interval(tmp_path, monkeypatch):
+    monkeypatch.setattr(manifest_module, "MANIFEST_SAVE_INTERVAL", 0)
+    path = tmp_path / "manifest.json"
+    csv_path = tmp_path / "series.csv"
+    csv_path.write_bytes(b"FECHA;valor\r\n")
+
+    DownloadManifest(str(path)).record("key", str(csv_path), {}, "diario")
+    assert "key" in json.loads(path.read_text())
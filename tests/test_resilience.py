@@ -0,0 +1,102 @@
+import asyncio
+
+import requests
+
+from common.resilience import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    DeadLetterQueue,
+    RetryableError,
+    RetryPolicy,
+)
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status} error", response=response)
+
+
+def test_retry_policy_classification():
+    policy = RetryPolicy(max_attempts=3, base_delay=0.5, max_delay=2)
+
+    assert policy.is_retryable(http_error(503))
+    assert policy.is_retryable(http_error(429))
+    assert not policy.is_retryable(http_error(404))
+    assert policy.is_retryable(requests.ConnectionError())
+    assert policy.is_retryable(OSError())
+    assert policy.is_retryable(RetryableError())
+    assert not policy.is_retryable(ValueError())
+
+    assert policy.should_retry(http_error(503), 2)
+    assert not policy.should_retry(http_error(503), 3)
+    assert 0 <= policy.get_delay(5) <= 2
+
+
+def test_circuit_breaker_opens_probes_and_closes():
+    async def main():
+        breaker = CircuitBreaker(
+            "test", window=4, min_calls=4, error_rate=0.5, open_duration=0.05
+        )
+        states = []
+        for ok in (True, False, True, False):
+            assert not await breaker.wait()
+            await breaker.record(ok)
+        states.append(breaker.state)
+
+        # The first task after the pause is the probe, the others wait for it
+        probe = await asyncio.wait_for(breaker.wait(), 1)
+        states.append(breaker.state)
+        waiting = asyncio.create_task(breaker.wait())
+        await asyncio.sleep(0.01)
+        assert probe and not waiting.done()
+
+        # A failed probe doubles the pause
+        await breaker.record(False, probe=True)
+        states.append(breaker.state)
+        assert breaker.open_duration == 0.1
+
+        assert await asyncio.wait_for(waiting, 1)
+        await breaker.record(True, probe=True)
+        states.append(breaker.state)
+        assert breaker.open_duration == 0.05
+        assert not await breaker.wait()
+        return states
+
+    assert asyncio.run(main()) == [OPEN, HALF_OPEN, OPEN, CLOSED]
+
+
+def test_circuit_breaker_needs_min_calls():
+    async def main():
+        breaker = CircuitBreaker("test", window=10, min_calls=3, error_rate=0.5)
+        await breaker.record(False)
+        await breaker.record(False)
+        return breaker.state
+
+    assert asyncio.run(main()) == CLOSED
+
+
+def test_dead_letter_queue(tmp_path):
+    path = tmp_path / "dead_letters.jsonl"
+    queue = DeadLetterQueue(str(path))
+    assert queue.load() == {}
+    assert queue.remove(["a"]) == 0
+
+    queue.add("a", {"url": "a"}, ValueError("first"))
+    queue.add("b", {"url": "b"}, http_error(404))
+    queue.add("a", {"url": "a"}, ValueError("second"))
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"key": "c", "task"')
+
+    records = queue.load()
+    assert set(records) == {"a", "b"}
+    assert records["a"]["error"] == "second"
+    assert records["b"]["error_type"] == "HTTPError"
+    assert records["b"]["task"] == {"url": "b"}
+
+    # The line cut short is dropped along with the records of a
+    assert queue.remove(["a"]) == 3
+    assert set(queue.load()) == {"b"}
+    assert path.read_text().count("\n") == 1
@@ -0,0 +1,84 @@
+import asyncio
+import time
+
+import pytest
+
+from common import scheduler
+from common.scheduler import DownloadScheduler, mark_cached, mark_fetched
+
+HOST = "sinca.mma.gob.cl"
+
+
+@pytest.fixture(autouse=True)
+def unlimited_rate(monkeypatch):
+    monkeypatch.setattr(scheduler, "REQUESTS_PER_SECOND", 1e6)
+    monkeypatch.setattr(scheduler, "RATE_BURST", 1e6)
+
+
+def skip(delay):
+    """Task answered from the manifest"""
+    time.sleep(delay)
+    mark_cached()
+    return "skipped"
+
+
+def download(delay):
+    """Task fetching from the server"""
+    mark_fetched()
+    time.sleep(delay)
+    return "downloaded"
+
+
+def partly_cached(delay):
+    """Task with one period skipped and one fetched"""
+    mark_cached()
+    return download(delay)
+
+
+async def run_all(download_scheduler, func, delay, count):
+    return await asyncio.gather(
+        *(download_scheduler.run(func, delay, host=HOST) for _ in range(count))
+    )
+
+
+def test_cached_tasks_are_not_latency_samples():
+    async def main():
+        download_scheduler = DownloadScheduler()
+        try:
+            results = await run_all(download_scheduler, skip, 0.002, 50)
+        finally:
+            download_scheduler.close()
+        return results, download_scheduler._host_limiter(HOST)
+
+    results, limiter = asyncio.run(main())
+    assert results == ["skipped"] * 50
+    assert limiter.recent_latency is None
+    assert limiter.in_flight == 0
+
+
+def test_tasks_with_a_fetch_are_latency_samples():
+    async def main():
+        download_scheduler = DownloadScheduler()
+        try:
+            await run_all(download_scheduler, partly_cached, 0.01, 5)
+        finally:
+            download_scheduler.close()
+        return download_scheduler._host_limiter(HOST)
+
+    limiter = asyncio.run(main())
+    assert limiter.recent_latency >= 0.01
+
+
+def test_limit_holds_when_downloads_follow_skips():
+    # Skips used to drag the baseline latency down to milliseconds, so the
+    # downloads after them looked congested and the limit collapsed to 1
+    async def main():
+        download_scheduler = DownloadScheduler()
+        try:
+            await run_all(download_scheduler, skip, 0.002, 300)
+            await run_all(download_scheduler, download, 0.1, 200)
+        finally:
+            download_scheduler.close()
+        return download_scheduler.get_host_limits()[HOST]
+
+    assert asyncio.run(main()) >= scheduler.INITIAL_HOST_CONCURRENCY
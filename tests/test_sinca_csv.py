@@ -0,0 +1,83 @@
+import numpy as np
+
+from common.sinca_csv import (
+    FLAG_MISSING,
+    FLAG_PRELIMINARY,
+    FLAG_UNVALIDATED,
+    FLAG_VALIDATED,
+    parse_sinca_csv,
+)
+
+HEADER = (
+    b"FECHA (YYMMDD);HORA (HHMM);Registros validados;Registros preliminares;"
+    b"Registros no validados;\r\n"
+)
+
+
+def write_csv(tmp_path, content):
+    path = tmp_path / "export.csv"
+    path.write_bytes(content)
+    return str(path)
+
+
+def test_parses_decimal_commas_and_empty_fields(tmp_path):
+    path = write_csv(
+        tmp_path,
+        HEADER
+        + b"230101;0000;12,5;;;\r\n"
+        + b"230101;0100;;7,25;;\r\n"
+        + b"230101;0200;;;3;\r\n"
+        + b"230101;0300;;;;\r\n",
+    )
+    series = parse_sinca_csv(path)
+
+    assert series.timestamps.tolist() == [
+        np.datetime64("2023-01-01T00:00:00"),
+        np.datetime64("2023-01-01T01:00:00"),
+        np.datetime64("2023-01-01T02:00:00"),
+        np.datetime64("2023-01-01T03:00:00"),
+    ]
+    np.testing.assert_array_equal(series.values, [12.5, 7.25, 3.0, np.nan])
+    assert series.flags.tolist() == [
+        FLAG_VALIDATED,
+        FLAG_PRELIMINARY,
+        FLAG_UNVALIDATED,
+        FLAG_MISSING,
+    ]
+
+
+def test_validated_values_win_over_the_other_columns(tmp_path):
+    path = write_csv(tmp_path, HEADER + b"230101;0000;1;2;3;\r\n230101;0100;;2;3;\r\n")
+    series = parse_sinca_csv(path)
+
+    assert series.values.tolist() == [1.0, 2.0]
+    assert series.flags.tolist() == [FLAG_VALIDATED, FLAG_PRELIMINARY]
+
+
+def test_two_digit_years_follow_the_strptime_pivot(tmp_path):
+    path = write_csv(
+        tmp_path, HEADER + b"681231;2300;1;;;\r\n690101;0000;2;;;\r\n991231;;3;;;\r\n"
+    )
+    series = parse_sinca_csv(path)
+
+    assert series.timestamps.tolist() == [
+        np.datetime64("2068-12-31T23:00:00"),
+        np.datetime64("1969-01-01T00:00:00"),
+        np.datetime64("1999-12-31T00:00:00"),
+    ]
+
+
+def test_chunks_split_mid_line(tmp_path):
+    rows = b"".join(b"230101;%02d00;%d,5;;;\r\n" % (hour, hour) for hour in range(24))
+    path = write_csv(tmp_path, HEADER + rows)
+
+    whole = parse_sinca_csv(path)
+    chunked = parse_sinca_csv(path, chunk_size=17)
+    for whole_array, chunked_array in zip(whole, chunked):
+        np.testing.assert_array_equal(whole_array, chunked_array)
+    assert len(chunked.values) == 24
+
+
+def test_empty_export(tmp_path):
+    series = parse_sinca_csv(write_csv(tmp_path, HEADER))
+    assert len(series.timestamps) == len(series.values) == len(series.flags) == 0
@@ -0,0 +1,64 @@
+import time
+
+import pytest
+
+from common.task_queue import TaskQueue
+
+
+@pytest.fixture
+def queue(tmp_path):
+    with TaskQueue(str(tmp_path / "queue.db"), visibility_timeout=0.2) as queue:
+        yield queue
+
+
+def test_enqueue_skips_unchanged_tasks(queue):
+    assert queue.enqueue([("a", ["R13", "to", "250101"])]) == 1
+    assert queue.enqueue([("a", ["R13", "to", "250101"])]) == 0
+    assert queue.get_counts()["pending"] == 1
+
+
+@pytest.mark.parametrize("finish", ["complete", "fail"])
+def test_enqueue_requeues_finished_tasks_with_a_new_payload(queue, finish):
+    queue.enqueue([("a", ["R13", "to", "250101"])])
+    ((task_id, _),) = queue.lease("w1")
+    if finish == "complete":
+        queue.complete("w1", task_id, "a.csv")
+    else:
+        queue.fail("w1", task_id, "Download failed", retry=False)
+
+    assert queue.enqueue([("a", ["R13", "to", "250101"])]) == 0
+    assert queue.enqueue([("a", ["R13", "to", "260101"])]) == 1
+    assert queue.get_counts() == {"pending": 1, "leased": 0, "done": 0, "failed": 0}
+    assert queue.lease("w1") == [(task_id, ["R13", "to", "260101"])]
+
+
+def test_enqueue_keeps_leased_tasks(queue):
+    queue.enqueue([("a", ["R13", "to", "250101"])])
+    ((task_id, _),) = queue.lease("w1")
+
+    assert queue.enqueue([("a", ["R13", "to", "260101"])]) == 0
+    assert queue.complete("w1", task_id)
+
+
+def test_expired_leases_move_to_another_worker(queue):
+    queue.enqueue([("a", ["R13"])])
+    ((task_id, _),) = queue.lease("w1")
+    assert queue.lease("w2") == []
+
+    time.sleep(0.3)
+    assert queue.lease("w2") == [(task_id, ["R13"])]
+    # The first worker lost its lease and can't report an outcome any more
+    assert queue.heartbeat("w1", [task_id]) == set()
+    assert not queue.complete("w1", task_id)
+    assert queue.complete("w2", task_id)
+    assert queue.is_drained()
+
+
+def test_heartbeats_keep_leases(queue):
+    queue.enqueue([("a", ["R13"])])
+    ((task_id, _),) = queue.lease("w1")
+
+    for _ in range(3):
+        time.sleep(0.1)
+        assert queue.heartbeat("w1", [task_id]) == {task_id}
+    assert queue.lease("w2") == []